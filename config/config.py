@@ -14,10 +14,20 @@ if os.path.isfile(env_file):
 
 indexes_dir = f'{base_dir}/indexes/'
 
+def parse_bytes(text):
+    """Number of bytes in e.g. '512M' or '16G'"""
+    text = str(text).strip().upper()
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text or 0)
+
 use_faiss_indexes = bool(int(os.environ.get('USE_FAISS_INDEXES')))
 use_annoy_indexes = bool(int(os.environ.get('USE_ANNOY_INDEXES')))
 use_usearch_indexes = bool(int(os.environ.get('USE_USEARCH_INDEXES')))
 load_usearch_indexes_in_memory = bool(int(os.environ.get('LOAD_USEARCH_INDEXES_IN_MEMORY')))
+flat_index_limit = int(os.environ.get('FLAT_INDEX_LIMIT', 0))  # vectors; 0: never
+index_cache_budget = parse_bytes(os.environ.get('INDEX_CACHE_BUDGET', '0'))  # 0: unbounded
 
 if not (use_faiss_indexes or use_annoy_indexes or use_usearch_indexes):
     print('Bad config! At least one index type must be activated.')
@@ -49,3 +59,6 @@ if allow_incoming_extension_requests:
 token_authentication_active = bool(int(os.environ['TOKEN_AUTHENTICATION']))
 
 year_wise_indexes = bool(int(os.environ['YEAR_WISE_INDEXES']))
+
+# evaluate date and country code filters in the vector search service
+pushdown_filters = bool(int(os.environ.get('PUSHDOWN_FILTERS', 0)))
@@ -25,6 +25,7 @@ from core.snippet import SnippetExtractor
 from core.reranking import ConceptMatchRanker
 from core.encoders import default_boe_encoder
 from core.results import SearchResult
+from core.search_params import SearchParams
 from core.encoders import default_embedding_matrix
 from core.datasets import PoC
 import core.remote as remote
@@ -36,6 +37,7 @@ from config.config import (
     reranker_active,
     smart_index_selection_active,
     year_wise_indexes,
+    pushdown_filters,
     allow_outgoing_extension_requests,
     allow_incoming_extension_requests,
     docs_dir
@@ -164,27 +166,66 @@ class SearchRequest(APIRequest):
         if smart_index_selection_active:
             return select_indexes(self._query, 3)
 
-        index_ids = list(available_indexes.available())
+        doc_type = self._data.get('type')
+        if doc_type in ['any', 'auto']:
+            doc_type = None
 
-        if "type" in self._data and (self._data['type'] not in ['any', 'auto']):
-            index_ids = [idx for idx in index_ids if len(idx.split(".")) > 1
-                                                     and idx.split(".")[1] == self._data['type']]
+        years = None
+        if year_wise_indexes and (self._data.get('before') or self._data.get('after')):
+            years = (self._read_year('after'), self._read_year('before'))
 
-        if not year_wise_indexes:
-            return index_ids
+        return list(available_indexes.find(doc_type=doc_type, years=years))
 
-        if not self._data.get('before') and not self._data.get('after'):
-            return index_ids
+    def _read_year(self, field):
+        value = self._data.get(field)
+        if value and re.match(r"^\d{4}", value):
+            return int(value[:4])
+        return None
 
-        if "before" in self._data and re.match(r"\d{4}", self._data['before']):
-            year = int(self._data['before'][:4])
-            index_ids = [idx for idx in index_ids if int(idx.split(".")[0]) <= year]
+    def _get_routing(self):
+        """Constraints that let the vector search service skip indexes which
+        cannot contain matching results, see `IndexInfo.matches`.
+        """
+        routing = {}
+        if self._index_specified_in_request() and re.match(r'^[A-HY]\d{2}[A-Z]?$', self._data['idx']):
+            routing['subclasses'] = [self._data['idx']]
 
-        if "after" in self._data and re.match(r"^\d{4}", self._data['after']):
-            year = int(self._data['after'][:4])
-            index_ids = [idx for idx in index_ids if int(idx.split(".")[0]) >= year]
+        if not year_wise_indexes:
+            return routing
 
-        return index_ids
+        after, before = self._read_year('after'), self._read_year('before')
+        if after or before:
+            routing['years'] = [after, before]
+        return routing
+
+    def _get_filter_spec(self):
+        """Date and country code filters in the form the vector search
+        service evaluates them in, see `core.metadata.Predicate`. The same
+        filters are still applied to the results it returns, since indexes
+        without metadata columns are searched unfiltered.
+        """
+        if not pushdown_filters:
+            return None
+        spec = {}
+        after, before = self._data.get('after'), self._data.get('before')
+        if after or before:
+            dtype = self._data.get('dtype', 'publication')
+            spec[dtype] = [after or None, before or None]
+        cc = self._data.get('cc')
+        if cc:
+            spec['cc'] = re.findall(r'\b[A-Z]{2}\b', cc.upper())
+        return spec or None
+
+    def _get_search_params(self):
+        """Recall/latency knobs of the vector search for the `preset` of
+        the route (see `routes.py`) or of the request, if any."""
+        preset = self._data.get('preset')
+        if not preset:
+            return None
+        try:
+            return SearchParams.from_preset(preset).to_dict()
+        except ValueError as e:
+            raise BadRequestError(str(e))
 
     def _index_specified_in_request(self):
         req_data = self._data
@@ -298,27 +339,43 @@ class SearchRequest102(SearchRequest):
         results = []
         n = min(self._n_results, self.MAX_RES_LIMIT)
         m = max(25, n)
-        while len(results) < n and m <= 2*self.MAX_RES_LIMIT:
-            payload = {
-                "vector": qvec.tolist(),
-                "n_results": m,
-                "type": self._doctype
-            }
-
-            # Run a vector search
-            results = vector_search_srv.send(payload)
-            results = [t for t in results if t[2] > self.MIN_SIMILARITY_THRESHOLD]
-            results = self._deduplicate_by_score(results)
-            results = self._filters.apply(results, m)
-
-            if not results:
+        payload = {
+            "vector": qvec,
+            "n_results": m,
+            "type": self._doctype,
+            "routing": self._get_routing(),
+            "min_similarity": self.MIN_SIMILARITY_THRESHOLD,
+            "filters": self._get_filter_spec(),
+            "params": self._get_search_params(),
+            "cursor": True
+        }
+
+        # Run a vector search; when filters reject too many results, the
+        # cursor gives the next candidates without redoing the earlier work
+        batch = vector_search_srv.send(payload)
+        fetched, last = m, None
+        while True:
+            candidates = batch.above(self.MIN_SIMILARITY_THRESHOLD).triplets()
+            candidates = self._deduplicate_by_score(candidates)
+            candidates = self._after_last(last, candidates, results)
+            if not candidates:
                 break
-            
+            last = candidates[-1]
+            results += self._filters.apply(candidates, n - len(results))
+
+            if len(results) >= n or batch.done or fetched >= 2*self.MAX_RES_LIMIT:
+                break
+
             # Avoid looking for more results if the last one is a poor match
-            if results[-1][2] <= self.MIN_SIMILARITY_THRESHOLD + 0.01:
+            if last[2] <= self.MIN_SIMILARITY_THRESHOLD + 0.01:
                 break
 
-            m *= 2
+            batch = vector_search_srv.send_next(batch.cursor, fetched)
+            fetched *= 2
+
+        if not batch.done:
+            vector_search_srv.close_cursor(batch.cursor)
+
         results = [SearchResult(*t) for t in results]
         results = self._deduplicate(results)
         return results[:n]
@@ -361,6 +418,22 @@ class SearchRequest102(SearchRequest):
         ranks = reranker.rank(self._query, result_texts)
         return [results[i] for i in ranks]
 
+    def _after_last(self, last, candidates, results):
+        """Deduplicate the candidates of a new batch against `last`, the last
+        candidate of the previous batch: a family member of `last` (same
+        score) is dropped, unless it is the preferred one, in which case it
+        replaces `last`, also in `results` if `last` passed the filters."""
+        if last is None or not candidates:
+            return candidates
+        kept = self._deduplicate_by_score([last, candidates[0]])
+        if len(kept) == 2:
+            return candidates
+        if kept[0] is last:
+            return candidates[1:]
+        if results and results[-1] is last:
+            results.pop()
+        return candidates
+
     def _deduplicate_by_score(self, triplets):
         if not triplets:
             return triplets
@@ -0,0 +1,287 @@
+"""
+Resumable building of vector indexes from a stream of documents
+
+Documents come in batches from a source (e.g. a Mongo collection, see
+`scripts/mongo2index.py`). Their texts are embedded in a pool of workers,
+and the vectors are written to memory mapped chunks in a work directory. A
+checkpoint (`state.json`) is saved after every chunk, so an interrupted
+build resumes after the last complete chunk instead of starting over. Once
+all documents are embedded, the chunks are indexed into usearch, FAISS
+and/or Annoy indexes that share a labels file, and the indexes are recorded
+in the manifest of the output folder.
+
+A source is a function of the resume token of the last checkpointed batch
+(None at first) that yields batches of `(token, label, text)` tuples, in
+the order of their tokens, which must be JSON serializable.
+"""
+
+import os
+import json
+import shutil
+import inspect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tqdm import tqdm
+
+from core import manifest
+from core.labels import LABELS_EXT, write_labels
+
+STATE_FILE = 'state.json'
+BACKEND_EXTS = {'usearch': '.usearch', 'faiss': '.faiss', 'annoy': '.ann'}
+VECTORS_EXT = '.vectors.npy'    # float32 vectors of a quantized usearch index, see core/indexes.py
+FULL_PRECISION = ['f32', 'f64']
+
+
+class IndexBuilder():
+
+    def __init__(self, index_id, out_dir, settings=None, chunk_size=100000, work_dir=None):
+        """`settings` describe what is indexed (e.g. the Mongo query); a
+        build is only resumed with the settings it was started with."""
+        self._id = index_id
+        self._out_dir = out_dir
+        self._work_dir = work_dir or f'{out_dir}/{index_id}.build'
+        self._chunk_size = chunk_size
+        self._settings = settings or {}
+        self._state = None
+
+    def start(self, restart=False):
+        if restart and os.path.exists(self._work_dir):
+            shutil.rmtree(self._work_dir)
+        os.makedirs(self._work_dir, exist_ok=True)
+        state = self._read_state()
+        if state is None:
+            state = {'settings': self._settings, 'token': None, 'dims': None,
+                     'count': 0, 'chunks': [], 'streamed': False, 'built': []}
+        elif state['settings'] != self._settings:
+            raise ValueError(f'{self._work_dir} holds a build with other settings; '
+                             'restart it or use another work dir')
+        self._state = state
+        return self
+
+    def embed(self, source, encode_fn, workers=4):
+        """Embed the documents of `source` with `encode_fn` (a list of texts
+        to an array of vectors) and write them to chunks, from the last
+        checkpoint on."""
+        if self._state['streamed']:
+            return
+        writer = None
+        batches = source(self._state['token'])
+        try:
+            with tqdm(initial=self._state['count'], unit=' docs', desc=self._id) as progress:
+                for batch, vectors in _embed_batches(batches, encode_fn, workers):
+                    if writer is None:
+                        self._state['dims'] = self._state['dims'] or vectors.shape[1]
+                        writer = ChunkWriter(self._work_dir, self._state, self._chunk_size,
+                                             self._save_state)
+                    writer.add(batch, vectors)
+                    progress.update(len(batch))
+        except Exception:
+            if writer is not None:
+                writer.close()     # checkpoint what was embedded
+            raise
+        if writer is not None:
+            writer.close()
+        self._state['streamed'] = True
+        self._save_state()
+
+    def build(self, backends, **options):
+        """Index the embedded vectors with each of the `backends`; options
+        are the keyword arguments of the `build_<backend>` functions."""
+        if not self._state['count']:
+            raise ValueError(f'No documents were embedded for {self._id}')
+        labels_file = f'{self._out_dir}/{self._id}{LABELS_EXT}'
+        if not self._state['built']:
+            write_labels(labels_file, self.labels())
+        for backend in backends:
+            if backend in self._state['built']:
+                continue
+            build_fn = BUILD_FNS[backend]
+            index_file = f'{self._out_dir}/{self._id}{BACKEND_EXTS[backend]}'
+            accepted = inspect.signature(build_fn).parameters
+            kwargs = {k: v for k, v in options.items() if k in accepted}
+            build_fn(f'{index_file}.tmp', self.chunks(), self._state['dims'],
+                     self._state['count'], **kwargs)
+            if backend == 'usearch' and kwargs.get('dtype', 'f32') not in FULL_PRECISION:
+                self._write_vectors(f'{self._out_dir}/{self._id}{VECTORS_EXT}')
+            os.replace(f'{index_file}.tmp', index_file)
+            manifest.record(index_file, labels_file, self._state['dims'], self._state['count'])
+            self._state['built'].append(backend)
+            self._save_state()
+
+    def _write_vectors(self, path):
+        """The float32 vectors of a quantized index, by key, with which its
+        search results are rescored"""
+        shape = (self._state['count'], self._state['dims'])
+        X = np.lib.format.open_memmap(f'{path}.tmp', mode='w+', dtype='<f4', shape=shape)
+        start = 0
+        for chunk in self.chunks():
+            X[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        X.flush()
+        del X
+        os.replace(f'{path}.tmp', path)
+
+    def finish(self, keep_work_dir=False):
+        if not keep_work_dir:
+            shutil.rmtree(self._work_dir)
+
+    def chunks(self):
+        """Memory maps of the vectors of each chunk, in order"""
+        for chunk in self._state['chunks']:
+            X = np.load(f'{self._work_dir}/{chunk["vectors"]}', mmap_mode='r')
+            yield X[:chunk['count']]
+
+    def labels(self):
+        labels = []
+        for chunk in self._state['chunks']:
+            with open(f'{self._work_dir}/{chunk["labels"]}') as f:
+                labels += json.load(f)
+        return labels
+
+    def _read_state(self):
+        path = f'{self._work_dir}/{STATE_FILE}'
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_state(self):
+        path = f'{self._work_dir}/{STATE_FILE}'
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self._state, f)
+        os.replace(f'{path}.tmp', path)
+
+    @property
+    def state(self):
+        return self._state
+
+
+class ChunkWriter():
+
+    """Writes vectors to `.npy` chunks of a build's work dir; a chunk is
+    checkpointed once it is full, or when the stream ends."""
+
+    def __init__(self, work_dir, state, chunk_size, save_fn):
+        self._work_dir = work_dir
+        self._state = state
+        self._chunk_size = chunk_size
+        self._save_fn = save_fn
+        self._chunk = None
+        self._name = None
+        self._labels = []
+        self._token = None
+
+    def add(self, batch, vectors):
+        X = np.asarray(vectors, dtype=np.float32)
+        X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+        i = 0
+        while i < len(batch):
+            if self._chunk is None:
+                self._open()
+            n = min(len(batch) - i, len(self._chunk) - len(self._labels))
+            self._chunk[len(self._labels):len(self._labels) + n] = X[i:i+n]
+            self._labels += [label for _, label, _ in batch[i:i+n]]
+            self._token = batch[i + n - 1][0]
+            i += n
+            if len(self._labels) == len(self._chunk):
+                self._checkpoint()
+
+    def close(self):
+        if self._chunk is not None and self._labels:
+            self._checkpoint()
+
+    def _open(self):
+        name = f'chunk-{len(self._state["chunks"]):05d}'
+        path = f'{self._work_dir}/{name}.npy'
+        shape = (self._chunk_size, self._state['dims'])
+        self._chunk = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+        self._name = name
+
+    def _checkpoint(self):
+        self._chunk.flush()
+        with open(f'{self._work_dir}/{self._name}.labels.json', 'w') as f:
+            json.dump(self._labels, f)
+        self._state['chunks'].append({'vectors': f'{self._name}.npy',
+                                      'labels': f'{self._name}.labels.json',
+                                      'count': len(self._labels)})
+        self._state['count'] += len(self._labels)
+        self._state['token'] = self._token
+        self._save_fn()
+        self._chunk = None
+        self._labels = []
+
+
+def _embed_batches(batches, encode_fn, workers):
+    """(batch, vectors) of each batch, in order, embedding up to twice as
+    many batches as there are workers ahead of the consumer. If the source
+    fails (e.g. its cursor times out), the batches it gave are still
+    yielded before the error is raised, so that they are checkpointed."""
+    with ThreadPoolExecutor(workers, thread_name_prefix='embed') as pool:
+        pending = deque()
+        error = None
+        try:
+            for batch in batches:
+                pending.append((batch, pool.submit(encode_fn, [text for _, _, text in batch])))
+                if len(pending) > 2 * workers:
+                    batch, future = pending.popleft()
+                    yield batch, future.result()
+        except Exception as e:
+            error = e
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+        if error is not None:
+            raise error
+
+
+def build_usearch(path, chunks, dims, count, dtype='f32', connectivity=None):
+    import usearch.index
+    kwargs = {'connectivity': connectivity} if connectivity else {}
+    index = usearch.index.Index(ndim=dims, metric='cos', dtype=dtype, **kwargs)
+    start = 0
+    for X in tqdm(chunks, desc='usearch'):
+        index.add(np.arange(start, start + len(X)), np.asarray(X))
+        start += len(X)
+    index.save(path)
+
+
+def build_faiss(path, chunks, dims, count, factory='OPQ16_64,HNSW32', train_size=100000):
+    """FAISS index of the normalized vectors (the factory string of
+    `FaissIndex`), trained on a random sample of them"""
+    import faiss
+    chunks = list(chunks)
+    index = faiss.index_factory(dims, factory)
+    if not index.is_trained:
+        index.train(_sample(chunks, count, train_size))
+    for X in tqdm(chunks, desc='faiss'):
+        index.add(np.ascontiguousarray(X))
+    faiss.write_index(index, path)
+
+
+def build_annoy(path, chunks, dims, count, trees=64):
+    """Annoy index built on disk, so that the vectors are not all held in
+    memory as they are added"""
+    import annoy
+    index = annoy.AnnoyIndex(dims, 'angular')
+    index.on_disk_build(path)
+    i = 0
+    for X in tqdm(chunks, desc='annoy'):
+        for x in X:
+            index.add_item(i, x)
+            i += 1
+    index.build(trees)
+    index.unload()
+
+
+def _sample(chunks, count, size, seed=0):
+    rows = np.sort(np.random.default_rng(seed).choice(count, min(size, count), replace=False))
+    sample, start = [], 0
+    for X in chunks:
+        mine = rows[(rows >= start) & (rows < start + len(X))] - start
+        sample.append(np.asarray(X[mine]))
+        start += len(X)
+    return np.concatenate(sample)
+
+
+BUILD_FNS = {'usearch': build_usearch, 'faiss': build_faiss, 'annoy': build_annoy}
@@ -6,7 +6,7 @@ from math import ceil
 from os import path
 import json
 
-#from config.config import INDEX_DIR
+from config.config import indexes_dir as INDEX_DIR
 
 
 class Indexer():
@@ -62,7 +62,7 @@ class Indexer():
                 Index: The Index object corresponding to the given
                     name and index type.
                     """
-            index_type = self._default_index_type
+            index_type = index_type or self._default_index_type
             if self._in_cache(index_id, index_type):
                 return self._get_index_from_cache(index_id, index_type)
             else:
@@ -134,20 +134,20 @@ class Indexer():
 
             # Cache for later use
             if self._cache_enabled:
-                self._add_to_cache(index_id, index_type, index)
+                self._add_index_to_cache(index_id, index_type, index)
 
-                return index
+            return index
 
-    #__instance = __impl(distilbert_model_path)
+    __instance = __impl()
 
-        def __getattr__(self, attr):
-            return getattr(self.__instance, attr)
+    def __getattr__(self, attr):
+        return getattr(self.__instance, attr)
 
-        def __setattr__(self, attr, value):
-            return setattr(self.__instance, attr, value)
+    def __setattr__(self, attr, value):
+        return setattr(self.__instance, attr, value)
 
-            def __getitem__(self, key):
-                return self.__instance.__getitem__(key)
+    def __getitem__(self, key):
+        return self.__instance.__getitem__(key)
 
 class IndexAnnoy():
 
@@ -304,13 +304,13 @@ class IndexFaiss():
             vectors (nd array): vectors to create index
             labels (None, optional): Labels for the vectors
         """
+        vectors = self._normalize(vectors)
         self._n_dims = vectors[0].shape[0]
-        if len(labels)!=0:
-            self._labels = list(range(len(vectors)))
-
+        self._labels = []
         self._build_index(vectors)
         self._write_labels_file()
         self._write_index_file()
+        self.add_vectors(vectors, labels)
 
     def _build_index(self, vectors):
         """Build index structure.
@@ -318,7 +318,6 @@ class IndexFaiss():
         Args:
             vectors (nd array): vectors to create index
         """
-        faiss.normalize_L2(vectors)
         quantiser = faiss.IndexFlatIP(self._n_dims)
         self._index = faiss.IndexIVFFlat(
             quantiser, self._n_dims, self._n_clusters, self._metric)
@@ -335,6 +334,14 @@ class IndexFaiss():
         with open(self._labels_file, 'w') as file:
             file.write(json.dumps(self._labels))
 
+    def _normalize(self, vectors):
+        """Vectors as unit length float32 rows, as the index compares them
+        by inner product.
+        """
+        vectors = np.array(vectors, dtype='float32')
+        faiss.normalize_L2(vectors)
+        return vectors
+
     def add_vectors(self, vectors, labels=None):
         """Add vectors to existing index.
 
@@ -345,24 +352,35 @@ class IndexFaiss():
         Returns:
             True if vectors are added
         """
+        vectors = self._normalize(vectors)
+        existing = list(self.get_labels()) if path.isfile(self._labels_file) else []
+        if labels is None:
+            labels = list(range(len(existing), len(existing) + len(vectors)))
+        if len(labels) != len(vectors):
+            raise ValueError('Vectors must map one-to-one with labels.')
         self._n_vecs = len(vectors)
         self._n_dims = vectors[0].shape[0]
-        ivf = self._distribute_vectors(vectors)
+        ivf = self._distribute_vectors(vectors, offset=len(existing))
         self._merge_index(ivf)
+        self._labels = [l.item() if isinstance(l, np.generic) else l for l in existing]
+        self._labels += list(labels)
+        self._write_labels_file()
         return True
 
-    def _distribute_vectors(self, vectors):
+    def _distribute_vectors(self, vectors, offset=0):
         """Distribute vectors into smaller parts
 
         Args:
             vectors (nd array): vectors to create index
+            offset (int): id of the first vector, i.e., the number of
+                vectors already in the index
 
         Returns:
             ivf (object): Inverted index
         """
         prev_div_factor = self._calculate_prev_div_factor()
         div_factor = self._calculate_div_factor(prev_div_factor)
-        self._create_branch_index(div_factor, vectors)
+        self._create_branch_index(div_factor, vectors, offset)
         return self._create_ivf()
 
     def _calculate_prev_div_factor(self):
@@ -390,17 +408,18 @@ class IndexFaiss():
             file.write(f'{self._div_factor}')
         return div_factor      
 
-    def _create_branch_index(self, div_factor, vectors):
+    def _create_branch_index(self, div_factor, vectors, offset=0):
         """Creating indices of smaller size.
 
         Args:
             div_factor (int): current division factor
+            offset (int): id of the first vector
         """
         for i in range(div_factor):
             index = faiss.read_index(f'{self._folder}/{self._index_id}.Original.index')
             llim = int(i*(self._n_vecs/div_factor))
             ulim = int((i+1)*(self._n_vecs/div_factor))
-            ids = np.arange(llim, ulim)
+            ids = np.arange(llim, ulim) + offset
             index.add_with_ids(vectors[llim:ulim], ids)
             faiss.write_index(index, f'{self._folder}/{self._index_id}{self._div_factor-div_factor+i+1}.index')
 
@@ -446,6 +465,13 @@ class IndexFaiss():
             ivf_vector.push_back(invlists)
         return ivf_vector
 
+    def _read_index(self):
+        """Read the merged index; its inverted lists stay on disk, in the
+        .ivfdata file, which is memory mapped (reading the index itself
+        with IO_FLAG_MMAP crashes searches).
+        """
+        return faiss.read_index(self._index_file)
+
     def get_labels(self):
         """Provide labels for vectors in index.
 
@@ -467,7 +493,7 @@ class IndexFaiss():
         Returns:
             indices (nd array): indices of search result vectors. 
         """
-        index = faiss.read_index(self._index_file, faiss.IO_FLAG_MMAP)
+        index = self._read_index()
         nearest_neighbours = n
         indices = index.search(query_vectors, nearest_neighbours)[1]
         return indices
@@ -482,7 +508,245 @@ class IndexFaiss():
         Returns:
             distances (nd array): distances of each search result from query vectors. 
         """
-        index = faiss.read_index(self._index_file, faiss.IO_FLAG_MMAP)
+        index = self._read_index()
         nearest_neighbours = n
         distances = index.search(query_vectors, nearest_neighbours)[0]
-        return distances
\ No newline at end of file
+        return distances
+
+class Resharder():
+
+    """
+    Merges, splits and re-shards the indexes of a folder into a new set of
+    indexes, partitioned by doc type and optionally by CPC subclass group
+    and year band, and cut to a target number of vectors each.
+    """
+
+    GROUP_LENGTHS = {'section': 1, 'class': 3, 'subclass': 4}
+
+    def __init__(self, folder):
+        """Initialize
+
+        Args:
+            folder (str): Folder of the indexes to re-shard; its manifest
+                (or, if it has none, its index file names) tells their
+                sizes and attributes, see `core/manifest.py`.
+        """
+        from core.manifest import Manifest
+        self._folder = folder[:-1] if folder.endswith('/') else folder
+        self._manifest = Manifest.read(self._folder)
+        if self._manifest is None:
+            raise ValueError(f'{folder} has no manifest; see scripts/build-manifest.py')
+
+    def entries(self, backend='usearch'):
+        """Manifest entries of the indexes of a backend, sorted by id.
+        """
+        return sorted((e for e in self._manifest if e['backend'] == backend),
+                      key=lambda e: e['id'])
+
+    def plan(self, backend='usearch', by=None, years=None, target_size=None):
+        """Plan new shards.
+
+        Args:
+            backend (str): Backend of the indexes to re-shard.
+            by (str, optional): CPC level to partition indexes by: 'section',
+                'class' or 'subclass'; indexes without a subclass are put
+                together.
+            years (int, optional): Width of the year bands to partition
+                indexes by, e.g. 5 for 2000-2004, 2005-2009...; a band is
+                assigned by the first year of an index.
+            target_size (int, optional): Maximum number of vectors of a
+                shard. Indexes of a partition are merged up to it and larger
+                ones split, into shards of even sizes; without it, each
+                partition makes one shard.
+
+        Returns:
+            list: Shards, as dicts with the `id` of the new index, its `parts`
+                (`[source index id, first row, end row]`) and `count`.
+        """
+        partitions = {}
+        for entry in self.entries(backend):
+            if entry.get('count') is None:
+                raise ValueError(f'The manifest has no vector count for {entry["id"]}')
+            key = (entry.get('doc_type'), self._group(entry, by), self._band(entry, years))
+            partitions.setdefault(key, []).append(entry)
+
+        shards, taken = [], set()
+        for key in sorted(partitions, key=str):
+            for shard in self._cut(partitions[key], key, target_size):
+                shard['id'] = self._unique(shard['id'], taken)
+                shards.append(shard)
+        return shards
+
+    def _group(self, entry, by):
+        if not by or not entry.get('subclass'):
+            return None
+        return entry['subclass'][:self.GROUP_LENGTHS[by]]
+
+    def _band(self, entry, years):
+        if not years or not entry.get('years'):
+            return None
+        start = entry['years'][0] // years * years
+        return (start, start + years - 1)
+
+    def _cut(self, entries, key, target_size):
+        """Shards of the indexes of a partition, with rows split evenly.
+        """
+        total = sum(e['count'] for e in entries)
+        n_shards = max(1, ceil(total / target_size)) if target_size else 1
+        size = ceil(total / n_shards)
+        name = self._name(entries, key)
+        shards = []
+        shard = {'parts': [], 'count': 0}
+        for entry in entries:
+            start = 0
+            while start < entry['count']:
+                end = min(entry['count'], start + size - shard['count'])
+                shard['parts'].append([entry['id'], start, end])
+                shard['count'] += end - start
+                start = end
+                if shard['count'] == size:
+                    shards.append(shard)
+                    shard = {'parts': [], 'count': 0}
+        if shard['count']:
+            shards.append(shard)
+        for i, shard in enumerate(shards):
+            shard['id'] = name if len(shards) == 1 else f'{name}.part{i + 1}'
+        return shards
+
+    def _name(self, entries, key):
+        """Name that encodes the attributes common to the indexes of a
+        partition, so that the new index is routed like them.
+        """
+        doc_type, group, band = key
+        tokens = []
+        subclasses = {e.get('subclass') for e in entries}
+        if None not in subclasses and len(subclasses) == 1:
+            tokens.append(subclasses.pop())
+        elif group and len(group) >= 3:
+            tokens.append(group)
+        if all(e.get('years') for e in entries):
+            start = min(e['years'][0] for e in entries)
+            end = max(e['years'][1] for e in entries)
+            tokens.append(str(start) if start == end else f'{start}-{end}')
+        tokens.append(doc_type or 'misc')
+        return '.'.join(tokens)
+
+    def _unique(self, name, taken):
+        unique, i = name, 2
+        while unique in taken:
+            unique, i = f'{name}.{i}', i + 1
+        taken.add(unique)
+        return unique
+
+    def write(self, shards, out_dir, backends=('usearch',), source_backend='usearch',
+              chunk_size=100000, **options):
+        """Write the planned shards to a folder, with their labels, metadata
+        columns (when all their sources have some) and manifest entries.
+        Each shard is built with `core.index_builder.IndexBuilder`, so that
+        an interrupted run resumes where it stopped.
+
+        Args:
+            shards (list): Shards, as planned by `plan`.
+            out_dir (str): Folder of the new indexes, other than the source
+                folder.
+            backends (tuple): Backends to build the shards with.
+            source_backend (str): Backend of the indexes to read vectors from.
+            chunk_size (int): Vectors per checkpoint.
+            **options: Options of the builders, e.g. `dtype` or `trees`.
+        """
+        from core.index_builder import IndexBuilder
+        from core.metadata import METADATA_EXT, open_columns
+        if path.abspath(out_dir) == path.abspath(self._folder):
+            raise ValueError('Shards must be written to another folder')
+        for shard in shards:
+            entries = {idx: self._manifest.get(idx, [source_backend]) for idx, _, _ in shard['parts']}
+            builder = IndexBuilder(shard['id'], out_dir, {'parts': shard['parts']}, chunk_size)
+            builder.start()
+            builder.embed(self._source(shard['parts'], entries), np.stack, workers=1)
+            builder.build(list(backends), **options)
+            builder.finish()
+
+            columns = [f'{self._folder}/{idx}{METADATA_EXT}' for idx, _, _ in shard['parts']]
+            if all(path.isfile(f) for f in columns):
+                rows = [open_columns(f)[start:end] for f, (_, start, end) in zip(columns, shard['parts'])]
+                np.save(f'{out_dir}/{shard["id"]}{METADATA_EXT}', np.concatenate(rows))
+
+    def _source(self, parts, entries, batch_size=10000):
+        """Source of `IndexBuilder.embed` that gives the vectors of the rows
+        of `parts` in place of texts; its tokens are `[part, row]`.
+        """
+        from core.labels import LabelStore
+
+        def source(token):
+            first, row = token if token is not None else (0, None)
+            for i in range(first, len(parts)):
+                index_id, start, end = parts[i]
+                entry = entries[index_id]
+                if i == first and row is not None:
+                    start = row + 1
+                labels = LabelStore.open(f'{self._folder}/{entry["labels"]}')
+                read = self._vector_reader(entry)
+                for lo in range(start, end, batch_size):
+                    hi = min(end, lo + batch_size)
+                    X = read(lo, hi)
+                    yield [([i, r], labels[r], X[r - lo]) for r in range(lo, hi)]
+        return source
+
+    def _vector_reader(self, entry):
+        """Function of a row range to the vectors of an index; vectors of
+        indexes after a transform (e.g. OPQ) or quantized are decoded back,
+        which loses precision, unless a .vectors.npy file has them in full.
+        """
+        index_file = f'{self._folder}/{entry["file"]}'
+        vectors_file = f'{self._folder}/{entry["id"]}.vectors.npy'
+        if path.isfile(vectors_file):
+            vectors = np.load(vectors_file, mmap_mode='r')
+            return lambda lo, hi: np.asarray(vectors[lo:hi], dtype='float32')
+        if entry['backend'] == 'usearch':
+            import usearch.index
+            index = usearch.index.Index.restore(index_file, view=True)
+            return lambda lo, hi: index.get(np.arange(lo, hi), dtype=np.float32)
+        if entry['backend'] == 'faiss':
+            if path.isfile(f'{self._folder}/{entry["id"]}.deltas.json'):
+                raise ValueError(f'{entry["id"]} has delta segments; compact it first')
+            index = faiss.read_index(index_file)
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.make_direct_map()
+            return lambda lo, hi: index.reconstruct_n(lo, hi - lo)
+        index = annoy.AnnoyIndex(entry['dims'], 'angular')
+        index.load(index_file)
+        return lambda lo, hi: np.array([index.get_item_vector(r) for r in range(lo, hi)],
+                                       dtype='float32')
+
+
+def fanout_report(before, after):
+    """Number of indexes a search is sent to before and after re-sharding,
+    for unrouted searches and for searches routed to each doc type, year
+    and subclass of the original indexes (averaged over them).
+
+    Args:
+        before (Manifest): Manifest of the original indexes.
+        after (Manifest): Manifest of the new indexes.
+
+    Returns:
+        list: Rows of `query`, `before`, `after` and `reduction` (times).
+    """
+    originals = list(before)
+    doc_types = sorted({e['doc_type'] for e in originals if e.get('doc_type')})
+    years = sorted({y for e in originals if e.get('years')
+                    for y in range(e['years'][0], e['years'][1] + 1)})
+    subclasses = sorted({e['subclass'] for e in originals if e.get('subclass')})
+    queries = [('all indexes', [{}])]
+    queries += [(f'type={t}', [{'doc_type': t}]) for t in doc_types]
+    if years:
+        queries.append(('one year (mean)', [{'years': (y, y)} for y in years]))
+    if subclasses:
+        queries.append(('one subclass (mean)', [{'subclass': s} for s in subclasses]))
+
+    rows = []
+    for name, routings in queries:
+        fanout = [np.mean([len(m.find(**routing)) for routing in routings]) for m in (before, after)]
+        rows.append({'query': name, 'before': float(fanout[0]), 'after': float(fanout[1]),
+                     'reduction': float(fanout[0] / fanout[1]) if fanout[1] else None})
+    return rows
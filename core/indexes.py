@@ -2,15 +2,22 @@ import numpy as np
 import annoy
 import json
 import os
-import gzip
+import re
 import faiss
 import psutil
+import threading
 import usearch.index
+from collections import OrderedDict
 
 
 from config import config
+from core.labels import LabelStore, find_labels_file, write_labels, LABELS_EXT, ORDER_EXT
+from core import manifest
+from core.manifest import Manifest
+from core.search_params import SearchParams, SettingLock
 
 CHECK_MARK = u'\u2713'
+VECTORS_EXT = '.vectors.npy'    # float32 vectors of a quantized usearch index
 
 class Index():
 
@@ -18,8 +25,10 @@ class Index():
         self._search_fn = None
         self._type = 'Index'
 
-    def search(self, query, n):
-        return self._search_fn(query, n)
+    def search(self, query, n, params=None):
+        """Top `n` matches of `query`; `params` is a `SearchParams`, a
+        preset name or a dict of knobs, see `core/search_params.py`"""
+        return self._search_fn(query, n, SearchParams.from_spec(params))
 
     @property
     def type(self):
@@ -31,6 +40,21 @@ class VectorIndex(Index):
     def __init__(self):
         self._type = 'VectorIndex'
 
+    def search_many(self, queries, n, params=None):
+        """Top `n` matches of each row of `queries`, as (ids, distances): a
+        list of ids and an array of distances per query, nearest first."""
+        Q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        return self._search_many_fn(Q, n, SearchParams.from_spec(params))
+
+    def _search_many_fn(self, Q, n, params=None):
+        """One search per query, for indexes without a batch search"""
+        ids, dists = [], []
+        for q in Q:
+            pairs = self._search_fn(q, n, params)
+            ids.append([i for i, _ in pairs])
+            dists.append(np.array([d for _, d in pairs], dtype=np.float32))
+        return ids, dists
+
 
 class AnnoyIndexReader():
 
@@ -38,9 +62,9 @@ class AnnoyIndexReader():
         self._dims = dims
         self._metric = metric
 
-    def read_from_files(self, ann_file, json_file, name=None):
+    def read_from_files(self, ann_file, labels_file, name=None):
         index = self._read_ann(ann_file)
-        items = self._get_items_from_json(json_file)
+        items = self._get_items(labels_file)
         item_resolver = items.__getitem__
         return AnnoyIndex(index, item_resolver, name)
 
@@ -49,6 +73,11 @@ class AnnoyIndexReader():
         index.load(ann_file)
         return index
 
+    def _get_items(self, labels_file):
+        if labels_file.endswith('.json'):
+            return self._get_items_from_json(labels_file)
+        return LabelStore.open(labels_file)
+
     def _get_items_from_json(self, json_file):
         with open(json_file) as file:
             items = json.load(file)
@@ -63,13 +92,13 @@ class AnnoyIndex(VectorIndex):
         self._name = name
         self._search_depth = 1000
 
-    def _search_fn(self, qvec, n):
-        ids, dists = self._get_similar(qvec, n)
+    def _search_fn(self, qvec, n, params=None):
+        ids, dists = self._get_similar(qvec, n, params)
         items = [self._index2item(i) for i in ids]
         return list(zip(items, dists))
 
-    def _get_similar(self, qvec, n):
-        d = self._search_depth
+    def _get_similar(self, qvec, n, params=None):
+        d = params.search_k if params and params.search_k else self._search_depth
         return self._index.get_nns_by_vector(qvec, n, d, True)
 
     def set_search_depth(self, d):
@@ -78,9 +107,12 @@ class AnnoyIndex(VectorIndex):
     def count(self):
         return self._index.get_n_items()
 
+    def to_flat(self):
+        X = [self._index.get_item_vector(i) for i in range(self.count())]
+        return FlatIndex(X, self._index2item, self._name)
+
     def dims(self):
-        v0 = self._index.get_item_vector(0)
-        return len(v0)
+        return self._index.f
 
     def __repr__(self):
         idx_type = 'AnnoyIndex '
@@ -96,11 +128,20 @@ class AnnoyIndex(VectorIndex):
 
 class FaissIndexReader():
 
-    def read_from_files(self, index_file, json_file, name=None):
+    def read_from_files(self, index_file, labels_file, name=None):
+        folder, filename = os.path.split(index_file)
+        FaissDeltas.recover(folder, name or filename[:-len('.faiss')])
         index = faiss.read_index(index_file)
-        items = self._get_items_from_json(json_file)
+        items = self._get_items(labels_file)
         item_resolver = items.__getitem__
-        return FaissIndex(index, item_resolver, name)
+        faiss_index = FaissIndex(index, item_resolver, name)
+        faiss_index.open_deltas(index_file, labels_file)
+        return faiss_index
+
+    def _get_items(self, labels_file):
+        if labels_file.endswith('.json'):
+            return self._get_items_from_json(labels_file)
+        return LabelStore.open(labels_file)
 
     def _get_items_from_json(self, json_file):
         with open(json_file) as fp:
@@ -110,36 +151,249 @@ class FaissIndexReader():
 
 class FaissIndex(VectorIndex):
 
+    """A FAISS index file, along with the delta segments of the vectors
+    added to it since it was written and the tombstones of the labels
+    deleted from it, see `FaissDeltas`. Adding vectors costs time in
+    proportion to their number; compaction, which runs in the background
+    once the deltas grow past `max_delta_segments` segments or
+    `max_delta_ratio` of the index, or the deleted vectors past
+    `max_dead_ratio` of it, merges them into the index file."""
+
+    max_delta_segments = 8
+    max_delta_ratio = 0.1
+    max_dead_ratio = 0.1
+
     def __init__(self, index=None, resolver_fn=None, name=None):
         self._id = name
         self._index = index
         self._index2label = resolver_fn
         self._labels = None
         self._dims = None
+        self._lock = threading.Lock()
+        self._ef_search = _ef_search(index)     # efSearch of searches without one
+        self._expansion_lock = SettingLock()    # held by HNSW searches, see _search
+        self._index_dir = None
+        self._labels_file = None
+        self._deltas = FaissDeltas()
+        self._write_lock = threading.Lock()    # held by writes and compactions
+        self._compaction = None
+
+    def _search_fn(self, qvec, n, params=None):
+        ids, dists = self._search_many_fn([qvec], n, params)
+        return list(zip(ids[0], dists[0].tolist()))
+
+    def _search_many_fn(self, Q, n, params=None):
+        Q = self._preprocess(Q)
+        with self._lock:
+            index, resolve, deltas = self._index, self._index2label, self._deltas
+        ds, ns = self._search(Q, n + deltas.hidden, params, index)
+        if deltas:
+            return deltas.merge(Q, n, ds, ns, resolve, index)
+        found = ns >= 0     # faiss pads with -1 when it finds fewer than n
+        ids = [[resolve(i) for i in row[ok]] for row, ok in zip(ns, found)]
+        return ids, [row[ok] for row, ok in zip(ds, found)]
+
+    def _search(self, Q, n, params=None, faiss_index=None):
+        """Search with the `efSearch` of HNSW or the `nprobe` of IVF indexes,
+        also when they follow a transform (as in OPQ16_64,HNSW32). faiss
+        1.7.4 ignores the efSearch of SearchParametersHNSW, so it is set on
+        the index, under a `SettingLock`: searches with the same efSearch,
+        e.g. the default one, run together, and never while another efSearch
+        is set."""
+        faiss_index = self._index if faiss_index is None else faiss_index
+        index, transformed = _base_index(faiss_index)
+        if isinstance(index, faiss.IndexHNSW):
+            ef_search = (params.expansion if params else None) or self._ef_search
+            with self._expansion_lock.holding(ef_search):
+                index.hnsw.efSearch = ef_search
+                return faiss_index.search(Q, n)
+        if not (isinstance(index, faiss.IndexIVF) and params and params.nprobe):
+            return faiss_index.search(Q, n)
+        search_params = faiss.SearchParametersIVF(nprobe=params.nprobe)
+        if transformed:
+            index_params = search_params
+            search_params = faiss.SearchParametersPreTransform()
+            search_params.index_params = index_params
+            search_params.referenced_objects = [index_params]  # keep it alive
+        return faiss_index.search(Q, n, params=search_params)
 
-    def _search_fn(self, qvec, n):
-        Q = self._preprocess([qvec])
-        ds, ns = self._index.search(Q, n)
-        items = [self._index2label(i) for i in ns[0]]
-        dists = [float(d) for d in ds[0]]
-        return list(zip(items, dists))
+    def count(self):
+        deltas = self._deltas
+        return self._index.ntotal - len(deltas.dead) + deltas.live_count
+
+    def to_flat(self):
+        """Raises RuntimeError for indexes that do not keep their vectors as
+        they are, e.g. after an OPQ transform, since an exact search over
+        their approximate vectors is not any better than the index's."""
+        index, transformed = self._base_index()
+        if transformed or not isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat)):
+            raise RuntimeError(f'{self._id} does not keep its vectors in full')
+        if self._deltas:
+            raise RuntimeError(f'{self._id} has uncompacted deltas')
+        X = self._index.reconstruct_n(0, self._index.ntotal)
+        return FlatIndex(X, self._index2label, self._id)
+
+    def _base_index(self):
+        return _base_index(self._index)
+
+    def open_deltas(self, index_file, labels_file):
+        """Read the deltas of the index file, if any, and the place of its
+        files, which later additions and compactions write to"""
+        self._index_dir = os.path.dirname(index_file)
+        self._labels_file = labels_file
+        if self._id is None:
+            self._id = os.path.basename(index_file)[:-len('.faiss')]
+        self._deltas = FaissDeltas.read(self._index_dir, self._id, self._index)
 
     # TODO: Move this to indexer
     def add_vectors(self, vectors, labels):
+        """Add vectors to the index: to the index file when it is created,
+        and as a delta segment later on. A label added again after it was
+        deleted is searched again; deleting it hides all its earlier
+        vectors."""
         if len(vectors) != len(labels):
             raise ValueError('Vector must map one-to-one with labels.')
         X = self._preprocess(vectors)
         if self._index is None:
             self._init(X)
-        self._index.add(X)
-        self._labels += labels
-        self._save()
+            self._index.add(X)
+            self._labels += labels
+            self._save()
+            return
+        with self._write_lock:
+            deltas = self._deltas.with_segment(self._index_dir, self._id, X, list(labels), self._index)
+            self._set_deltas(deltas)
+        self._compact_if_needed()
+
+    def delete(self, labels):
+        """Hide the vectors of `labels` from searches, until a compaction
+        drops them; their ids in the index file are dead from now on."""
+        with self._write_lock:
+            dead = self._base_ids(labels)
+            self._set_deltas(self._deltas.with_tombstones(labels, dead))
+        self._compact_if_needed()
+
+    def _base_ids(self, labels):
+        """Ids of the vectors of `labels` in the index file"""
+        if self._labels_file is not None and self._labels_file.endswith(LABELS_EXT):
+            store = LabelStore.open(self._labels_file)
+            return [i for label in labels for i in store.find(label)]
+        labels = set(labels)
+        return [i for i, label in enumerate(self._read_labels()) if label in labels]
+
+    def _set_deltas(self, deltas):
+        deltas.write(self._index_dir, self._id)
+        with self._lock:
+            self._deltas = deltas
+
+    def _compact_if_needed(self):
+        deltas = self._deltas
+        too_many = len(deltas.segments) > self.max_delta_segments
+        too_big = deltas.count > self.max_delta_ratio * self._index.ntotal
+        too_many_deleted = deltas.hidden > self.max_dead_ratio * self._index.ntotal
+        if not (too_many or too_big or too_many_deleted):
+            return
+        with self._lock:
+            if self._compaction and self._compaction.is_alive():
+                return
+            self._compaction = threading.Thread(target=self.compact, daemon=True,
+                                                name=f'compact-{self._id}')
+            self._compaction.start()
+
+    def compact(self):
+        """Merge the delta segments into the index file and labels. The dead
+        ids of the index file are dropped once they are more than
+        `max_dead_ratio` of it, see `_remove`; until then they stay dead.
+        The new index file and labels are written next to the current ones,
+        and the deltas written with the renames that put them in their
+        place, so that `FaissDeltas.recover` finishes a compaction that
+        stops halfway through them. Searches go on meanwhile; additions and
+        deletions wait."""
+        with self._write_lock:
+            deltas = self._deltas
+            too_many_dead = len(deltas.dead) > self.max_dead_ratio * self._index.ntotal
+            if not (deltas.segments or deltas.tombstones or too_many_dead):
+                return
+            labels = self._read_labels()
+            index, dead = faiss.clone_index(self._index), deltas.dead
+            if too_many_dead:
+                labels, dead = self._remove(index, dead, labels), ()
+            for segment in deltas.segments:
+                live = segment.live(deltas.tombstones)
+                index.add(segment.vectors[live])
+                labels += [segment.labels[i] for i in live]
+            compacted = FaissDeltas(dead=dead, next_seq=deltas.next_seq, base_count=index.ntotal)
+            renames = self._write_base(index, labels)
+            compacted.write(self._index_dir, self._id, renames)
+            _apply_renames(self._index_dir, renames)
+            compacted.write(self._index_dir, self._id)
+            index_file = f'{self._index_dir}/{self._id}.faiss'
+            manifest.record(index_file, self._labels_file, index.d, index.ntotal)
+            if self._labels_file.endswith('.json'):
+                resolve = labels.__getitem__
+            else:
+                resolve = LabelStore.open(self._labels_file).__getitem__
+            with self._lock:
+                self._index, self._index2label, self._deltas = index, resolve, compacted
+            for segment in deltas.segments:
+                segment.remove(self._index_dir, self._id)
+
+    def _remove(self, index, dead, labels):
+        """Remove the `dead` ids from `index`, a copy of the index file, and
+        return the labels of the ids left. Flat, PQ and SQ indexes remove
+        them in place; the others (e.g. HNSW and IVF), which cannot renumber
+        their ids, are rebuilt from the vectors they store, as they store
+        them past their transforms (e.g. OPQ), so that these are not applied
+        to them twice; IVF indexes with PQ codes encode them again, which
+        changes them slightly."""
+        keep = np.setdiff1d(np.arange(index.ntotal), np.fromiter(dead, dtype='int64'))
+        inner, _ = _base_index(index)
+        if isinstance(inner, faiss.IndexFlatCodes):
+            inner.remove_ids(np.array(sorted(dead), dtype='int64'))
+        else:
+            source, _ = _base_index(self._index)
+            if faiss.try_extract_index_ivf(source) is not None:
+                source = faiss.clone_index(source)
+                faiss.extract_index_ivf(source).make_direct_map()
+            inner.reset()
+            for start in range(0, len(keep), 100000):
+                ids = keep[start:start + 100000]
+                first = int(ids[0])
+                inner.add(source.reconstruct_n(first, int(ids[-1]) - first + 1)[ids - first])
+        index.ntotal = inner.ntotal     # an IndexPreTransform counts them apart
+        return [labels[i] for i in keep]
+
+    def _read_labels(self):
+        if self._labels_file.endswith('.json'):
+            with open(self._labels_file) as fp:
+                return json.load(fp)
+        store = LabelStore.open(self._labels_file)
+        return [store[i] for i in range(len(store))]
+
+    def _write_base(self, index, labels):
+        """Write the index file and labels of a compaction next to the
+        current ones; returns the renames that put them in their place, as
+        (from, to) file names in the folder of the index"""
+        name = f'{self._id}.faiss'
+        faiss.write_index(index, f'{self._index_dir}/{name}.tmp')
+        renames = [(f'{name}.tmp', name)]
+        labels_name = os.path.basename(self._labels_file)
+        if labels_name.endswith('.json'):
+            with open(f'{self._index_dir}/{labels_name}.tmp', 'w') as fp:
+                json.dump(labels, fp)
+            renames.append((f'{labels_name}.tmp', labels_name))
+        else:
+            stem = labels_name[:-len(LABELS_EXT)]
+            write_labels(f'{self._index_dir}/{stem}.tmp{LABELS_EXT}', labels)
+            renames += [(f'{stem}.tmp{ext}', f'{stem}{ext}') for ext in [LABELS_EXT, ORDER_EXT]]
+        return renames
 
     def _init(self, X):
         self._dims = X.shape[1]
         self._labels = []
         self._index = faiss.index_factory(self._dims, "OPQ16_64,HNSW32")
         self._index.train(X)
+        self._ef_search = _ef_search(self._index)
 
     def _preprocess(self, vectors):
         X = np.array(vectors).astype('float32')
@@ -152,6 +406,381 @@ class FaissIndex(VectorIndex):
         faiss.write_index(self._index, index_file)
         with open(labels_file, 'w') as fp:
             json.dump(self._labels, fp)
+        manifest.record(index_file, labels_file, self._dims, self._index.ntotal)
+        self._labels_file = labels_file
+        self._index2label = self._labels.__getitem__
+        self._deltas = FaissDeltas(base_count=self._index.ntotal)
+
+    @property
+    def name(self):
+        return self._id
+
+
+def _base_index(faiss_index):
+    index = faiss.downcast_index(faiss_index)
+    transformed = isinstance(index, faiss.IndexPreTransform)
+    if transformed:
+        index = faiss.downcast_index(index.index)
+    return index, transformed
+
+
+def _transform(faiss_index, X):
+    """Vectors as the index past the transforms of a FAISS index (e.g. OPQ)
+    sees them"""
+    index = faiss.downcast_index(faiss_index)
+    if isinstance(index, faiss.IndexPreTransform):
+        for i in range(index.chain.size()):
+            X = faiss.downcast_VectorTransform(index.chain.at(i)).apply(X)
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+
+def _ef_search(faiss_index):
+    """efSearch of an HNSW index, also past its transforms, else None"""
+    index = _base_index(faiss_index)[0] if faiss_index is not None else None
+    return index.hnsw.efSearch if isinstance(index, faiss.IndexHNSW) else None
+
+
+def _apply_renames(folder, renames):
+    """Put the files of a compaction in their place; those already moved,
+    e.g. by an earlier attempt, are skipped"""
+    for src, dst in renames:
+        try:
+            os.replace(f'{folder}/{src}', f'{folder}/{dst}')
+        except FileNotFoundError:
+            pass
+
+
+class DeltaSegment():
+
+    """Vectors added to a FAISS index at once, stored as `.npy` and
+    `.items.json` files, and searched exactly in the space of the index,
+    past its transforms, so that their distances compare with the index's"""
+
+    def __init__(self, seq, vectors, labels, faiss_index):
+        self.seq = seq
+        self.vectors = vectors
+        self.labels = labels
+        X = _transform(faiss_index, vectors)
+        self._index = faiss.IndexFlat(X.shape[1], faiss_index.metric_type)
+        self._index.add(X)
+
+    @classmethod
+    def read(cls, folder, index_id, seq, faiss_index):
+        name = f'{folder}/{index_id}.delta-{seq:06d}'
+        with open(f'{name}.items.json') as fp:
+            labels = json.load(fp)
+        return cls(seq, np.load(f'{name}.npy'), labels, faiss_index)
+
+    def write(self, folder, index_id):
+        name = f'{folder}/{index_id}.delta-{self.seq:06d}'
+        np.save(f'{name}.npy', self.vectors)
+        with open(f'{name}.items.json', 'w') as fp:
+            json.dump(self.labels, fp)
+
+    def remove(self, folder, index_id):
+        for ext in ['.npy', '.items.json']:
+            path = f'{folder}/{index_id}.delta-{self.seq:06d}{ext}'
+            if os.path.exists(path):
+                os.remove(path)
+
+    def search(self, Qt, n):
+        return self._index.search(Qt, min(n, len(self.labels)))
+
+    def live(self, tombstones):
+        """Positions of the vectors not deleted since they were added"""
+        return [i for i, label in enumerate(self.labels)
+                if tombstones.get(label, -1) < self.seq]
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class FaissDeltas():
+
+    """Changes to a FAISS index file that are not merged into it yet, kept
+    in its `.deltas.json` file: delta segments numbered from 1 on, the
+    tombstones of deleted labels and the dead ids of the index file. The
+    tombstone of a label is the number of the last segment when it was
+    deleted; it hides the label in that segment and the earlier ones, the
+    index file being number 0. Objects are not changed once made, so that
+    searches can go on while they are replaced.
+
+    The vector count of the index file is recorded too: if it does not
+    match the index file, the index file was replaced (e.g. rebuilt) and the
+    deltas, which were made for the earlier one, are dropped. A compaction
+    writes its deltas along with the renames of its files, see `recover`.
+    Segment files left behind by a compaction (those of earlier segments
+    that the deltas do not list) are removed when the deltas are read."""
+
+    def __init__(self, segments=(), tombstones=None, dead=(), next_seq=1, base_count=None):
+        self.segments = tuple(segments)
+        self.tombstones = dict(tombstones or {})
+        self.dead = frozenset(dead)
+        self.next_seq = next_seq
+        self.base_count = base_count
+        self.live_count = sum(len(s.live(self.tombstones)) for s in self.segments)
+
+    @classmethod
+    def read(cls, folder, index_id, faiss_index):
+        path = f'{folder}/{index_id}.deltas.json'
+        if not os.path.exists(path):
+            return cls(base_count=faiss_index.ntotal)
+        with open(path) as fp:
+            state = json.load(fp)
+        seqs = state['segments']
+        for orphan in _orphan_segments(folder, index_id, seqs, state['next_seq']):
+            print(f'Removing orphan delta segment file: {orphan}')
+            os.remove(f'{folder}/{orphan}')
+        if state['base_count'] != faiss_index.ntotal:
+            return cls(next_seq=state['next_seq'], base_count=faiss_index.ntotal)
+        segments = [DeltaSegment.read(folder, index_id, seq, faiss_index) for seq in seqs]
+        return cls(segments, state['tombstones'], state['dead'], state['next_seq'],
+                   faiss_index.ntotal)
+
+    @staticmethod
+    def recover(folder, index_id):
+        """Finish a compaction that stopped after it wrote its deltas, by
+        putting its index file and labels in their place; to be done before
+        the index file is read."""
+        path = f'{folder}/{index_id}.deltas.json'
+        if not os.path.exists(path):
+            return
+        with open(path) as fp:
+            state = json.load(fp)
+        if state.get('renames'):
+            _apply_renames(folder, state.pop('renames'))
+            with open(f'{path}.tmp', 'w') as fp:
+                json.dump(state, fp)
+            os.replace(f'{path}.tmp', path)
+            manifest.record(f'{folder}/{index_id}.faiss')
+
+    def write(self, folder, index_id, renames=None):
+        path = f'{folder}/{index_id}.deltas.json'
+        state = {'segments': [s.seq for s in self.segments], 'tombstones': self.tombstones,
+                 'dead': sorted(self.dead), 'next_seq': self.next_seq,
+                 'base_count': self.base_count}
+        if renames:
+            state['renames'] = renames
+        with open(f'{path}.tmp', 'w') as fp:
+            json.dump(state, fp)
+        os.replace(f'{path}.tmp', path)
+
+    def with_segment(self, folder, index_id, vectors, labels, faiss_index):
+        segment = DeltaSegment(self.next_seq, vectors, labels, faiss_index)
+        segment.write(folder, index_id)
+        return FaissDeltas(self.segments + (segment,), self.tombstones, self.dead,
+                           self.next_seq + 1, self.base_count)
+
+    def with_tombstones(self, labels, dead=()):
+        """Deltas with `labels` deleted; `dead` are their ids in the index
+        file"""
+        seq = self.segments[-1].seq if self.segments else 0
+        tombstones = {**self.tombstones, **{label: seq for label in labels}}
+        return FaissDeltas(self.segments, tombstones, self.dead | set(dead), self.next_seq,
+                           self.base_count)
+
+    @property
+    def count(self):
+        return sum(len(s) for s in self.segments)
+
+    @property
+    def hidden(self):
+        """Number of deleted vectors, in the index file and the segments,
+        which searches fetch on top of the matches they need"""
+        return len(self.dead) + self.count - self.live_count
+
+    def merge(self, Q, n, ds, ns, resolve, faiss_index):
+        """Top `n` matches of the queries `Q` among the matches (`ds`, `ns`)
+        of the index file and those of the segments, without deleted ones"""
+        k = n + self.hidden
+        Qt = _transform(faiss_index, Q)
+        found = [[] for _ in Q]
+        for row, (dists, ids) in enumerate(zip(ds, ns)):
+            for d, i in zip(dists, ids):
+                if i < 0 or i in self.dead:
+                    continue
+                label = resolve(i)
+                if label not in self.tombstones:
+                    found[row].append((d, label))
+        for segment in self.segments:
+            for row, (dists, ids) in enumerate(zip(*segment.search(Qt, k))):
+                for d, i in zip(dists, ids):
+                    label = segment.labels[i] if i >= 0 else None
+                    if label is not None and self.tombstones.get(label, -1) < segment.seq:
+                        found[row].append((d, label))
+        reverse = faiss_index.metric_type == faiss.METRIC_INNER_PRODUCT
+        ids, dists = [], []
+        for matches in found:
+            matches = sorted(matches, key=lambda m: m[0], reverse=reverse)[:n]
+            ids.append([label for _, label in matches])
+            dists.append(np.array([d for d, _ in matches], dtype=np.float32))
+        return ids, dists
+
+    def __bool__(self):
+        return bool(self.segments or self.tombstones or self.dead)
+
+
+def _orphan_segments(folder, index_id, seqs, next_seq):
+    """Files of the segments of an index numbered below `next_seq` that are
+    not among `seqs`; those numbered `next_seq` on may be being written"""
+    pattern = re.compile(re.escape(index_id) + r'\.delta-(\d{6})\.(npy|items\.json)$')
+    orphans = []
+    for name in sorted(os.listdir(folder)):
+        match = pattern.match(name)
+        if match and int(match.group(1)) < next_seq and int(match.group(1)) not in seqs:
+            orphans.append(name)
+    return orphans
+
+
+class FlatIndex(VectorIndex):
+
+    """An index searched exactly, by a product of the query with the matrix
+    of its normalized vectors, which is faster than an approximate search
+    for small indexes. Distances are cosine distances."""
+
+    def __init__(self, vectors, resolver_fn, name=None, keys=None, dtype=np.float32):
+        X = np.asarray(vectors, dtype=np.float32)
+        X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+        self._matrix = np.ascontiguousarray(X, dtype=dtype)
+        self._keys = np.arange(len(X)) if keys is None else np.asarray(keys)
+        self._index2label = resolver_fn
+        self._name = name
+
+    def _search_fn(self, qvec, n, params=None):
+        ids, dists = self._search_many_fn(np.atleast_2d(qvec), n, params)
+        return list(zip(ids[0], dists[0].tolist()))
+
+    def _search_many_fn(self, Q, n, params=None):
+        Q = np.asarray(Q, dtype=np.float32)
+        Q = Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+        X = self._matrix
+        S = (X if X.dtype == np.float32 else X.astype(np.float32)) @ Q.T
+        n = min(n, len(S))
+        if n <= 0:
+            return [[] for _ in Q], [np.empty(0, dtype=np.float32) for _ in Q]
+        top = np.argpartition(-S, n - 1, axis=0)[:n]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(S, top, 0), 0, kind='stable'), 0)
+        sims = np.take_along_axis(S, top, 0)
+        ids = [[self._index2label(k) for k in self._keys[col]] for col in top.T]
+        return ids, [(1.0 - col).astype(np.float32) for col in sims.T]
+
+    def count(self):
+        return len(self._matrix)
+
+    @property
+    def nbytes(self):
+        return self._matrix.nbytes + self._keys.nbytes
+
+    def __repr__(self):
+        idx_name = 'Unnamed' if self._name is None else self._name
+        return f'FlatIndex {idx_name} [{len(self._matrix)} vectors, {self._matrix.shape[1]} dimensions]'
+
+    @property
+    def name(self):
+        return self._name
+
+
+class IndexCache():
+
+    """Loaded indexes, least recently used first, evicted once their total
+    size exceeds `budget` bytes (0 for no limit). An index is loaded by one
+    thread at a time: concurrent requests for it wait for that load."""
+
+    def __init__(self, budget=0):
+        self.budget = budget
+        self._entries = OrderedDict()   # key -> (index, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def get_or_load(self, key, load_fn):
+        """Cached index `key`, or the index loaded by `load_fn`, which returns
+        it along with its size in bytes."""
+        index = self.get(key)
+        if index is not None:
+            return index
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            index = self.get(key)   # loaded while waiting
+            if index is not None:
+                return index
+            with self._lock:
+                self.misses += 1
+            index, nbytes = load_fn()
+            self.put(key, index, nbytes)
+        with self._lock:
+            self._load_locks.pop(key, None)
+        return index
+
+    def put(self, key, index, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (index, nbytes)
+            self._bytes += nbytes
+            while self.budget > 0 and self._bytes > self.budget and len(self._entries) > 1:
+                _, (_, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'bytes': self._bytes,
+                'count': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'indexes': {key: size for key, (_, size) in self._entries.items()}
+            }
+
+
+class LazyIndex(VectorIndex):
+
+    """Index of an `IndexesDirectory` that is taken from the directory (and
+    loaded if it is not cached) for each search, so that a search over more
+    indexes than fit in the cache does not keep all of them loaded."""
+
+    def __init__(self, directory, index_id):
+        self._directory = directory
+        self._id = index_id
+
+    def _search_fn(self, qvec, n, params=None):
+        return self._directory.get_one(self._id).search(qvec, n, params)
+
+    def _search_many_fn(self, Q, n, params=None):
+        return self._directory.get_one(self._id).search_many(Q, n, params)
+
+    def __repr__(self):
+        return f'LazyIndex {self._id}'
 
     @property
     def name(self):
@@ -160,84 +789,132 @@ class FaissIndex(VectorIndex):
 
 class IndexesDirectory():
 
-    cache = {}
+    cache = IndexCache(config.index_cache_budget)
     dims = 1024
     metric = 'angular'
     use_faiss_indexes = config.use_faiss_indexes
     use_annoy_indexes = config.use_annoy_indexes
     use_usearch_indexes = config.use_usearch_indexes
+    flat_limit = config.flat_index_limit    # indexes this small are searched exactly
 
     def __init__(self, folder):
         self._folder = folder
+        self._manifest = Manifest.load(folder)
         self._available = self._discover_indexes()
 
     def _discover_indexes(self):
-        files = [f.name for f in os.scandir(self._folder)]
-        index_files = []
+        return self._manifest.ids(self._backends())
 
+    def _backends(self):
+        """Enabled index backends, in order of preference"""
+        backends = []
         if self.use_faiss_indexes:
-            index_files += [f for f in files if f.endswith('.faiss')]
+            backends.append('faiss')
         if self.use_annoy_indexes:
-            index_files += [f for f in files if f.endswith('.ann')]
+            backends.append('annoy')
         if self.use_usearch_indexes:
-            index_files += [f for f in files if f.endswith('.usearch')]
-        
-        index_ids = ['.'.join(f.split('.')[:-1]) for f in index_files]
-        return set(index_ids)
+            backends.append('usearch')
+        return backends
+
+    def find(self, prefix=None, doc_type=None, years=None, subclass=None):
+        """Ids of the indexes with the given id prefix and attributes, see
+        `Manifest.find`"""
+        return self._manifest.find(prefix, self._backends(), doc_type, years, subclass)
+
+    def info(self, index_id):
+        """Manifest entry of an index: backend, dims, count, doc type, years,
+        subclass, size and checksum (only those in its name if the folder
+        has no manifest)"""
+        return self._manifest.get(index_id, self._backends())
 
     def get(self, index_id):
+        """Indexes whose ids start with `index_id` ("*" or "all" for every
+        index). If they don't fit in the cache's budget together, they are
+        returned as `LazyIndex`es, which are loaded (and evicted) as they
+        are searched instead of all at once."""
         if index_id == "*" or index_id == "all":
             index_ids = self.available()
         else:
-            index_ids = filter(lambda x: x.startswith(index_id), self.available())
-        indexes = []
-        for idx in sorted(index_ids):
-            indexes.append(self._get_one_index(idx))
-        return indexes
+            index_ids = self.find(prefix=index_id)
+        index_ids = sorted(index_ids)
+        budget = self.cache.budget
+        if budget > 0 and len(index_ids) > 1 and \
+                sum(self._estimate_size(idx) for idx in index_ids) > budget:
+            return [LazyIndex(self, idx) for idx in index_ids]
+        return [self.get_one(idx) for idx in index_ids]
 
-    def _get_one_index(self, index_id):
-        if index_id in self.cache:
-            return self.cache.get(index_id)
-        return self._get_from_disk(index_id)
+    def get_one(self, index_id):
+        return self.cache.get_or_load(index_id, lambda: self._get_from_disk(index_id))
 
     def _get_from_disk(self, index_id):
         print(f'Loading vector index: {index_id}')
 
         index_file = self._get_index_file_path(index_id)
-        labels_file = f'{self._folder}/{index_id}.items.json'
+        entry = self.info(index_id) or {}
+        if entry.get('labels'):
+            labels_file = f'{self._folder}/{entry["labels"]}'
+        else:
+            labels_file = find_labels_file(self._folder, index_id)
 
+        dims = entry.get('dims') or self.dims
         if index_file.endswith('faiss'):
             reader = FaissIndexReader()
         elif index_file.endswith('ann'):
-            reader = AnnoyIndexReader(self.dims, "angular")
+            reader = AnnoyIndexReader(dims, "angular")
         elif index_file.endswith('usearch'):
-            reader = USearchIndexReader(self.dims, "cos")
-            labels_file = f'{self._folder}/{index_id}.items.bin.gz'
+            reader = USearchIndexReader(dims, "cos")
         else:
             raise ValueError(f'Unknown index file type: {index_file}')
         
         index = reader.read_from_files(index_file, labels_file, name=index_id)
-        self._cache_index(index_id, index)
-        print(f"  {CHECK_MARK} RAM usage: {psutil.virtual_memory()._asdict().get('percent')}%")
-        return index
+        index = self._flatten_if_small(index)
+        nbytes = self._index_size(index_id, index)
+        print(f"  {CHECK_MARK} {nbytes / 2**20:.1f} MB, index cache: "
+              f"{(self.cache.nbytes + nbytes) / 2**20:.1f} MB, "
+              f"RAM usage: {psutil.virtual_memory()._asdict().get('percent')}%")
+        return index, nbytes
+
+    def _index_size(self, index_id, index):
+        """Bytes an index takes in memory: its file (as it is read whole or
+        memory mapped) and labels, or the matrix of a flat index"""
+        if isinstance(index, FlatIndex):
+            return index.nbytes + self._labels_size(index_id)
+        return self._estimate_size(index_id)
+
+    def _estimate_size(self, index_id):
+        entry = self.info(index_id) or {}
+        size = entry.get('bytes')
+        if size is None:
+            size = self._labels_size(index_id)
+            if entry:
+                size += os.path.getsize(self._get_index_file_path(index_id))
+        vectors_file = f'{self._folder}/{index_id}{VECTORS_EXT}'
+        if os.path.exists(vectors_file):
+            size += os.path.getsize(vectors_file)
+        return size
+
+    def _labels_size(self, index_id):
+        try:
+            return os.path.getsize(find_labels_file(self._folder, index_id))
+        except ValueError:
+            return 0
+
+    def _flatten_if_small(self, index):
+        if self.flat_limit <= 0 or index.count() > self.flat_limit:
+            return index
+        try:
+            return index.to_flat()
+        except RuntimeError:
+            return index
 
     def _get_index_file_path(self, index_id):
-        faiss_file = f'{self._folder}/{index_id}.faiss'
-        if self.use_faiss_indexes and os.path.exists(faiss_file):
-            return faiss_file
-        
-        ann_file = f'{self._folder}/{index_id}.ann'
-        if self.use_annoy_indexes and os.path.exists(ann_file):
-            return ann_file
-        
-        usearch_file = f'{self._folder}/{index_id}.usearch'
-        if self.use_usearch_indexes and os.path.exists(usearch_file):
-            return usearch_file
-
-        raise ValueError(f'Index file not found for {index_id}')
+        entry = self.info(index_id)
+        if entry is None:
+            raise ValueError(f'Index file not found for {index_id}')
+        return f'{self._folder}/{entry["file"]}'
 
-    def _cache_index(self, index_id, index):
-        self.cache[index_id] = index
+    def cache_stats(self):
+        return self.cache.stats()
 
     def available(self):
         return self._available
@@ -245,18 +922,75 @@ class IndexesDirectory():
 
 class USearchIndex(VectorIndex):
     
-        def __init__(self, index=None, resolver_fn=None, name=None):
+        def __init__(self, index=None, resolver_fn=None, name=None, vectors=None, path=None):
             self._id = name
             self._index = index
             self._index2label = resolver_fn
             self._labels = None
             self._dims = None
+            self._vectors = vectors  # full precision vectors of a quantized index
+            self._rescore_factor = 4
+            self._path = path
+            self._expansion = index.expansion_search if index is not None else None
+            self._expansion_lock = SettingLock()    # held by searches, see _search
     
-        def _search_fn(self, qvec, n):
-            matches = self._index.search(qvec, n)
+        def _search_fn(self, qvec, n, params=None):
+            if self._vectors is not None:
+                return self._search_and_rescore(qvec, n, params)
+            matches = self._search(qvec, n, params)
             labels = [self._index2label(m.key) for m in matches]
             dists = [float(m.distance) for m in matches]
             return list(zip(labels, dists))
+
+        def _search(self, qvec, n, params=None):
+            """usearch has no per search `expansion_search`, so it is set on
+            the index, under a `SettingLock`, as FaissIndex does for efSearch."""
+            exact = bool(params and params.exact)
+            expansion = (params.expansion if params else None) or self._expansion
+            with self._expansion_lock.holding(expansion):
+                self._index.expansion_search = expansion
+                return self._index.search(qvec, n, exact=exact)
+
+        def _search_many_fn(self, Q, n, params=None):
+            k = n if self._vectors is None else n * self._rescore_factor
+            matches = self._search(Q, k, params)
+            if isinstance(matches, usearch.index.BatchMatches):
+                rows = [(matches.keys[i, :c], matches.distances[i, :c])
+                        for i, c in enumerate(matches.counts)]
+            else:
+                rows = [(matches.keys, matches.distances)]
+            if self._vectors is not None:
+                rows = [self._rescore(q, keys, n) for q, (keys, _) in zip(Q, rows)]
+            ids = [[self._index2label(key) for key in keys] for keys, _ in rows]
+            return ids, [np.asarray(dists, dtype=np.float32) for _, dists in rows]
+
+        def _search_and_rescore(self, qvec, n, params=None):
+            keys = self._search(qvec, n * self._rescore_factor, params).keys
+            keys, dists = self._rescore(qvec, keys, n)
+            return [(self._index2label(key), float(d)) for key, d in zip(keys, dists)]
+
+        def _rescore(self, qvec, keys, n):
+            """Top `n` of the candidates `keys` by their exact distance to
+            `qvec`, computed on the full precision vectors."""
+            X = np.asarray(self._vectors[keys], dtype=np.float32)
+            q = np.asarray(qvec, dtype=np.float32)
+            sims = (X @ q) / np.maximum(np.linalg.norm(X, axis=1) * np.linalg.norm(q), 1e-12)
+            top = np.argsort(-sims, kind='stable')[:n]
+            return keys[top], 1.0 - sims[top]
+
+        def set_rescore_factor(self, factor):
+            self._rescore_factor = factor
+
+        def count(self):
+            return len(self._index)
+
+        def to_flat(self):
+            keys = np.array(self._index.keys, dtype=np.uint64)
+            if self._vectors is not None:
+                X = self._vectors[keys]
+            else:
+                X = self._index.get(keys, dtype=np.float32)
+            return FlatIndex(X, self._index2label, self._id, keys)
         
         @property
         def name(self):
@@ -265,8 +999,6 @@ class USearchIndex(VectorIndex):
 
 class USearchIndexReader:
 
-    BYTES_PER_LABEL = 20
-
     def __init__(self, dims, metric):
         self._dims = dims
         self._metric = metric
@@ -274,13 +1006,7 @@ class USearchIndexReader:
     def read_from_files(self, index_file, labels_file, name=None):
         view = not config.load_usearch_indexes_in_memory
         index = usearch.index.Index(ndim=self._dims, metric=self._metric, path=index_file, view=view)
-        
-        with gzip.open(labels_file, 'rb') as f:
-            self._labels = f.read()
-        
-        return USearchIndex(index, self._get_label, name)
-
-    def _get_label(self, i):
-        start = int(i * self.BYTES_PER_LABEL)
-        end = start + self.BYTES_PER_LABEL
-        return self._labels[start:end].decode("utf-8").strip()
+        labels = LabelStore.open(labels_file)
+        vectors_file = index_file[:-len('.usearch')] + VECTORS_EXT
+        vectors = np.load(vectors_file, mmap_mode='r') if os.path.exists(vectors_file) else None
+        return USearchIndex(index, labels.__getitem__, name, vectors, index_file)
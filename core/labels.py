@@ -0,0 +1,178 @@
+"""
+Fixed-width label files for vector indexes
+
+An index maps each vector to a numeric key; its labels file maps the key
+back to a document id. The `.items.bin` format stores one label per key,
+padded to a fixed width, after a 16 byte header (an 8 byte magic string,
+the label width and a reserved field, both uint32). Such a file is opened
+as a read-only memory map, so that all the processes reading an index share
+the same page cache pages instead of each holding a copy of its labels.
+
+An optional `.items.order` file holds the keys sorted by label (uint32),
+which makes looking up the key of a label a binary search.
+"""
+
+import os
+import gzip
+import json
+import bisect
+import numpy as np
+
+MAGIC = b'PQAILBL1'
+HEADER_SIZE = 16
+BYTES_PER_LABEL = 20    # width of labels in .items.bin.gz files
+LABELS_EXT = '.items.bin'
+ORDER_EXT = '.items.order'
+LEGACY_EXTS = ['.items.bin.gz', '.items.json']
+
+
+class LabelStore():
+
+    def __init__(self, labels, order=None):
+        self._labels = labels
+        self._order = order
+
+    @classmethod
+    def open(cls, labels_file):
+        """Open a labels file of any of the supported formats; only
+        `.items.bin` files are memory mapped."""
+        if labels_file.endswith('.gz'):
+            with gzip.open(labels_file, 'rb') as f:
+                return cls.from_bytes(f.read())
+        if labels_file.endswith('.json'):
+            with open(labels_file) as f:
+                return cls.from_list(json.load(f))
+
+        with open(labels_file, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            width = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+        if magic != MAGIC:
+            raise ValueError(f'Not a labels file: {labels_file}')
+        count = (os.path.getsize(labels_file) - HEADER_SIZE) // width
+        labels = _memmap(labels_file, f'S{width}', HEADER_SIZE, count)
+
+        order = None
+        order_file = labels_file[:-len(LABELS_EXT)] + ORDER_EXT
+        if os.path.exists(order_file):
+            order = _memmap(order_file, '<u4', 0, count)
+        return cls(labels, order)
+
+    @classmethod
+    def from_bytes(cls, data, width=BYTES_PER_LABEL):
+        return cls(np.frombuffer(data, dtype=f'S{width}'))
+
+    @classmethod
+    def from_list(cls, labels):
+        return cls(_to_array(labels))
+
+    def __getitem__(self, key):
+        return self._labels[key].decode('utf-8').strip()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def find(self, label):
+        """Return the keys that have the given label."""
+        target = label.encode('utf-8')
+        if self._order is None:
+            labels = np.char.strip(self._labels)
+            return np.flatnonzero(labels == target).tolist()
+
+        by_label = _SortedLabels(self._labels, self._order)
+        start = bisect.bisect_left(by_label, target)
+        end = bisect.bisect_right(by_label, target, lo=start)
+        return sorted(int(self._order[i]) for i in range(start, end))
+
+    @property
+    def nbytes(self):
+        order_bytes = 0 if self._order is None else self._order.nbytes
+        return self._labels.nbytes + order_bytes
+
+
+class _SortedLabels():
+
+    """Sequence view of labels in key order `order`, for `bisect`"""
+
+    def __init__(self, labels, order):
+        self._labels = labels
+        self._order = order
+
+    def __getitem__(self, i):
+        return self._labels[self._order[i]].strip()
+
+    def __len__(self):
+        return len(self._order)
+
+
+class LabelsDirectory():
+
+    """Reverse lookup of labels across all the labels files in a folder"""
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._stores = {}
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            if entry.name.endswith(LABELS_EXT):
+                index_id = entry.name[:-len(LABELS_EXT)]
+                self._stores[index_id] = LabelStore.open(entry.path)
+
+    def locate(self, label):
+        """Return the (index id, key) pairs that have the given label."""
+        return [(index_id, key)
+                for index_id, store in self._stores.items()
+                for key in store.find(label)]
+
+    def get(self, index_id, key):
+        return self._stores[index_id][key]
+
+
+def find_labels_file(folder, index_id):
+    """Path of an index's labels file, preferring the `.items.bin` format."""
+    for ext in [LABELS_EXT] + LEGACY_EXTS:
+        path = f'{folder}/{index_id}{ext}'
+        if os.path.exists(path):
+            return path
+    raise ValueError(f'Labels file not found for {index_id}')
+
+
+def write_labels(labels_file, labels, width=None):
+    """Write labels in the `.items.bin` format, along with the matching
+    `.items.order` file for reverse lookups."""
+    array = _to_array(labels, width)
+    header = np.zeros(2, dtype='<u4')
+    header[0] = array.dtype.itemsize
+    with open(labels_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(header.tobytes())
+        f.write(array.tobytes())
+
+    order = np.argsort(array, kind='stable').astype('<u4')
+    order.tofile(labels_file[:-len(LABELS_EXT)] + ORDER_EXT)
+
+
+def convert(src_file, labels_file=None):
+    """Convert a `.items.bin.gz` or `.items.json` labels file to the
+    `.items.bin` format; returns the path of the new file."""
+    for ext in LEGACY_EXTS:
+        if src_file.endswith(ext):
+            labels_file = labels_file or src_file[:-len(ext)] + LABELS_EXT
+            break
+    else:
+        raise ValueError(f'Unknown labels file type: {src_file}')
+
+    store = LabelStore.open(src_file)
+    labels = [store[i] for i in range(len(store))]
+    write_labels(labels_file, labels)
+    return labels_file
+
+
+def _to_array(labels, width=None):
+    encoded = [str(label).encode('utf-8') for label in labels]
+    width = width or max([len(label) for label in encoded] + [1])
+    return np.array(encoded, dtype=f'S{width}')
+
+
+def _memmap(path, dtype, offset, count):
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
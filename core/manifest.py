@@ -0,0 +1,266 @@
+"""
+Manifest of the vector indexes of a folder
+
+Index builders record each index they write in the folder's `manifest.json`:
+its backend, file, labels file, dimensions, vector count, size in bytes and
+checksum, and the doc type, years and CPC subclass encoded in its name (e.g.
+`2019.patent` or `H04W.2001-2005.npl`). Reading the manifest tells what
+indexes a folder has, and what they hold, without opening any index; see
+`Manifest.load` for index files copied in without being recorded.
+
+    {"version": 1, "indexes": [{"id": "2019.patent", "backend": "usearch",
+      "file": "2019.patent.usearch", "labels": "2019.patent.items.bin",
+      "dims": 384, "count": 1250000, "doc_type": "patent",
+      "years": [2019, 2019], "subclass": null, "bytes": 1040000000,
+      "checksum": "sha256:..."}, ...]}
+
+`scripts/build-manifest.py` writes the manifest of an existing folder.
+"""
+
+import os
+import re
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
+
+from core.labels import find_labels_file
+
+MANIFEST_FILE = 'manifest.json'
+VERSION = 1
+BACKENDS = {'.faiss': 'faiss', '.ann': 'annoy', '.usearch': 'usearch'}
+DOC_TYPES = ['patent', 'npl']
+YEARS_PATTERN = re.compile(r'^(\d{4})(?:-(\d{4}))?$')
+SUBCLASS_PATTERN = re.compile(r'^[A-HY]\d{2}[A-Z]?$')    # subclass, or class (e.g. H04)
+
+
+def parse_index_name(index_id):
+    """Doc type, years (a `(from, to)` range) and CPC subclass (or class)
+    encoded in the name of an index; None for those it does not encode."""
+    attrs = {'doc_type': None, 'years': None, 'subclass': None}
+    for token in index_id.split('.'):
+        years = YEARS_PATTERN.match(token)
+        if years:
+            start, end = years.groups()
+            attrs['years'] = (int(start), int(end or start))
+        elif SUBCLASS_PATTERN.match(token):
+            attrs['subclass'] = token
+        else:
+            for doc_type in DOC_TYPES:
+                if doc_type in token:
+                    attrs['doc_type'] = doc_type
+    return attrs
+
+
+def split_index_file(filename):
+    """(index id, backend) of an index file name, or None if it is not one"""
+    for ext, backend in BACKENDS.items():
+        if filename.endswith(ext):
+            return filename[:-len(ext)], backend
+    return None
+
+
+def file_checksum(path, chunk_size=2**20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return f'sha256:{digest.hexdigest()}'
+
+
+def make_entry(index_file, labels_file=None, dims=None, count=None, checksum=True):
+    """Manifest entry of an index file; `dims` and `count` are read from the
+    index when not given, see `read_header`."""
+    folder, filename = os.path.split(index_file)
+    index_id, backend = split_index_file(filename)
+    if labels_file is None:
+        labels_file = find_labels_file(folder, index_id)
+    if dims is None or count is None:
+        header_dims, header_count = read_header(index_file, dims)
+        dims = header_dims if dims is None else dims
+        count = header_count if count is None else count
+    attrs = parse_index_name(index_id)
+    return {
+        'id': index_id,
+        'backend': backend,
+        'file': filename,
+        'labels': os.path.basename(labels_file),
+        'dims': dims,
+        'count': count,
+        'doc_type': attrs['doc_type'],
+        'years': list(attrs['years']) if attrs['years'] else None,
+        'subclass': attrs['subclass'],
+        'bytes': os.path.getsize(index_file) + os.path.getsize(labels_file),
+        'checksum': file_checksum(index_file) if checksum else None
+    }
+
+
+def read_header(index_file, dims=None):
+    """(dims, count) of an index, read without loading it in memory. Annoy
+    files do not record their dimensions, which must be given to count
+    their vectors."""
+    backend = split_index_file(os.path.basename(index_file))[1]
+    if backend == 'usearch':
+        import usearch.index
+        meta = usearch.index.Index.metadata(index_file)
+        return meta['dimensions'], meta['count_present']
+    if backend == 'faiss':
+        import faiss
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        return index.d, index.ntotal
+    if dims is None:
+        return None, None
+    import annoy
+    index = annoy.AnnoyIndex(dims, 'angular')
+    index.load(index_file)
+    return dims, index.get_n_items()
+
+
+class Manifest():
+
+    def __init__(self, folder, entries=()):
+        self._folder = folder
+        self._entries = {}      # (index id, backend) -> entry
+        for entry in entries:
+            self.add(entry)
+
+    @classmethod
+    def read(cls, folder):
+        """Manifest of a folder, or None if it has none"""
+        path = os.path.join(folder, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != VERSION:
+            raise ValueError(f'Unsupported manifest version: {data.get("version")}')
+        return cls(folder, data['indexes'])
+
+    @classmethod
+    def from_files(cls, folder):
+        """Manifest made from the names of the index files of a folder, with
+        only the attributes encoded in them, for folders with no manifest"""
+        entries = []
+        for entry in os.scandir(folder):
+            parsed = split_index_file(entry.name)
+            if parsed:
+                index_id, backend = parsed
+                attrs = parse_index_name(index_id)
+                entries.append({'id': index_id, 'backend': backend, 'file': entry.name,
+                                'doc_type': attrs['doc_type'], 'years': attrs['years'],
+                                'subclass': attrs['subclass']})
+        return cls(folder, entries)
+
+    @classmethod
+    def load(cls, folder):
+        """Manifest of a folder, brought in line with its index files: files
+        it does not list (e.g. copied in without `record`) are added with
+        the attributes encoded in their names, and entries of files no
+        longer there are left out. For a folder with no manifest, the same
+        as `from_files`."""
+        scanned = cls.from_files(folder)
+        manifest = cls.read(folder)
+        if manifest is None:
+            return scanned
+        files = {entry['file'] for entry in scanned}
+        for entry in list(manifest):
+            if entry['file'] not in files:
+                manifest.remove(entry['id'], entry['backend'])
+        for entry in scanned:
+            if manifest.get(entry['id'], [entry['backend']]) is None:
+                manifest.add(entry)
+        return manifest
+
+    def save(self):
+        path = os.path.join(self._folder, MANIFEST_FILE)
+        entries = sorted(self._entries.values(), key=lambda e: (e['id'], e['backend']))
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'version': VERSION, 'indexes': entries}, f, indent=1)
+        os.replace(f'{path}.tmp', path)
+
+    def add(self, entry):
+        entry = dict(entry)
+        if entry.get('years'):
+            entry['years'] = tuple(entry['years'])
+        self._entries[(entry['id'], entry['backend'])] = entry
+
+    def remove(self, index_id, backend=None):
+        for key in [k for k in self._entries if k[0] == index_id]:
+            if backend is None or key[1] == backend:
+                del self._entries[key]
+
+    def get(self, index_id, backends=None):
+        """Entry of an index; of the first of `backends` it has, if given"""
+        for backend in backends or BACKENDS.values():
+            entry = self._entries.get((index_id, backend))
+            if entry:
+                return entry
+        return None
+
+    def ids(self, backends=None):
+        return {index_id for index_id, backend in self._entries
+                if backends is None or backend in backends}
+
+    def find(self, prefix=None, backends=None, doc_type=None, years=None, subclass=None):
+        """Ids of the indexes whose ids start with `prefix` and that can hold
+        documents of the given doc type, years (a `(from, to)` range, either
+        end may be None) and CPC subclass (or group, or class). Like the
+        routing of the vector search service, an index that does not encode
+        its years or subclass is not left out on that attribute."""
+        ids = set()
+        for (index_id, backend), entry in self._entries.items():
+            if backends is not None and backend not in backends:
+                continue
+            if prefix and not index_id.startswith(prefix):
+                continue
+            if doc_type and entry.get('doc_type') != doc_type:
+                continue
+            if years and entry.get('years'):
+                start, end = years
+                if start is not None and entry['years'][1] < int(start):
+                    continue
+                if end is not None and entry['years'][0] > int(end):
+                    continue
+            if subclass and entry.get('subclass'):
+                if not (entry['subclass'].startswith(subclass) or subclass.startswith(entry['subclass'])):
+                    continue
+            ids.add(index_id)
+        return ids
+
+    def verify(self, index_id, backend):
+        """Tell if an index file still has the checksum it was recorded with"""
+        entry = self._entries[(index_id, backend)]
+        path = os.path.join(self._folder, entry['file'])
+        return os.path.exists(path) and file_checksum(path) == entry.get('checksum')
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@contextmanager
+def _locked(folder):
+    """Exclusive lock on a folder; the folder itself is locked, so that no
+    lock file is left in it."""
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)    # releases the lock
+
+
+def record(index_file, labels_file=None, dims=None, count=None):
+    """Add (or update) the entry of an index in the manifest of its folder;
+    for index builders, once the index and its labels are written. A folder
+    without a manifest gets one that also lists the indexes already in it,
+    with the attributes encoded in their names, see `Manifest.load`."""
+    folder = os.path.dirname(os.path.abspath(index_file))
+    entry = make_entry(index_file, labels_file, dims, count)
+    with _locked(folder):
+        manifest = Manifest.load(folder)
+        manifest.add(entry)
+        manifest.save()
+    return entry
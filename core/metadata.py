@@ -0,0 +1,100 @@
+"""
+Per-index metadata columns for filtering vector search results
+
+The `.meta.npy` file of an index holds one record per key, in key order,
+with the document's publication, filing and priority dates as YYYYMMDD
+integers (0 when unknown) and its country code packed into a uint16 (0 for
+non-patent literature). The vector search service maps these files and
+evaluates date and country code filters on them, so that it returns only
+results that pass the filters.
+"""
+
+import re
+import numpy as np
+from dateutil.parser import parse as parse_date
+
+METADATA_EXT = '.meta.npy'
+COLUMNS_DTYPE = np.dtype([
+    ('publication', '<i4'),
+    ('filing', '<i4'),
+    ('priority', '<i4'),
+    ('cc', '<u2')
+])
+DATE_COLUMNS = ['publication', 'filing', 'priority']
+
+
+def encode_date(date):
+    """YYYYMMDD integer for a date string (or date), 0 if there is none."""
+    if not date:
+        return 0
+    if not isinstance(date, str):
+        return int(date.strftime('%Y%m%d'))
+    if re.match(r'^\d{8}$', date):
+        return int(date)
+    return int(parse_date(date).strftime('%Y%m%d'))
+
+
+def encode_cc(code):
+    if not code or len(code) < 2:
+        return 0
+    return (ord(code[0]) << 8) | ord(code[1])
+
+
+def doc_to_row(doc):
+    """Metadata record of a patent or NPL document from the database, with
+    the same meaning of dates as the filters in `core/filters.py`."""
+    if doc is None:
+        return (0, 0, 0, 0)
+    if 'publicationNumber' not in doc:  # npl
+        publication = encode_date(f"{doc['year']}-12-31") if doc.get('year') else 0
+        return (publication, 0, 0, 0)
+    return (
+        encode_date(doc.get('publicationDate')),
+        encode_date(doc.get('filingDate')),
+        encode_date(doc.get('priorityDate')),
+        encode_cc(doc['publicationNumber'][:2])
+    )
+
+
+def write_columns(path, rows):
+    np.save(path, np.array(rows, dtype=COLUMNS_DTYPE))
+
+
+def open_columns(path):
+    return np.load(path, mmap_mode='r')
+
+
+class Predicate():
+
+    """A conjunction of date ranges and a country code set, given as e.g.
+    `{"publication": [20150101, null], "cc": ["US", "EP"]}`, evaluated
+    over metadata columns."""
+
+    def __init__(self, spec):
+        self._ranges = []
+        for column in DATE_COLUMNS:
+            if spec.get(column):
+                after, before = spec[column]
+                after = encode_date(after) if after else None
+                before = encode_date(before) if before else None
+                self._ranges.append((column, after, before))
+        codes = spec.get('cc') or []
+        self._codes = np.array([encode_cc(code) for code in codes], dtype='<u2')
+
+    def __bool__(self):
+        return bool(self._ranges) or len(self._codes) > 0
+
+    def __call__(self, columns, keys=None):
+        """Boolean mask of the records (or those at `keys`) that pass."""
+        rows = columns if keys is None else columns[np.asarray(keys, dtype=np.int64)]
+        mask = np.ones(len(rows), dtype=bool)
+        for column, after, before in self._ranges:
+            values = rows[column]
+            mask &= values > 0
+            if after is not None:
+                mask &= values >= after
+            if before is not None:
+                mask &= values <= before
+        if len(self._codes):
+            mask &= np.isin(rows['cc'], self._codes)
+        return mask
@@ -1,6 +1,11 @@
+import os
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 from core.indexes import VectorIndex
 
+# Haystacks are searched in parallel; the index libraries release the GIL
+executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='searcher')
+
 class Searcher():
 
     _invalid_needle_msg = "Invalid needle"
@@ -15,6 +20,9 @@ class Searcher():
     
     def _search_fn(self, needle, haystack, n):
         raise NotImplementedError
+
+    def _search_batch_fn(self, needles, haystack, n):
+        return [self._search_fn(needle, haystack, n) for needle in needles]
     
     def _sort_fn(self, results):
         return results
@@ -26,6 +34,19 @@ class Searcher():
         n_results = max(0, n_results)
         return self._search_many(needle, haystack, n_results)
 
+    def search_many(self, needles, haystack, n_results=10):
+        """Results of each of the `needles`, as `search` would give them,
+        from searching every haystack once for all the needles."""
+        for needle in needles:
+            self._check_needle_compatibility(needle)
+        self._check_haystack_compatibility(haystack)
+        haystack = [haystack] if self._is_one_haystack(haystack) else haystack
+        n_results = max(0, n_results)
+        per_haystack = self._fan_out(
+            lambda hs: self._search_batch_fn(needles, hs, n_results), haystack)
+        return [self._merge([results[i] for results in per_haystack], n_results)
+                for i in range(len(needles))]
+
     def _check_needle_compatibility(self, needle):
         if not self._needle_compatibility_fn(needle):
             raise Exception(self._invalid_needle_msg)
@@ -47,7 +68,16 @@ class Searcher():
         raise ValueError
     
     def _search_many(self, needle, haystack, n):
-        list_of_lists = [self._search_one(needle, hs, n) for hs in haystack]
+        list_of_lists = self._fan_out(lambda hs: self._search_one(needle, hs, n), haystack)
+        return self._merge(list_of_lists, n)
+
+    def _fan_out(self, fn, haystack):
+        haystack = list(haystack)
+        if len(haystack) <= 1:
+            return [fn(hs) for hs in haystack]
+        return list(executor.map(fn, haystack))
+
+    def _merge(self, list_of_lists, n):
         results = self._flatten(list_of_lists)
         results = self._sort_fn(results)
         results = self._deduplicate(results)
@@ -81,9 +111,10 @@ class VectorIndexSearcher(Searcher):
     _invalid_haystack_msg = "Can only search VectorIndex objects"
     _no_haystack_msg = "No VectorIndex objects provided for search"
 
-    def __init__(self):
+    def __init__(self, params=None):
         super().__init__()
         self._compat_haystack_type = VectorIndex
+        self._params = params   # see core/search_params.py
 
     def _needle_compatibility_fn(self, needle):
         if not hasattr(needle, "__iter__"):
@@ -95,11 +126,17 @@ class VectorIndexSearcher(Searcher):
         return True
 
     def _search_fn(self, vector, index, n):
-        pairs = index.search(vector, n)
+        pairs = index.search(vector, n, self._params)
+        return self._to_triplets(pairs, index.name)
+
+    def _search_batch_fn(self, vectors, index, n):
+        ids, dists = index.search_many(vectors, n, self._params)
+        return [self._to_triplets(zip(row_ids, row_dists.tolist()), index.name)
+                for row_ids, row_dists in zip(ids, dists)]
+
+    def _to_triplets(self, pairs, index_id):
         pairs = [(res_id, dist) for res_id, dist in pairs if 0.0 <= dist <= 2.0]
-        index_id = index.name
-        triplets = [(res_id, index_id, dist) for res_id, dist in pairs]
-        return triplets
+        return [(res_id, index_id, dist) for res_id, dist in pairs]
 
     def _sort_fn(self, triplets):
         return sorted(triplets, key=lambda x: x[-1])
@@ -0,0 +1,110 @@
+"""
+Recall/latency knobs of a vector search, common to all index backends
+
+Each backend reads the knobs it has and ignores the others:
+
+    expansion   size of the candidate list of HNSW graph searches, i.e.
+                `expansion_search` of usearch and `efSearch` of FAISS
+    nprobe      number of inverted lists visited by FAISS IVF indexes
+    search_k    number of tree nodes inspected by Annoy
+    exact       brute force search instead of a graph search (usearch)
+
+A knob left as None keeps the value the index was built or loaded with.
+"""
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+PRESETS = {
+    'fast': {'expansion': 32, 'nprobe': 8, 'search_k': 300},
+    'default': {},
+    'high-recall': {'expansion': 256, 'nprobe': 64, 'search_k': 10000},
+}
+
+
+class SearchParams():
+
+    """Search knobs given as a preset name, or a dict of knobs optionally
+    based on a preset, e.g. `{"preset": "fast", "expansion": 48}`."""
+
+    def __init__(self, expansion=None, nprobe=None, search_k=None, exact=False):
+        self.expansion = expansion
+        self.nprobe = nprobe
+        self.search_k = search_k
+        self.exact = exact
+
+    @classmethod
+    def from_preset(cls, name):
+        if name not in PRESETS:
+            raise ValueError(f'Unknown search preset: {name}')
+        return cls(**PRESETS[name])
+
+    @classmethod
+    def from_spec(cls, spec):
+        if spec is None or isinstance(spec, cls):
+            return spec or cls()
+        if isinstance(spec, str):
+            return cls.from_preset(spec)
+        spec = dict(spec)
+        params = cls.from_preset(spec.pop('preset', None) or 'default')
+        unknown = set(spec) - set(vars(params))
+        if unknown:
+            raise ValueError(f'Unknown search parameters: {", ".join(sorted(unknown))}')
+        for knob, value in spec.items():
+            setattr(params, knob, value)
+        return params
+
+    def to_dict(self):
+        knobs = {'expansion': self.expansion, 'nprobe': self.nprobe,
+                 'search_k': self.search_k, 'exact': self.exact or None}
+        return {k: v for k, v in knobs.items() if v is not None}
+
+    def __eq__(self, other):
+        return isinstance(other, SearchParams) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'SearchParams({self.to_dict()})'
+
+
+class SettingLock():
+
+    """Lock of a setting that searches of a shared index change, e.g. the
+    efSearch of a FAISS HNSW index, which is not a per search parameter.
+    Searches that need the same value hold the lock together; a search that
+    needs another value waits until they are done, and those that arrive
+    meanwhile wait for it in turn, so that no value waits forever.
+
+        with lock.holding(expansion):
+            index.hnsw.efSearch = expansion
+            ...
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._holders = 0
+        self._waiting = Counter()   # value -> searches waiting to hold it
+
+    @contextmanager
+    def holding(self, value):
+        with self._cond:
+            self._waiting[value] += 1
+            while not self._can_hold(value):
+                self._cond.wait()
+            self._waiting[value] -= 1
+            self._value = value
+            self._holders += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._holders -= 1
+                if not self._holders:
+                    self._cond.notify_all()
+
+    def _can_hold(self, value):
+        if not self._holders:
+            return True
+        others = sum(self._waiting.values()) - self._waiting[value]
+        return value == self._value and not others
@@ -2,6 +2,7 @@ import os
 import re
 import numpy as np
 import json
+import threading
 from sklearn.decomposition import TruncatedSVD
 from sentence_transformers import SentenceTransformer
 
@@ -36,6 +37,7 @@ class SentBERTVectorizer:
             self._model_path = models_dir + model
             self._name = 'SentBERTVectorizer'
             self._model = None # Lazy loads
+            self._load_lock = threading.Lock()
 
         def load (self):
             self._model = SentenceTransformer(self._model_path)
@@ -51,8 +53,11 @@ class SentBERTVectorizer:
             return vecs
 
         def _load_if_needed(self):
+            # Embedding threads (e.g. those of IndexBuilder) load it once
             if self._model is None:
-                self.load()
+                with self._load_lock:
+                    if self._model is None:
+                        self.load()
 
     __instance = __impl()
 
@@ -56,6 +56,7 @@ class SuggestCPCs(TextBasedRequest):
         search_req['type'] = 'patent'
         search_req['n'] = 25
         search_req['cc'] = 'US'
+        search_req['preset'] = self._data.get('preset', 'fast')
         results = SearchRequest102(search_req).serve()['results']
         patents = [Patent(res['id']) for res in results]
         return patents
@@ -80,6 +81,7 @@ class PredictGAUs(TextBasedRequest):
         search_req['dtype'] = 'publication'
         search_req['n'] = 25
         search_req['cc'] = 'US'
+        search_req['preset'] = self._data.get('preset', 'fast')
         results = SearchRequest102(search_req).serve()['results']
         patents = [Patent(res['id']) for res in results]
         return patents
@@ -11,14 +11,16 @@ route_config = [
         "path": "/suggest/cpcs",
         "handler": API.SuggestCPCs,
         "rateLimit": 5,
-        "protected": True
+        "protected": True,
+        "searchPreset": "fast"
     },
     {
         "method": "GET",
         "path": "/predict/gaus",
         "handler": API.PredictGAUs,
         "rateLimit": 5,
-        "protected": True
+        "protected": True,
+        "searchPreset": "fast"
     },
     {
         "method": "GET",
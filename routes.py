@@ -31,7 +31,8 @@ routes_config = [
         "handler": API.PatentPriorArtRequest,
         'rateLimit': 5,
         'protected': True,
-        'metered': True
+        'metered': True,
+        'searchPreset': 'high-recall'
     },
     {
         "method": "GET",
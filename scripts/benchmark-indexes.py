@@ -0,0 +1,275 @@
+"""
+Compare the vector index backends (FAISS, Annoy, usearch and the vector
+search service) on recall, latency, build time and memory
+
+Usage: python scripts/benchmark-indexes.py [--synthetic 100000 | --vectors FILE.npy]
+                                           [--out DIR] [--json FILE] [--csv FILE]
+
+The indexes are built from synthetic vectors (clustered, so that they have
+some structure like real embeddings) or from an exported sample of vectors,
+and written to --out as files that `IndexesDirectory` and the service can
+read. They are searched through the index classes of `core/indexes.py` and,
+for the service, through `services/vector_search.py` in this process. The
+exact top k of each query, found by brute force, is the ground truth for
+recall@k.
+
+Every backend is searched with a sweep of its recall/latency knob (see
+`core/search_params.py`), which gives a recall/latency curve per backend.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+import psutil
+import annoy
+import faiss
+import usearch.index
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+sys.path.append(BASE_DIR)
+from core.indexes import AnnoyIndexReader, FaissIndexReader, USearchIndexReader
+from core.labels import write_labels
+from core.search_params import SearchParams
+
+INDEX_ID = 'benchmark'
+EXPANSIONS = [16, 32, 64, 128, 256, 512]
+NPROBES = [1, 4, 16, 64, 256]
+SEARCH_KS = [100, 300, 1000, 3000, 10000, 30000]
+
+
+def synthetic_vectors(n, dims, n_clusters=1000, noise=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dims)).astype(np.float32)
+    X = centers[rng.integers(n_clusters, size=n)]
+    X += rng.normal(scale=noise, size=X.shape).astype(np.float32)
+    return normalize(X)
+
+
+def normalize(X):
+    X = np.asarray(X, dtype=np.float32)
+    return X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+
+
+def ground_truth(X, Q, k, batch_size=64):
+    """Keys of the exact top k (by cosine similarity) of each query."""
+    truth = []
+    for i in range(0, len(Q), batch_size):
+        S = X @ Q[i:i+batch_size].T
+        top = np.argpartition(-S, k - 1, axis=0)[:k]
+        truth.extend(set(col.tolist()) for col in top.T)
+    return truth
+
+
+def rss():
+    return psutil.Process().memory_info().rss
+
+
+def file_size(*paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+def build_faiss(X, folder, factory):
+    name = f'{INDEX_ID}.{factory.replace(",", "_")}'
+    start = time.perf_counter()
+    index = faiss.index_factory(X.shape[1], factory)
+    index.train(X)
+    index.add(X)
+    build_time = time.perf_counter() - start
+    faiss.write_index(index, f'{folder}/{name}.faiss')
+    write_json_labels(f'{folder}/{name}.items.json', len(X))
+    return name, build_time, file_size(f'{folder}/{name}.faiss')
+
+
+def build_annoy(X, folder, n_trees):
+    name = f'{INDEX_ID}.trees{n_trees}'
+    start = time.perf_counter()
+    index = annoy.AnnoyIndex(X.shape[1], 'angular')
+    for i, x in enumerate(X):
+        index.add_item(i, x)
+    index.build(n_trees)
+    build_time = time.perf_counter() - start
+    index.save(f'{folder}/{name}.ann')
+    write_json_labels(f'{folder}/{name}.items.json', len(X))
+    return name, build_time, file_size(f'{folder}/{name}.ann')
+
+
+def build_usearch(X, folder, dtype):
+    start = time.perf_counter()
+    index = usearch.index.Index(ndim=X.shape[1], metric='cos', dtype=dtype)
+    index.add(np.arange(len(X)), X)
+    build_time = time.perf_counter() - start
+    index.save(f'{folder}/{INDEX_ID}.usearch')
+    write_labels(f'{folder}/{INDEX_ID}.items.bin', [str(i) for i in range(len(X))])
+    return INDEX_ID, build_time, file_size(f'{folder}/{INDEX_ID}.usearch')
+
+
+def write_json_labels(path, n):
+    with open(path, 'w') as f:
+        json.dump([str(i) for i in range(n)], f)
+
+
+def run(search_fn, Q, truth, k):
+    """Recall@k and latencies of searching the queries one by one; `search_fn`
+    returns the keys of the matches of a query."""
+    latencies, recalls = [], []
+    for q, expected in zip(Q, truth):
+        start = time.perf_counter()
+        keys = search_fn(q)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(expected & set(keys[:k])) / len(expected))
+    latencies = np.array(latencies) * 1000
+    return {
+        'recall': float(np.mean(recalls)),
+        'qps': float(len(Q) / (latencies.sum() / 1000)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95))
+    }
+
+
+def sweep(backend, config, index, Q, truth, k, knobs, extra):
+    """Search `index` (a `VectorIndex`) with each of the `knobs`."""
+    rows = []
+    for knob in knobs:
+        params = SearchParams.from_spec(knob)
+        search_fn = lambda q: [int(label) for label, _ in index.search(q, k, params)]
+        rows.append({'backend': backend, 'config': config,
+                     'params': json.dumps(params.to_dict()),
+                     **run(search_fn, Q, truth, k), **extra})
+    return rows
+
+
+def benchmark_faiss(X, Q, truth, k, folder, factories):
+    rows = []
+    for factory in factories:
+        name, build_time, size = build_faiss(X, folder, factory)
+        before = rss()
+        index = FaissIndexReader().read_from_files(f'{folder}/{name}.faiss',
+                                                   f'{folder}/{name}.items.json', name)
+        extra = {'build_s': build_time, 'size_bytes': size, 'rss_bytes': rss() - before}
+        knobs = [{'nprobe': p} for p in NPROBES] if 'IVF' in factory else \
+                [{'expansion': e} for e in EXPANSIONS]
+        rows += sweep('faiss', factory, index, Q, truth, k, knobs, extra)
+    return rows
+
+
+def benchmark_annoy(X, Q, truth, k, folder, n_trees):
+    name, build_time, size = build_annoy(X, folder, n_trees)
+    before = rss()
+    reader = AnnoyIndexReader(X.shape[1], 'angular')
+    index = reader.read_from_files(f'{folder}/{name}.ann', f'{folder}/{name}.items.json', name)
+    extra = {'build_s': build_time, 'size_bytes': size, 'rss_bytes': rss() - before}
+    knobs = [{'search_k': s} for s in SEARCH_KS]
+    return sweep('annoy', f'{n_trees} trees', index, Q, truth, k, knobs, extra)
+
+
+def benchmark_usearch(X, Q, truth, k, folder, dtype, build):
+    name, build_time, size = build
+    before = rss()
+    reader = USearchIndexReader(X.shape[1], 'cos')
+    index = reader.read_from_files(f'{folder}/{name}.usearch', f'{folder}/{name}.items.bin', name)
+    extra = {'build_s': build_time, 'size_bytes': size, 'rss_bytes': rss() - before}
+    knobs = [{'expansion': e} for e in EXPANSIONS] + [{'exact': True}]
+    return sweep('usearch', dtype, index, Q, truth, k, knobs, extra)
+
+
+def benchmark_service(X, Q, truth, k, folder, dtype, build):
+    """The service's search path, without HTTP: fan-out over its executor,
+    rescoring and label resolution."""
+    from services import vector_search as vs
+    vs.indexes_dir = f'{folder}/'
+    before = rss()
+    vs.load_indexes()
+    vs.start_executor()
+    extra = {'build_s': build[1], 'size_bytes': build[2], 'rss_bytes': rss() - before}
+    rows = []
+    try:
+        for knob in [{'expansion': e} for e in EXPANSIONS] + [{'exact': True}]:
+            params = SearchParams.from_spec(knob)
+            search_fn = lambda q: [int(label) for label, _, _ in
+                                   vs.concurrent_search(q, k, params=params)]
+            rows.append({'backend': 'service', 'config': dtype,
+                         'params': json.dumps(params.to_dict()),
+                         **run(search_fn, Q, truth, k), **extra})
+    finally:
+        vs.stop_executor()
+    return rows
+
+
+def print_row(row):
+    print(f"{row['backend']:<10}{row['config']:<24}{row['params']:<28}{row['recall']:>8.3f}"
+          f"{row['qps']:>10.0f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}"
+          f"{row['build_s']:>9.1f}{row['size_bytes'] / 2**20:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the vector index backends')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--synthetic', type=int, default=100000, help='Number of synthetic vectors')
+    source.add_argument('--vectors', help='.npy file of vectors to index, e.g. an exported sample')
+    parser.add_argument('--dims', type=int, default=384, help='Dimensions of synthetic vectors')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--backends', default='faiss,annoy,usearch,service')
+    parser.add_argument('--faiss', default='OPQ16_64,HNSW32;HNSW32;IVF{nlist},Flat',
+                        help='FAISS index factory strings, separated by ";"')
+    parser.add_argument('--trees', type=int, default=64, help='Number of Annoy trees')
+    parser.add_argument('--dtype', default='bf16', help='Scalar type of the usearch index')
+    parser.add_argument('--threads', type=int, default=1, help='FAISS threads per search')
+    parser.add_argument('--out', help='Directory for the index files (default: a temporary one)')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    parser.add_argument('--csv', help='Write the results to this CSV file')
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = normalize(np.load(args.vectors, mmap_mode='r'))
+        X, Q = vectors[:-args.queries], vectors[-args.queries:]
+    else:
+        X = synthetic_vectors(args.synthetic + args.queries, args.dims)
+        X, Q = X[:-args.queries], X[-args.queries:]
+    print(f'{len(X)} vectors, {len(Q)} queries, {X.shape[1]} dimensions')
+    truth = ground_truth(X, Q, args.k)
+    faiss.omp_set_num_threads(args.threads)
+
+    tmp = tempfile.TemporaryDirectory() if not args.out else None
+    folder = args.out or tmp.name
+    os.makedirs(folder, exist_ok=True)
+    backends = args.backends.split(',')
+    nlist = int(4 * np.sqrt(len(X)))
+    factories = [f.format(nlist=nlist) for f in args.faiss.split(';')]
+
+    print(f"{'backend':<10}{'config':<24}{'params':<28}{'recall@' + str(args.k):>8}"
+          f"{'qps':>10}{'p50 ms':>9}{'p95 ms':>9}{'build s':>9}{'MiB':>9}")
+    results = []
+    runs = []
+    if 'faiss' in backends:
+        runs.append(lambda: benchmark_faiss(X, Q, truth, args.k, folder, factories))
+    if 'annoy' in backends:
+        runs.append(lambda: benchmark_annoy(X, Q, truth, args.k, folder, args.trees))
+    if 'usearch' in backends or 'service' in backends:
+        build = build_usearch(X, folder, args.dtype)
+        if 'usearch' in backends:
+            runs.append(lambda: benchmark_usearch(X, Q, truth, args.k, folder, args.dtype, build))
+        if 'service' in backends and X.shape[1] != 384:
+            print('Skipping the service, which serves 384-d indexes only')
+        elif 'service' in backends:
+            runs.append(lambda: benchmark_service(X, Q, truth, args.k, folder, args.dtype, build))
+    for fn in runs:
+        for row in fn():
+            results.append(row)
+            print_row(row)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+    if tmp:
+        tmp.cleanup()
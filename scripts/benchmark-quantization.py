@@ -0,0 +1,103 @@
+"""
+Compare quantized usearch indexes with the full precision ones they were made
+from, see `scripts/quantize-usearch-index.py`
+
+Usage: python scripts/benchmark-quantization.py REFERENCE_DIR QUANTIZED_DIR [-k 10]
+
+For each index, queries are made from randomly picked vectors of the index
+with some noise added. The exact top k of every query, found by brute force
+over the float32 vectors, is the ground truth for recall@k. Reported for the
+reference index, the quantized index and the quantized index with rescoring:
+recall@k and the p50/p95 latency of single-threaded searches.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+from usearch.index import Index
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+sys.path.append(BASE_DIR)
+from services.vector_search import VECTORS_EXT, RESCORE_FACTOR, rescore, cosine_distances
+
+
+def make_queries(vectors, n_queries, noise=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    Q = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    Q += rng.normal(scale=noise / np.sqrt(Q.shape[1]), size=Q.shape).astype(np.float32)
+    return Q
+
+
+def ground_truth(vectors, Q, k, batch_size=100000):
+    """Keys of the exact top k of each query."""
+    best = []
+    for q in Q:
+        dists = np.concatenate([cosine_distances(np.asarray(vectors[i:i+batch_size], dtype=np.float32), q)
+                                for i in range(0, len(vectors), batch_size)])
+        top = np.argpartition(dists, k - 1)[:k] if k < len(dists) else np.arange(len(dists))
+        best.append(set(top.tolist()))
+    return best
+
+
+def run(search_fn, Q, truth, k):
+    latencies, recalls = [], []
+    for q, expected in zip(Q, truth):
+        start = time.perf_counter()
+        keys = search_fn(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected & set(keys[:k].tolist())) / len(expected))
+    return {
+        'recall': float(np.mean(recalls)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95))
+    }
+
+
+def benchmark(index_id, reference_dir, quantized_dir, k, n_queries, factor):
+    reference = Index.restore(f'{reference_dir}/{index_id}.usearch', view=True)
+    quantized = Index.restore(f'{quantized_dir}/{index_id}.usearch', view=True)
+    vectors = np.load(f'{quantized_dir}/{index_id}{VECTORS_EXT}', mmap_mode='r')
+    Q = make_queries(vectors, n_queries)
+    truth = ground_truth(vectors, Q, k)
+
+    variants = {
+        f'reference ({reference.dtype.name.lower()})': lambda q: reference.search(q, k, threads=1).keys,
+        f'quantized ({quantized.dtype.name.lower()})': lambda q: quantized.search(q, k, threads=1).keys,
+        f'quantized + rescoring x{factor}':
+            lambda q: rescore(vectors, q, quantized.search(q, k * factor, threads=1).keys, k)[0]
+    }
+    rows = []
+    for name, fn in variants.items():
+        rows.append({'index': index_id, 'variant': name, **run(fn, Q, truth, k)})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark quantized usearch indexes')
+    parser.add_argument('reference_dir')
+    parser.add_argument('quantized_dir')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--factor', type=int, default=RESCORE_FACTOR, help='Rescoring over-fetch factor')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    index_ids = sorted(entry.name[:-len(VECTORS_EXT)] for entry in os.scandir(args.quantized_dir)
+                       if entry.name.endswith(VECTORS_EXT))
+    results = []
+    print(f"{'index':<24}{'variant':<32}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for index_id in index_ids:
+        for row in benchmark(index_id, args.reference_dir, args.quantized_dir,
+                             args.k, args.queries, args.factor):
+            results.append(row)
+            print(f"{row['index']:<24}{row['variant']:<32}{row['recall']:>10.3f}"
+                  f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,59 @@
+"""
+Write the manifest of a folder of indexes built before index builders
+recorded them in it, see `core/manifest.py`
+
+Usage: python scripts/build-manifest.py [indexes_dir] [--dims 1024] [--verify]
+
+Dimensions and counts are read from the index files' headers; Annoy files
+don't record their dimensions, which are taken from --dims. With --verify,
+the checksums of an existing manifest are checked instead.
+"""
+import os
+import sys
+import argparse
+from pathlib import Path
+from tqdm import tqdm
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+INDEXES_DIR = "{}/indexes".format(BASE_DIR)
+
+sys.path.append(BASE_DIR)
+from core.manifest import Manifest, make_entry, split_index_file
+
+
+def build(folder, annoy_dims):
+    files = sorted(entry.path for entry in os.scandir(folder)
+                   if split_index_file(entry.name))
+    manifest = Manifest(folder)
+    for index_file in tqdm(files):
+        dims = annoy_dims if index_file.endswith('.ann') else None
+        try:
+            manifest.add(make_entry(index_file, dims=dims))
+        except ValueError as e:  # e.g. no labels file
+            print(f'Skipping {os.path.basename(index_file)}: {e}')
+    manifest.save()
+    print(f'{len(manifest)} indexes recorded in {folder}')
+
+
+def verify(folder):
+    manifest = Manifest.read(folder)
+    if manifest is None:
+        sys.exit(f'{folder} has no manifest')
+    bad = [f"{entry['id']} ({entry['backend']})" for entry in tqdm(list(manifest))
+           if not manifest.verify(entry['id'], entry['backend'])]
+    for name in bad:
+        print(f'Checksum mismatch or missing file: {name}')
+    print(f'{len(manifest) - len(bad)} of {len(manifest)} indexes match the manifest')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the manifest of a folder of indexes')
+    parser.add_argument('indexes_dir', nargs='?', default=INDEXES_DIR)
+    parser.add_argument('--dims', type=int, default=1024, help='Dimensions of Annoy indexes')
+    parser.add_argument('--verify', action='store_true', help='Check the checksums of the manifest')
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args.indexes_dir)
+    else:
+        build(args.indexes_dir, args.dims)
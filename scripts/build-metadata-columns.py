@@ -0,0 +1,56 @@
+"""
+Write the metadata columns (.meta.npy) of vector indexes, which the vector
+search service uses for filtering results by date and country code, see
+`core/metadata.py`
+
+Usage: python scripts/build-metadata-columns.py [indexes_dir]
+"""
+import os
+import sys
+from pathlib import Path
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+INDEXES_DIR = "{}/indexes".format(BASE_DIR)
+BATCH_SIZE = 1000
+
+sys.path.append(BASE_DIR)
+load_dotenv(f'{BASE_DIR}/.env')
+from core.db import PAT_COLLS, NPL_COLL, normalize_patent_number_for_mongodb
+from core.labels import LabelStore, find_labels_file
+from core.metadata import METADATA_EXT, doc_to_row, write_columns
+
+folder = sys.argv[1] if len(sys.argv) > 1 else INDEXES_DIR
+FIELDS = {'publicationNumber': 1, 'publicationDate': 1, 'filingDate': 1,
+          'priorityDate': 1, 'id': 1, 'year': 1}
+
+
+def fetch_docs(labels):
+    """Map of the given labels to their documents; missing ones are left out."""
+    docs = {}
+    pns = {normalize_patent_number_for_mongodb(l): l for l in labels if l[:2].isupper()}
+    for coll in PAT_COLLS:
+        if not pns:
+            break
+        for doc in coll.find({'publicationNumber': {'$in': list(pns)}}, FIELDS):
+            docs[pns.pop(doc['publicationNumber'])] = doc
+    npls = [l for l in labels if not l[:2].isupper()]
+    for doc in NPL_COLL.find({'id': {'$in': npls}}, FIELDS):
+        docs[doc['id']] = doc
+    return docs
+
+
+index_ids = sorted(entry.name[:-len('.usearch')] for entry in os.scandir(folder)
+                   if entry.name.endswith('.usearch'))
+for index_id in index_ids:
+    metadata_file = f'{folder}/{index_id}{METADATA_EXT}'
+    if os.path.exists(metadata_file):
+        continue
+    labels = LabelStore.open(find_labels_file(folder, index_id))
+    rows = []
+    for i in tqdm(range(0, len(labels), BATCH_SIZE), desc=index_id):
+        batch = [labels[key] for key in range(i, min(i + BATCH_SIZE, len(labels)))]
+        docs = fetch_docs(batch)
+        rows.extend(doc_to_row(docs.get(label)) for label in batch)
+    write_columns(metadata_file, rows)
@@ -0,0 +1,32 @@
+"""
+Convert index labels files (.items.bin.gz, .items.json) to the memory-mapped
+.items.bin format, see `core/labels.py`
+
+Usage: python scripts/convert-labels.py [indexes_dir]
+"""
+import os
+import sys
+from pathlib import Path
+from tqdm import tqdm
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+INDEXES_DIR = "{}/indexes".format(BASE_DIR)
+
+sys.path.append(BASE_DIR)
+from core.labels import LABELS_EXT, LEGACY_EXTS, convert
+
+folder = sys.argv[1] if len(sys.argv) > 1 else INDEXES_DIR
+
+sources = {}
+for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+    for ext in LEGACY_EXTS:
+        if entry.name.endswith(ext):
+            index_id = entry.name[:-len(ext)]
+            sources.setdefault(index_id, entry.path) # prefer .items.bin.gz
+
+todo = [(index_id, path) for index_id, path in sources.items()
+        if not os.path.exists(f'{folder}/{index_id}{LABELS_EXT}')]
+print(f'{len(todo)} of {len(sources)} labels files need conversion')
+
+for index_id, path in tqdm(todo):
+    convert(path)
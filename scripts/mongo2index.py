@@ -0,0 +1,101 @@
+"""
+Build vector indexes of documents streamed from a MongoDB collection
+
+Usage: python scripts/mongo2index.py INDEX_ID [--coll bibliography]
+                                     [--query '{"publicationDate": {"$gte": "2021-08-07"}}']
+                                     [--backends usearch,faiss,annoy] [--out INDEXES_DIR]
+
+Documents are read in `_id` order, with only their id and text fields, and
+their texts are embedded in batches with `SentBERTVectorizer.encode_many`,
+see `core/index_builder.py`. Rerunning an interrupted build with the same
+arguments resumes it from its last checkpoint; --restart starts it over.
+"""
+import os
+import sys
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+from bson import json_util
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+INDEXES_DIR = "{}/indexes".format(BASE_DIR)
+
+sys.path.append(BASE_DIR)
+load_dotenv(f'{BASE_DIR}/.env')
+from core.db import MONGO_CLIENT, MONGO_DBNAME, MONGO_PAT_COLL
+from core.index_builder import IndexBuilder, BUILD_FNS
+from core.vectorizers import SentBERTVectorizer
+
+
+def get_field(doc, field):
+    """Value of a (possibly dotted) field of a document"""
+    for key in field.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def mongo_source(coll, query, id_field, text_field, batch_size):
+    """Source of `IndexBuilder.embed`; documents without an id or a text
+    are left out."""
+    def source(token):
+        criteria = query
+        if token is not None:
+            criteria = {'$and': [query, {'_id': {'$gt': json_util.loads(token)}}]}
+        cursor = coll.find(criteria, {id_field: 1, text_field: 1})
+        cursor = cursor.sort('_id', 1).batch_size(batch_size)
+        batch = []
+        for doc in cursor:
+            label, text = get_field(doc, id_field), get_field(doc, text_field)
+            if not label or not text:
+                continue
+            batch.append((json_util.dumps(doc['_id']), str(label), text))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    return source
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build vector indexes from a Mongo collection')
+    parser.add_argument('index_id', help='e.g. 2021.patent, see core/manifest.py')
+    parser.add_argument('--coll', default=MONGO_PAT_COLL.split(',')[0])
+    parser.add_argument('--query', default='{}', help='Mongo query (extended JSON)')
+    parser.add_argument('--id-field', default='publicationNumber')
+    parser.add_argument('--text-field', default='abstract')
+    parser.add_argument('--backends', default='usearch', help='Any of usearch,faiss,annoy')
+    parser.add_argument('--out', default=INDEXES_DIR, help='Directory for the indexes')
+    parser.add_argument('--work-dir', help='Directory for chunks and checkpoints')
+    parser.add_argument('--batch-size', type=int, default=256, help='Documents per embedding batch')
+    parser.add_argument('--workers', type=int, default=4, help='Embedding workers')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='Vectors per checkpoint')
+    parser.add_argument('--dtype', default='f32',
+                        help='Scalar type of usearch indexes; quantized ones (e.g. bf16) '
+                             'come with their float32 vectors for rescoring')
+    parser.add_argument('--factory', default='OPQ16_64,HNSW32', help='FAISS index factory string')
+    parser.add_argument('--train-size', type=int, default=100000, help='FAISS training sample')
+    parser.add_argument('--trees', type=int, default=64, help='Number of Annoy trees')
+    parser.add_argument('--restart', action='store_true', help='Discard a previous build')
+    parser.add_argument('--keep-work-dir', action='store_true')
+    args = parser.parse_args()
+    backends = args.backends.split(',')
+    if not set(backends) <= set(BUILD_FNS):
+        parser.error(f'--backends must be among {", ".join(BUILD_FNS)}')
+
+    query = json_util.loads(args.query)
+    settings = {'db': MONGO_DBNAME, 'coll': args.coll, 'query': args.query,
+                'id_field': args.id_field, 'text_field': args.text_field}
+    coll = MONGO_CLIENT[MONGO_DBNAME][args.coll]
+    source = mongo_source(coll, query, args.id_field, args.text_field, args.batch_size)
+
+    os.makedirs(args.out, exist_ok=True)
+    builder = IndexBuilder(args.index_id, args.out, settings, args.chunk_size, args.work_dir)
+    builder.start(restart=args.restart)
+    builder.embed(source, SentBERTVectorizer().encode_many, args.workers)
+    builder.build(backends, dtype=args.dtype, factory=args.factory,
+                  train_size=args.train_size, trees=args.trees)
+    builder.finish(args.keep_work_dir)
+    print(f'{builder.state["count"]} documents indexed in {args.out}')
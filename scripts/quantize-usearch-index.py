@@ -0,0 +1,75 @@
+"""
+Write scalar quantized (f16 or i8) copies of usearch indexes, along with the
+float32 vectors (.vectors.npy) that the vector search service uses to rescore
+their candidates at full precision
+
+Usage: python scripts/quantize-usearch-index.py --dtype i8 --out OUT_DIR [indexes_dir]
+
+The labels and metadata files of an index are copied along with it, and the
+index is recorded in the manifest of OUT_DIR (see `core/manifest.py`), so
+that OUT_DIR can be served as it is. The vectors are read from the indexes
+themselves, or from `<index id>.npy` files in --vectors-dir when the original
+float vectors are at hand (indexes stored as bf16 have lost some precision).
+"""
+import os
+import sys
+import shutil
+import argparse
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from usearch.index import Index
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+INDEXES_DIR = "{}/indexes".format(BASE_DIR)
+sys.path.append(BASE_DIR)
+from core.manifest import record
+COPIED_EXTS = ['.items.bin', '.items.order', '.items.bin.gz', '.items.json', '.meta.npy']
+VECTORS_EXT = '.vectors.npy'
+
+
+def read_vectors(index, index_id, vectors_dir=None):
+    """Vectors of an index in key order; keys must be 0..n-1."""
+    if vectors_dir and os.path.exists(f'{vectors_dir}/{index_id}.npy'):
+        return np.load(f'{vectors_dir}/{index_id}.npy', mmap_mode='r')
+    keys = np.arange(len(index))
+    if not np.array_equal(np.sort(np.array(index.keys)), keys):
+        raise ValueError(f'Keys of {index_id} are not 0..n-1')
+    return index.get(keys, dtype=np.float32)
+
+
+def quantize(index_file, out_dir, dtype, vectors_dir=None, batch_size=100000):
+    folder = os.path.dirname(index_file)
+    index_id = os.path.basename(index_file)[:-len('.usearch')]
+    source = Index.restore(index_file, view=True)
+    vectors = read_vectors(source, index_id, vectors_dir)
+
+    index = Index(ndim=source.ndim, metric='cos', dtype=dtype,
+                  connectivity=source.connectivity,
+                  expansion_add=source.expansion_add,
+                  expansion_search=source.expansion_search)
+    for i in range(0, len(vectors), batch_size):
+        X = np.asarray(vectors[i:i+batch_size], dtype=np.float32)
+        index.add(np.arange(i, i + len(X)), X)
+    index.save(f'{out_dir}/{index_id}.usearch')
+    np.save(f'{out_dir}/{index_id}{VECTORS_EXT}', np.asarray(vectors, dtype='<f4'))
+
+    for ext in COPIED_EXTS:
+        if os.path.exists(f'{folder}/{index_id}{ext}'):
+            shutil.copy(f'{folder}/{index_id}{ext}', f'{out_dir}/{index_id}{ext}')
+    record(f'{out_dir}/{index_id}.usearch', dims=source.ndim, count=len(index))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize usearch indexes')
+    parser.add_argument('indexes_dir', nargs='?', default=INDEXES_DIR)
+    parser.add_argument('--dtype', choices=['f16', 'i8'], default='i8')
+    parser.add_argument('--out', required=True, help='Directory for the quantized indexes')
+    parser.add_argument('--vectors-dir', help='Directory with the original vectors as <index id>.npy')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    files = sorted(entry.path for entry in os.scandir(args.indexes_dir)
+                   if entry.name.endswith('.usearch'))
+    for index_file in tqdm(files):
+        quantize(index_file, args.out, args.dtype, args.vectors_dir)
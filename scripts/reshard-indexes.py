@@ -0,0 +1,87 @@
+"""
+Merge, split and re-shard the vector indexes of a folder
+
+Usage: python scripts/reshard-indexes.py SRC_DIR --out DIR [--by section|class|subclass]
+                                         [--years 5] [--target-size 2000000]
+                                         [--backends usearch,faiss,annoy] [--dry-run]
+
+The indexes of SRC_DIR (as listed in its manifest) are partitioned by doc
+type, and by CPC subclass group (--by) and year band (--years) if given;
+those of a partition are merged, and cut into shards of at most
+--target-size vectors. The shards are written to --out with their labels,
+metadata columns and manifest, see `core/indexer.py`. The script prints the
+plan and how many indexes a search has to be sent to before and after.
+Rerunning an interrupted run with the same arguments resumes it.
+"""
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+sys.path.append(BASE_DIR)
+from core.indexer import Resharder, fanout_report
+from core.index_builder import BUILD_FNS
+from core.manifest import Manifest, parse_index_name
+
+
+def planned_entry(index_id):
+    """Manifest entry of a shard that is not written yet, for --dry-run"""
+    return {'id': index_id, 'backend': 'usearch', **parse_index_name(index_id)}
+
+
+def print_plan(shards):
+    for shard in shards:
+        parts = ', '.join(f'{idx}[{start}:{end}]' for idx, start, end in shard['parts'])
+        print(f"{shard['id']:<32}{shard['count']:>12}  {parts}")
+
+
+def print_report(rows):
+    print(f"{'query':<24}{'before':>10}{'after':>10}{'reduction':>12}")
+    for row in rows:
+        reduction = f"{row['reduction']:.1f}x" if row['reduction'] else '-'
+        print(f"{row['query']:<24}{row['before']:>10.1f}{row['after']:>10.1f}{reduction:>12}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-shard vector indexes')
+    parser.add_argument('src_dir', help='Folder of the indexes, with a manifest')
+    parser.add_argument('--out', required=True, help='Folder for the new indexes')
+    parser.add_argument('--source-backend', default='usearch', help='Backend to read vectors from')
+    parser.add_argument('--by', choices=list(Resharder.GROUP_LENGTHS), help='CPC level to partition by')
+    parser.add_argument('--years', type=int, help='Width of the year bands to partition by')
+    parser.add_argument('--target-size', type=int, help='Maximum number of vectors per shard')
+    parser.add_argument('--backends', default='usearch', help='Any of usearch,faiss,annoy')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='Vectors per checkpoint')
+    parser.add_argument('--dtype', default='f32',
+                        help='Scalar type of usearch indexes; quantized ones (e.g. bf16) '
+                             'come with their float32 vectors for rescoring')
+    parser.add_argument('--factory', default='OPQ16_64,HNSW32', help='FAISS index factory string')
+    parser.add_argument('--trees', type=int, default=64, help='Number of Annoy trees')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the plan and fan-out')
+    parser.add_argument('--json', help='Write the plan and fan-out report to this JSON file')
+    args = parser.parse_args()
+    backends = args.backends.split(',')
+    if not set(backends) <= set(BUILD_FNS):
+        parser.error(f'--backends must be among {", ".join(BUILD_FNS)}')
+
+    resharder = Resharder(args.src_dir)
+    shards = resharder.plan(args.source_backend, args.by, args.years, args.target_size)
+    print_plan(shards)
+
+    before = Manifest.read(args.src_dir)
+    if args.dry_run:
+        after = Manifest(args.out, [planned_entry(shard['id']) for shard in shards])
+    else:
+        os.makedirs(args.out, exist_ok=True)
+        resharder.write(shards, args.out, backends, args.source_backend, args.chunk_size,
+                        dtype=args.dtype, factory=args.factory, trees=args.trees)
+        after = Manifest.read(args.out)
+    report = fanout_report(before, after)
+    print()
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'shards': shards, 'fanout': report}, f, indent=2)
@@ -40,9 +40,11 @@ app.add_middleware(QuotaMiddleware)
 app.add_middleware(RateLimitMiddleware, default_limit=10, window=10)
 
 
-async def create_request_and_serve(req: Request, handler):
+async def create_request_and_serve(req: Request, handler, preset=None):
     try:
         req_data = {**req.path_params, **req.query_params}
+        if preset:
+            req_data.setdefault('preset', preset)
         response = handler(req_data).serve()
         if isinstance(response, str):
             return HTMLResponse(content=response, status_code=200)
@@ -59,15 +61,17 @@ async def create_request_and_serve_jpg(req: Request, handler):
     except Exception as e:
         handle_error(e)
 
-def create_route_handler(handler, is_jpg=False):
-    fn = create_request_and_serve_jpg if is_jpg else create_request_and_serve
-    return partial(fn, handler=handler)
+def create_route_handler(handler, is_jpg=False, preset=None):
+    if is_jpg:
+        return partial(create_request_and_serve_jpg, handler=handler)
+    return partial(create_request_and_serve, handler=handler, preset=preset)
 
 def add_routes(app, routes):
     for route in routes:
         app.add_api_route(
             route["path"],
-            create_route_handler(route["handler"], route.get('is_jpg', False)),
+            create_route_handler(route["handler"], route.get('is_jpg', False),
+                                 route.get('searchPreset')),
             methods=[route["method"]]
         )
 
@@ -2,23 +2,42 @@ import os
 import time
 import subprocess
 import sys
-import gzip
+import json
+import struct
+import heapq
 import itertools
+import threading
+import uuid
+import hashlib
+from collections import OrderedDict, deque
 from pathlib import Path
+from functools import partial, wraps
+from fnmatch import fnmatch
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import requests
+import httpx
+from cachetools import TTLCache
 import numpy as np
+import psutil
 import uvicorn
 from tqdm.auto import tqdm
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from usearch.index import Index as UsearchIndex
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from usearch.index import Index as UsearchIndex, BatchMatches
 from dotenv import load_dotenv
 
 BASE_DIR = str(Path(__file__).parent.parent.resolve())
 sys.path.append(BASE_DIR)
+from config.config import parse_bytes
+from core.labels import LabelStore, find_labels_file
+from core.manifest import DOC_TYPES, parse_index_name
+from core.metadata import METADATA_EXT, Predicate, open_columns
+from core.search_params import SearchParams, SettingLock
 
 load_dotenv(f"{BASE_DIR}/.env")
 indexes_dir = f'{BASE_DIR}/indexes/'
@@ -29,12 +48,130 @@ DEFAULT_ENDPOINT = f'http://{HOST}:{PORT}'
 ENDPOINT = os.environ.get('VECTOR_SEARCH_ENDPOINT', DEFAULT_ENDPOINT)
 process = None  # To track service status
 
+# Client connection pool
+POOL_SIZE = int(os.environ.get('VECTOR_SEARCH_POOL_SIZE', 16))
+TIMEOUT = float(os.environ.get('VECTOR_SEARCH_TIMEOUT', 30))
+RETRIES = int(os.environ.get('VECTOR_SEARCH_RETRIES', 2))
+
+# Binary wire format: a little-endian uint32 header length, a JSON header
+# (padded so that the array that follows is 8-byte aligned) and a raw array.
+# Labels take as many bytes as the longest label of a frame, which the
+# header gives as `label_bytes`.
+BINARY_CONTENT_TYPE = 'application/x-pqai-frame'
+WIRE_FORMAT = os.environ.get('VECTOR_SEARCH_WIRE_FORMAT', 'binary')
+BYTES_PER_LABEL = 20    # of frames without `label_bytes`
+
+def result_dtype(label_bytes=BYTES_PER_LABEL):
+    return np.dtype([
+        ('label', f'S{label_bytes}'),
+        ('index', '<u4'),
+        ('sim', '<f4')
+    ])
+
+KEYED_RESULT_DTYPE = np.dtype([
+    ('key', '<u8'),
+    ('index', '<u4'),
+    ('sim', '<f4')
+])
+
+# Searching
+SEARCH_WORKERS = int(os.environ.get('VECTOR_SEARCH_WORKERS', os.cpu_count()))
+INDEX_THREADS = int(os.environ.get('VECTOR_SEARCH_INDEX_THREADS', 1))
+FANOUT = os.environ.get('VECTOR_SEARCH_FANOUT', 'adaptive')  # or 'shard'
+VECTORS_EXT = '.vectors.npy'    # float32 vectors of a quantized index, by key
+RESCORE_FACTOR = int(os.environ.get('VECTOR_SEARCH_RESCORE_FACTOR', 4))
+FILTER_EXACT_LIMIT = int(os.environ.get('VECTOR_SEARCH_FILTER_EXACT_LIMIT', 20000))
+# Indexes with at most FLAT_LIMIT vectors are searched exactly, from a float32
+# copy of their vectors held in RAM (4 bytes per dimension and vector), also
+# when the indexes themselves are memory mapped; 0 (the default): none are
+FLAT_LIMIT = int(os.environ.get('VECTOR_SEARCH_FLAT_LIMIT', 0))
+SHARD = os.environ.get('VECTOR_SEARCH_SHARD')  # e.g. "0/4", load one shard of the indexes
+LOCAL_SHARDS = int(os.environ.get('VECTOR_SEARCH_LOCAL_SHARDS', 1))
+RAM_BUDGET = parse_bytes(os.environ.get('VECTOR_SEARCH_RAM_BUDGET', '0'))  # 0: no manager
+LOAD_WORKERS = int(os.environ.get('VECTOR_SEARCH_LOAD_WORKERS', os.cpu_count()))
+LAZY = bool(int(os.environ.get('VECTOR_SEARCH_LAZY', 0)))
+PRELOAD = [p.strip() for p in os.environ.get('VECTOR_SEARCH_PRELOAD', '').split(',') if p.strip()]
+RESIDENCY_INTERVAL = float(os.environ.get('VECTOR_SEARCH_RESIDENCY_INTERVAL', 60))
+WATCH_INTERVAL = float(os.environ.get('VECTOR_SEARCH_WATCH_INTERVAL', 0))  # 0: no watcher
+RELOAD_GRACE = float(os.environ.get('VECTOR_SEARCH_RELOAD_GRACE', 300))
+RESULTS_CACHE_SIZE = int(os.environ.get('VECTOR_SEARCH_CACHE_SIZE', 10000))  # 0: no cache
+RESULTS_CACHE_TTL = float(os.environ.get('VECTOR_SEARCH_CACHE_TTL', 600))
+LATENCY_WINDOW = 1000   # latencies kept per index for /stats
+CURSOR_TTL = float(os.environ.get('VECTOR_SEARCH_CURSOR_TTL', 300))
+MAX_CURSORS = int(os.environ.get('VECTOR_SEARCH_MAX_CURSORS', 1000))
+
 cache = {
+    'paths': {},
     'indexes': {},
-    'labels': {}
+    'labels': {},
+    'metadata': {},
+    'vectors': {},
+    'catalog': {}
 }
 
+executor = None
+inflight = 0
+inflight_lock = threading.Lock()
+queued = 0          # search tasks submitted to the executor and not done yet
+cursors = OrderedDict()
+cursors_lock = threading.Lock()
+signatures = {}     # index id -> file_signature() of the loaded files
+reload_lock = threading.Lock()
+reload_status = {'running': False}
+indexes_loaded = threading.Event()  # set once the indexes are loaded at startup
+load_status = {'loaded': 0, 'total': 0, 'failed': {}}
+load_lock = threading.Lock()
+index_locks = {}
+expansion_locks = {}    # index id -> (SettingLock of its expansion_search, default expansion)
+query_counts = {}   # index id -> searches since the last residency update
+query_scores = {}   # index id -> decayed search count
+query_totals = {}   # index id -> searches since startup
+latencies = {}      # index id -> durations of its latest searches
+counters_lock = threading.Lock()    # for the search counts and latencies
+residency_lock = threading.Lock()
+flat_indexes = None     # FlatIndexes, once the indexes are loaded
+
 def load_indexes():
+    """Open the indexes on LOAD_WORKERS threads, those matching PRELOAD
+    first. In the lazy mode, only those are opened; the others are only
+    entered in the catalog (which reads just their headers) and memory
+    mapped by the first search that needs them.
+    """
+    files = sorted(scan_index_files(), key=lambda f: preload_rank(index_name(f)))
+    load_status.update({'loaded': 0, 'total': len(files), 'failed': {}})
+    lazy = [LAZY and preload_rank(index_name(f)) == len(PRELOAD) for f in files]
+    with ThreadPoolExecutor(LOAD_WORKERS, thread_name_prefix='load') as pool:
+        futures = [pool.submit(load_index, f, l) for f, l in zip(files, lazy)]
+        bar = tqdm(total=len(files), desc="Loading indexes", ncols=80, ascii="░▒")
+        for file, future in zip(files, futures):
+            try:
+                future.result()
+                load_status['loaded'] += 1
+            except Exception as e:
+                load_status['failed'][index_name(file)] = str(e)
+                print(f'Could not load {file.name}: {e}')
+            bar.update()
+        bar.close()
+    global flat_indexes
+    with load_lock:
+        cache['catalog'] = dict(sorted(cache['catalog'].items()))
+        flat_indexes = build_flat_indexes(cache)
+    indexes_loaded.set()
+
+
+def index_name(file):
+    return file.name[:-len('.usearch')]
+
+
+def preload_rank(index_id):
+    """Position of the first PRELOAD pattern that matches the index id."""
+    for i, pattern in enumerate(PRELOAD):
+        if fnmatch(index_id, pattern):
+            return i
+    return len(PRELOAD)
+
+
+def scan_index_files():
     index_files = []
     for entry in os.scandir(indexes_dir):
         if entry.is_file() and entry.name.endswith('.usearch'):
@@ -45,75 +182,1234 @@ def load_indexes():
     if os.environ.get('ENVIRONMENT') == 'test':
         files = files[-10:]
 
-    for file in tqdm(index_files, desc="Loading indexes", ncols=80, ascii="░▒"):
-        load_index(file)
+    if SHARD:
+        files = shard_files(files, SHARD)
+    return files
+
+
+def load_index(file, lazy=False):
+    index_id, entry = open_index(file, lazy)
+    signature = file_signature(file.path)
+    with load_lock:
+        install(cache, index_id, entry)
+        signatures[index_id] = signature
+
+
+def open_index(file, lazy=False):
+    """Open an index's files; a lazily opened index has no index or labels
+    yet, see `get_index`."""
+    index_id = index_name(file)
+    labels_file = find_labels_file(os.path.dirname(file.path), index_id)
+    if lazy:
+        index, labels = None, None
+        count = UsearchIndex.metadata(file.path)['count_present']
+    else:
+        view = os.environ.get('LOAD_USEARCH_INDEXES_IN_MEMORY') == '0' or RAM_BUDGET > 0
+        index = UsearchIndex(ndim=384, metric='cos', path=file.path, view=view)
+        labels = LabelStore.open(labels_file)
+        count = len(index)
+
+    columns = None
+    metadata_file = file.path[:-len('.usearch')] + METADATA_EXT
+    if os.path.exists(metadata_file):
+        columns = open_columns(metadata_file)
+
+    vectors = None
+    vectors_file = file.path[:-len('.usearch')] + VECTORS_EXT
+    if os.path.exists(vectors_file):
+        vectors = np.load(vectors_file, mmap_mode='r')
+
+    nbytes = os.path.getsize(file.path) + os.path.getsize(labels_file)
+    info = IndexInfo(index_id, count, nbytes)
+    info.filterable = columns is not None
+    info.resident = index is not None and not view
+    info.dtype = UsearchIndex.metadata(file.path)['kind_scalar'].name.lower()
+    info.rescored = vectors is not None
+    return index_id, (file.path, index, labels, columns, vectors, info)
+
+
+def install(parts, index_id, entry):
+    path, index, labels, columns, vectors, info = entry
+    parts['paths'][index_id] = path
+    for key, value in [('indexes', index), ('labels', labels), ('metadata', columns),
+                       ('vectors', vectors)]:
+        if value is None:
+            parts[key].pop(index_id, None)
+        else:
+            parts[key][index_id] = value
+    parts['catalog'][index_id] = info
+
+
+def get_index(idx):
+    """The index `idx`, memory mapped now if it was loaded lazily."""
+    index = cache['indexes'].get(idx)
+    if index is None:
+        with index_locks.setdefault(idx, threading.Lock()):
+            index = cache['indexes'].get(idx)
+            if index is None:
+                path = cache['paths'][idx]
+                index = UsearchIndex(ndim=384, metric='cos', path=path, view=True)
+                put_loaded('indexes', idx, path, index)
+    return index
+
+
+def index_search(idx, query, k, threads=INDEX_THREADS, params=None):
+    """Search the index `idx` with the expansion and exactness of `params`.
+    usearch has no per search `expansion_search`, so it is set on the index
+    under a `SettingLock` of the index id, as `core.indexes.USearchIndex`
+    does: searches with the same expansion run together, others wait. The
+    copies of an index that reloads and residency changes open share the
+    lock, and every search sets the expansion on the copy it searches."""
+    index = get_index(idx)
+    lock, default = expansion_locks.get(idx, (None, None))
+    if lock is None:
+        with index_locks.setdefault(idx, threading.Lock()):
+            if idx not in expansion_locks:
+                expansion_locks[idx] = (SettingLock(), index.expansion_search)
+            lock, default = expansion_locks[idx]
+    expansion = (params.expansion if params else None) or default
+    with lock.holding(expansion):
+        index.expansion_search = expansion
+        return index.search(query, k, threads=threads, exact=bool(params and params.exact))
+
+
+def get_labels(idx):
+    labels = cache['labels'].get(idx)
+    if labels is None:
+        with index_locks.setdefault(idx, threading.Lock()):
+            labels = cache['labels'].get(idx)
+            if labels is None:
+                path = cache['paths'][idx]
+                labels = LabelStore.open(find_labels_file(os.path.dirname(path), idx))
+                put_loaded('labels', idx, path, labels)
+    return labels
+
+
+def put_loaded(key, idx, path, value):
+    """Add a lazily opened part of an index to `cache`, unless a reload has
+    replaced the index meanwhile. Like every change to `cache`, it replaces
+    the part with an updated copy, under `load_lock`, so that it is not lost
+    to a concurrent change of the same part (e.g. by `set_residency`)."""
+    with load_lock:
+        if cache['paths'].get(idx) == path:
+            cache[key] = {**cache[key], idx: value}
+
+
+def file_signature(index_file):
+    """Sizes and modification times of an index's files; a change in any
+    of them means the index has to be reloaded."""
+    folder, index_id = os.path.dirname(index_file), os.path.basename(index_file)[:-len('.usearch')]
+    paths = [index_file, f'{folder}/{index_id}{METADATA_EXT}', f'{folder}/{index_id}{VECTORS_EXT}']
+    try:
+        paths.append(find_labels_file(folder, index_id))
+    except ValueError:
+        pass
+    stats = [os.stat(path) if os.path.exists(path) else None for path in paths]
+    return tuple((st.st_size, st.st_mtime_ns) if st else None for st in stats)
+
+
+def reload_indexes():
+    """Bring the loaded indexes in line with the index files: load new and
+    changed ones while the current ones keep serving, then swap them in.
+    Removed indexes leave the catalog at once, so new searches skip them,
+    but stay loaded for RELOAD_GRACE seconds for searches in progress.
+    """
+    with reload_lock:
+        reload_status.update({'running': True, 'started': time.time()})
+        files = {f.name[:-len('.usearch')]: f for f in scan_index_files()}
+        current = {index_id: file_signature(f.path) for index_id, f in files.items()}
+        todo = [i for i in files if current[i] != signatures.get(i)]
+        removed = [i for i in cache['catalog'] if i not in files]
+
+        loaded, failed = {}, {}
+        for index_id in todo:
+            lazy = LAZY and preload_rank(index_id) == len(PRELOAD)
+            try:
+                loaded[index_id] = open_index(files[index_id], lazy)[1]
+            except Exception as e:
+                failed[index_id] = str(e)
+
+        swap_indexes(loaded, removed)
+        for index_id in loaded:
+            signatures[index_id] = current[index_id]
+        for index_id in removed:
+            signatures.pop(index_id, None)
+        if removed:
+            timer = threading.Timer(RELOAD_GRACE, retire_indexes, [removed])
+            timer.daemon = True
+            timer.start()
 
-def load_index(file):
-    fname = file.path.split('/').pop()
-    index_id = fname[:-len('.usearch')]
+        reload_status.update({
+            'running': False,
+            'finished': time.time(),
+            'loaded': sorted(loaded),
+            'removed': sorted(removed),
+            'failed': failed
+        })
+        return dict(reload_status)
 
-    view = os.environ.get('LOAD_USEARCH_INDEXES_IN_MEMORY') == '0'
-    index = UsearchIndex(ndim=384, metric='cos', path=file.path, view=view)
-    cache['indexes'][index_id] = index
 
-    labels_file = file.path[:-len('.usearch')] + '.items.bin.gz'
-    with gzip.open(labels_file, 'rb') as f:
-        labels = f.read()
-    cache['labels'][index_id] = labels
+def swap_indexes(loaded, removed):
+    """Install loaded indexes and drop removed ones from the catalog. Every
+    part of `cache` is replaced by an updated copy, never changed in place,
+    so a search sees either the old or the new version of each part; the
+    catalog is replaced last, so it never lists an index not yet loaded.
+    """
+    global flat_indexes
+    with load_lock:
+        parts = {key: dict(cache[key]) for key in cache}
+        for index_id, entry in loaded.items():
+            install(parts, index_id, entry)
+        for index_id in removed:
+            parts['catalog'].pop(index_id, None)
 
+        catalog = dict(sorted(parts.pop('catalog').items()))
+        flat = build_flat_indexes({**parts, 'catalog': catalog}, flat_indexes, set(loaded))
+        cache.update(parts)
+        flat_indexes = flat
+        cache['catalog'] = catalog
+    results_cache.clear()
 
-def search_index(t):
+
+def retire_indexes(index_ids):
+    with reload_lock, load_lock:
+        index_ids = [i for i in index_ids if i not in cache['catalog']]
+        for key in ['indexes', 'labels', 'metadata', 'vectors', 'paths']:
+            part = dict(cache[key])
+            for index_id in index_ids:
+                part.pop(index_id, None)
+            cache[key] = part
+        for index_id in index_ids:
+            expansion_locks.pop(index_id, None)
+
+
+def start_reload():
+    """Reload indexes on a background thread, unless a reload is running."""
+    if reload_lock.locked():
+        return False
+    threading.Thread(target=reload_indexes, name='reload', daemon=True).start()
+    return True
+
+
+def watch_indexes(stop_event, interval):
+    """Reload whenever the index files have changed and then stayed the same
+    for one interval, so that files still being copied are not loaded."""
+    while not indexes_loaded.wait(interval):
+        if stop_event.is_set():
+            return
+    previous = None
+    while not stop_event.wait(interval):
+        try:
+            current = {f.name: file_signature(f.path) for f in scan_index_files()}
+        except OSError:
+            continue
+        loaded = {f'{i}.usearch': sig for i, sig in signatures.items()}
+        if current != loaded and current == previous:
+            reload_indexes()
+        previous = current
+
+
+def assign_shards(sizes, n_shards):
+    """Assign indexes to shards so that each holds about as many bytes;
+    `sizes` maps index names to sizes. Largest indexes are placed first, each
+    on the shard with the fewest bytes so far. The result only depends on
+    the names and sizes, so every worker computes the same assignment.
+    """
+    loads = [(0, shard) for shard in range(n_shards)]
+    assignment = {}
+    for name in sorted(sizes, key=lambda name: (-sizes[name], name)):
+        load, shard = heapq.heappop(loads)
+        assignment[name] = shard
+        heapq.heappush(loads, (load + sizes[name], shard))
+    return assignment
+
+
+def shard_files(files, shard):
+    i, n_shards = [int(x) for x in shard.split('/')]
+    sizes = {f.name: os.path.getsize(f.path) for f in files}
+    assignment = assign_shards(sizes, n_shards)
+    return [f for f in files if assignment[f.name] == i]
+
+
+class IndexInfo:
+    """Catalog entry of a loaded index: the doc type, year (or year range)
+    and CPC subclass encoded in its name, e.g. `2019.patent` or
+    `H04W.2001-2005.npl`, along with its vector count and size on disk.
+    """
+
+    DOC_TYPES = DOC_TYPES
+
+    def __init__(self, index_id, count=None, nbytes=None):
+        self.id = index_id
+        self.count = count
+        self.nbytes = nbytes
+        attrs = parse_index_name(index_id)
+        self.doc_type = attrs['doc_type']
+        self.years = attrs['years']
+        self.subclass = attrs['subclass']
+        self.filterable = False  # has metadata columns
+        self.resident = False    # fully loaded in RAM, not memory mapped
+        self.dtype = None        # scalar type of the stored vectors
+        self.rescored = False    # has full precision vectors for rescoring
+        self.flat = False        # searched exactly, see FlatIndexes
+
+    def matches(self, routing):
+        """Tell if the index can hold results that satisfy the routing
+        constraints. An index that does not encode an attribute (e.g. is not
+        split by year) is never pruned on that attribute, except doc type.
+        """
+        types = routing.get('types')
+        if types and self.doc_type not in types:
+            return False
+
+        years = routing.get('years')
+        if years and self.years:
+            start, end = years
+            if start is not None and self.years[1] < int(start):
+                return False
+            if end is not None and self.years[0] > int(end):
+                return False
+
+        subclasses = routing.get('subclasses')
+        if subclasses and self.subclass:
+            if not any(self.subclass.startswith(code) or code.startswith(self.subclass)
+                       for code in subclasses):
+                return False
+        return True
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'doc_type': self.doc_type,
+            'years': self.years,
+            'subclass': self.subclass,
+            'count': self.count,
+            'bytes': self.nbytes,
+            'filterable': self.filterable,
+            'resident': self.resident,
+            'dtype': self.dtype,
+            'rescored': self.rescored,
+            'flat': self.flat
+        }
+
+
+def get_routing(payload, type=None):
+    """Read the routing constraints of a search: `types`, `years` (a
+    `[from, to]` range, either end may be null) and `subclasses`. The older
+    `type` field stands for `types` when the latter is not given.
+    """
+    routing = dict(payload.get('routing') or {})
+    if 'types' not in routing and type in IndexInfo.DOC_TYPES:
+        routing['types'] = [type]
+    return routing
+
+
+def select_indexes(routing):
+    return [idx for idx, info in cache['catalog'].items() if info.matches(routing)]
+
+
+def measured(search_fn):
+    """Record the latency and query count of the index searched by a
+    function whose first argument is an `(idx, query or queries, n)` tuple."""
+    @wraps(search_fn)
+    def wrapper(t, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return search_fn(t, *args, **kwargs)
+        finally:
+            n_queries = len(t[1]) if np.ndim(t[1]) == 2 else 1
+            record_search(t[0], time.perf_counter() - start, n_queries)
+    return wrapper
+
+
+@measured
+def search_index(t, threads=INDEX_THREADS, params=None):
     idx, qvec, n = t
-    matches = cache['indexes'][idx].search(qvec, n)
-    results = [(m.key, idx, 1.0-m.distance) for m in matches]
-    return results
+    if flat_indexes and idx in flat_indexes:
+        return (idx, *flat_indexes.search(qvec, n, [idx])[idx][0])
+    vectors = cache['vectors'].get(idx)
+    if vectors is None:
+        matches = index_search(idx, qvec, n, threads, params)
+        return idx, matches.keys, matches.distances
+    matches = index_search(idx, qvec, n * RESCORE_FACTOR, threads, params)
+    return (idx, *rescore(vectors, qvec, matches.keys, n))
+
+
+def rescore(vectors, qvec, keys, n):
+    """Rank the candidates `keys` of a quantized index by their exact
+    cosine distance to `qvec`, computed on the full precision vectors."""
+    if len(keys) == 0:
+        return keys, np.empty(0, dtype=np.float32)
+    dists = cosine_distances(np.asarray(vectors[keys], dtype=np.float32), qvec)
+    top = np.argsort(dists, kind='stable')[:n]
+    return keys[top], dists[top]
+
+
+def cosine_distances(X, qvec):
+    q = qvec / np.linalg.norm(qvec)
+    return 1.0 - (X @ q) / np.maximum(np.linalg.norm(X, axis=1), 1e-12)
+
+
+def search_index_filtered(t, predicate, threads=INDEX_THREADS, params=None):
+    """Search an index for the top `n` matches that pass `predicate`.
+
+    When few of the index's vectors pass, they are scanned exactly. Else the
+    index is searched with a `k` large enough for `n` matches to pass at the
+    predicate's selectivity, growing `k` until they do. Indexes without
+    metadata columns cannot be filtered and are searched as usual. With
+    exact `params` the passing vectors are always scanned.
+    """
+    columns = cache['metadata'].get(t[0])
+    if columns is None or not predicate:
+        return search_index(t, threads, params)
+    return filtered_search(t, predicate, columns, threads, params)
+
+
+@measured
+def filtered_search(t, predicate, columns, threads=INDEX_THREADS, params=None):
+    idx, qvec, n = t
+    if flat_indexes and idx in flat_indexes:
+        return (idx, *flat_indexes.search(qvec, n, [idx], predicate)[idx][0])
+    index = get_index(idx)
+    passing = np.flatnonzero(predicate(columns))
+    if len(passing) <= FILTER_EXACT_LIMIT or (params and params.exact):
+        return exact_search(idx, qvec, n, passing)
+
+    vectors = cache['vectors'].get(idx)
+    m = n if vectors is None else n * RESCORE_FACTOR
+    selectivity = len(passing) / len(columns)
+    k = min(len(index), int(m / selectivity * 1.2) + 1)
+    while True:
+        matches = index_search(idx, qvec, k, threads, params)
+        mask = predicate(columns, matches.keys)
+        if mask.sum() >= m or len(matches.keys) < k or k >= len(index):
+            if vectors is not None:
+                return (idx, *rescore(vectors, qvec, matches.keys[mask], n))
+            return idx, matches.keys[mask][:n], matches.distances[mask][:n]
+        k = min(len(index), 2 * k)
+
+
+def exact_search(idx, qvec, n, keys):
+    if len(keys) == 0:
+        return idx, keys, np.empty(0, dtype=np.float32)
+    vectors = cache['vectors'].get(idx)
+    if vectors is None:
+        X = get_index(idx).get(keys, dtype=np.float32)
+    else:
+        X = np.asarray(vectors[keys], dtype=np.float32)
+    dists = cosine_distances(X, qvec)
+    top = np.argpartition(dists, n - 1)[:n] if n < len(dists) else np.arange(len(dists))
+    top = top[np.argsort(dists[top])]
+    return idx, keys[top], dists[top]
+
+
+@measured
+def search_index_batch(t, threads=INDEX_THREADS, params=None):
+    idx, Q, n = t
+    if flat_indexes and idx in flat_indexes:
+        return flat_indexes.search(Q, n, [idx])[idx]
+    vectors = cache['vectors'].get(idx)
+    k = n if vectors is None else n * RESCORE_FACTOR
+    matches = index_search(idx, Q, k, threads, params)
+    if isinstance(matches, BatchMatches):
+        rows = [(matches.keys[i, :c], matches.distances[i, :c])
+                for i, c in enumerate(matches.counts)]
+    else:
+        rows = [(matches.keys, matches.distances)]
+    if vectors is None:
+        return rows
+    return [rescore(vectors, q, keys, n) for q, (keys, _) in zip(Q, rows)]
+
+
+class FlatIndexes:
+    """Indexes with at most FLAT_LIMIT vectors, searched exactly by a matrix
+    product with their vectors, which takes less time than an HNSW search
+    of an index this small. Their normalized vectors are stacked in one
+    matrix, in catalog order, so that indexes next to each other in the
+    catalog (as the years of a doc type are) are scanned in one product.
+    The search being exact, search params (presets, `exact`) do not apply:
+    it finds what the most exact of them would.
+    """
+
+    def __init__(self, entries=()):
+        """`entries` are (index id, keys, vectors in the order of the keys)"""
+        self.spans = {}
+        self.keys = {}
+        blocks, start = [], 0
+        for idx, keys, X in entries:
+            X = np.asarray(X, dtype=np.float32)
+            X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+            blocks.append(X)
+            self.spans[idx] = (start, start + len(keys))
+            self.keys[idx] = keys
+            start += len(keys)
+        self.matrix = np.vstack(blocks) if blocks else np.empty((0, 0), dtype=np.float32)
+
+    def __contains__(self, idx):
+        return idx in self.spans
+
+    def __len__(self):
+        return len(self.spans)
+
+    def block(self, idx):
+        start, end = self.spans[idx]
+        return self.keys[idx], self.matrix[start:end]
+
+    def search(self, Q, n, idxs, predicate=None):
+        """Top `n` matches of each query (row of `Q`) in each of the indexes
+        `idxs`, as {idx: [(keys, distances) of each query]}."""
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        Q = Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+        results = {}
+        for start, end, run in self._runs(idxs):
+            S = self.matrix[start:end] @ Q.T
+            for idx in run:
+                first, last = self.spans[idx]
+                results[idx] = self._top(idx, S[first-start:last-start], n, predicate)
+        return results
+
+    def _runs(self, idxs):
+        """Contiguous row ranges of the matrix that hold the indexes `idxs`."""
+        runs = []
+        for idx in sorted(idxs, key=lambda i: self.spans[i]):
+            start, end = self.spans[idx]
+            if runs and runs[-1][1] == start:
+                runs[-1][1] = end
+                runs[-1][2].append(idx)
+            else:
+                runs.append([start, end, [idx]])
+        return runs
+
+    def _top(self, idx, S, n, predicate=None):
+        keys = self.keys[idx]
+        if predicate and idx in cache['metadata']:
+            passed = predicate(cache['metadata'][idx], keys)
+            S = np.where(passed[:, None], S, -np.inf)
+        k = min(n, len(S))
+        if k == 0:
+            empty = (keys[:0], np.empty(0, dtype=np.float32))
+            return [empty] * S.shape[1]
+        top = np.argpartition(-S, k - 1, axis=0)[:k]
+        sims = np.take_along_axis(S, top, axis=0)
+        order = np.argsort(-sims, axis=0, kind='stable')
+        top, sims = np.take_along_axis(top, order, 0), np.take_along_axis(sims, order, 0)
+        rows = []
+        for j in range(S.shape[1]):
+            found = np.isfinite(sims[:, j])
+            rows.append((keys[top[found, j]], (1.0 - sims[found, j]).astype(np.float32)))
+        return rows
+
+
+def build_flat_indexes(parts, previous=None, changed=()):
+    """FlatIndexes of the loaded indexes in `parts` (a copy of `cache`) that
+    are small enough. Indexes that are not `changed` since `previous` was
+    built keep their vectors from it."""
+    entries = []
+    for idx, info in parts['catalog'].items():
+        index = parts['indexes'].get(idx)
+        info.flat = index is not None and info.count <= FLAT_LIMIT
+        if not info.flat:
+            continue
+        if previous and idx in previous and idx not in changed:
+            entries.append((idx, *previous.block(idx)))
+            continue
+        keys = np.array(index.keys, dtype=np.uint64)
+        vectors = parts['vectors'].get(idx)
+        X = index.get(keys, dtype=np.float32) if vectors is None else vectors[keys]
+        entries.append((idx, keys, X))
+    return FlatIndexes(entries)
+
+
+def search_flat(Q, n, idxs, predicate=None):
+    """Search the flat indexes `idxs` in one go; the time taken is recorded
+    as shared equally among them."""
+    start = time.perf_counter()
+    try:
+        return flat_indexes.search(Q, n, idxs, predicate)
+    finally:
+        seconds = (time.perf_counter() - start) / max(1, len(idxs))
+        for idx in idxs:
+            record_search(idx, seconds, len(np.atleast_2d(Q)))
+
+
+def record_search(idx, seconds, n_queries=1):
+    with counters_lock:
+        if idx not in latencies:
+            latencies[idx] = deque(maxlen=LATENCY_WINDOW)
+        latencies[idx].append(seconds)
+        query_totals[idx] = query_totals.get(idx, 0) + n_queries
+        query_counts[idx] = query_counts.get(idx, 0) + n_queries
+
+
+def count_queries(idx, n=1):
+    with counters_lock:
+        query_counts[idx] = query_counts.get(idx, 0) + n
+
+
+def index_stats(idx, info):
+    with counters_lock:
+        times = np.array(latencies.get(idx, [])) * 1000
+        queries = query_totals.get(idx, 0)
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]).tolist() if len(times) else [None] * 3
+    return {
+        'id': idx,
+        'count': info.count,
+        'residency': 'unloaded' if idx not in cache['indexes'] else
+                     'flat' if info.flat else 'ram' if info.resident else 'mmap',
+        'dtype': info.dtype,
+        'bytes': info.nbytes,
+        'queries': queries,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99
+    }
+
+
+def stats():
+    catalog = cache['catalog']
+    indexes = [index_stats(idx, info) for idx, info in catalog.items()]
+    return {
+        'indexes': indexes,
+        'memory': {
+            'rss': psutil.Process().memory_info().rss,
+            'ram_bytes': sum(i['bytes'] for i in indexes if i['residency'] == 'ram'),
+            'mmap_bytes': sum(i['bytes'] for i in indexes if i['residency'] == 'mmap'),
+            'flat_bytes': flat_indexes.matrix.nbytes if flat_indexes else 0
+        },
+        'executor': {
+            'workers': SEARCH_WORKERS,
+            'queue_depth': queued,
+            'inflight_requests': inflight
+        },
+        'cache': results_cache.stats(),
+        'cursors': len(cursors)
+    }
+
+
+def update_residency(decay=0.5, hysteresis=1.25):
+    """Keep the most searched indexes fully loaded in RAM, as many as fit
+    in RAM_BUDGET, and serve the others through memory maps.
+
+    Indexes are ranked by their search counts, decayed by half at every
+    update. A resident index counts `hysteresis` times its score, so that
+    indexes do not flip between the tiers on small changes in traffic.
+    Indexes searched since the last update that stay memory mapped get a
+    read-ahead hint, which brings their pages into the page cache.
+    """
+    with residency_lock:
+        catalog = cache['catalog']
+        with counters_lock:
+            counts = dict(query_counts)
+            query_counts.clear()
+        for idx in catalog:
+            query_scores[idx] = query_scores.get(idx, 0) * decay + counts.get(idx, 0)
+        for idx in [i for i in query_scores if i not in catalog]:
+            del query_scores[idx]
+
+        rank = lambda idx: query_scores[idx] * (hysteresis if catalog[idx].resident else 1)
+        chosen, used = set(), 0
+        for idx in sorted(catalog, key=rank, reverse=True):
+            if catalog[idx].flat:   # searched in the flat matrix, see FlatIndexes
+                continue
+            size = index_file_size(idx)
+            if query_scores[idx] > 0 and used + size <= RAM_BUDGET:
+                chosen.add(idx)
+                used += size
+
+        for idx, info in catalog.items():
+            if info.resident and idx not in chosen:
+                set_residency(idx, False)
+        for idx, info in catalog.items():
+            if not info.resident and idx in chosen:
+                set_residency(idx, True)
+            elif idx not in chosen and counts.get(idx):
+                advise(cache['paths'][idx], getattr(os, 'POSIX_FADV_WILLNEED', None))
+
+
+def set_residency(idx, resident):
+    """Reopen an index fully loaded or memory mapped, and swap it in unless
+    a reload has replaced it meanwhile."""
+    current = cache['indexes'].get(idx)
+    path = cache['paths'][idx]
+    try:
+        index = UsearchIndex(ndim=384, metric='cos', path=path, view=not resident)
+    except Exception as e:
+        print(f'Could not change residency of {idx}: {e}')
+        return
+    with load_lock:
+        if cache['indexes'].get(idx) is not current or cache['paths'].get(idx) != path:
+            return
+        indexes = dict(cache['indexes'])
+        indexes[idx] = index
+        cache['indexes'] = indexes
+        cache['catalog'][idx].resident = resident
+
+
+def index_file_size(idx):
+    try:
+        return os.path.getsize(cache['paths'][idx])
+    except OSError:
+        return 0
+
+
+def advise(path, advice):
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    finally:
+        os.close(fd)
+
+
+def manage_residency(stop_event, interval):
+    while not indexes_loaded.wait(interval):
+        if stop_event.is_set():
+            return
+    for idx in cache['catalog']:    # start with the indexes to preload
+        if preload_rank(idx) < len(PRELOAD):
+            count_queries(idx)
+    update_residency()
+    while not stop_event.wait(interval):
+        update_residency()
+
+
+def residency():
+    catalog = cache['catalog']
+    indexes = [{
+        'id': idx,
+        'resident': info.resident,
+        'bytes': index_file_size(idx),
+        'score': query_scores.get(idx, 0),
+        'recent_queries': query_counts.get(idx, 0)
+    } for idx, info in catalog.items()]
+    return {
+        'budget': RAM_BUDGET,
+        'used': sum(i['bytes'] for i in indexes if i['resident']),
+        'indexes': sorted(indexes, key=lambda i: -i['score'])
+    }
+
+
+def start_executor(max_workers=SEARCH_WORKERS):
+    global executor
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='search')
+    return executor
+
+
+def stop_executor():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+def get_executor():
+    return executor if executor is not None else start_executor()
+
+
+def fanout_width(n_tasks):
+    if FANOUT == 'shard':
+        return n_tasks
+    with inflight_lock:
+        concurrent_requests = max(1, inflight)
+    return max(1, SEARCH_WORKERS // concurrent_requests)
+
+
+def submit(fn, *args):
+    """Submit a search task to the shared executor, counting it in the queue
+    depth until it is done (or cancelled, as the executor stops)."""
+    global queued
+    with inflight_lock:
+        queued += 1
+    future = get_executor().submit(counted, fn, *args)
+    future.add_done_callback(task_cancelled)
+    return future
+
+
+def counted(fn, *args):
+    try:
+        return fn(*args)
+    finally:
+        task_done()
+
+
+def task_cancelled(future):
+    if future.cancelled():
+        task_done()
+
+
+def task_done():
+    global queued
+    with inflight_lock:
+        queued -= 1
+
+
+def fanout(fn, args):
+    """Map `fn` over `args` on the shared executor and return the results in
+    order. In the adaptive mode, the search workers are shared among the
+    requests in flight; each request gets no more parallel tasks than its
+    share, and each task works through a contiguous run of `args`.
+    """
+    width = min(len(args), fanout_width(len(args)))
+    if width == len(args):
+        return [future.result() for future in [submit(fn, a) for a in args]]
+    size = -(-len(args) // width)
+    groups = [args[i:i+size] for i in range(0, len(args), size)]
+    futures = [submit(lambda group: [fn(a) for a in group], g) for g in groups]
+    return list(itertools.chain.from_iterable(future.result() for future in futures))
+
+
+def track_request(fn, *args):
+    global inflight
+    with inflight_lock:
+        inflight += 1
+    try:
+        return fn(*args)
+    finally:
+        with inflight_lock:
+            inflight -= 1
 
 
-def concurrent_search(qvec, n, type=None):
-    idxs = cache['indexes'].keys()
-    if type in ['patent', 'npl']:
-        idxs = [idx for idx in idxs if type in idx]
-    args = [(idx, qvec, n) for idx in idxs]
+def get_label(idx, i):
+    return get_labels(idx)[i]
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        with tqdm(total=len(args), desc="Searching indexes", ncols=80, ascii="░▒") as pbar:
-            results = []
-            for r in executor.map(search_index, args):
-                results.append(r)
-                pbar.update(1)
 
-    results = list(itertools.chain.from_iterable(results))
-    results = sorted(results, key=lambda x: x[2], reverse=True)
+def merge_top_n(matches, n, min_sim=None):
+    """Merge per-index matches, each sorted by distance, into the global top
+    `n` as (key, index, similarity) triplets, leaving out those less similar
+    than `min_sim`.
 
-    BYTES_PER_LABEL = 20
+    This is a k-way heap merge that stops after `n` items, so it touches
+    about `n + k` candidates instead of sorting all `n * k` of them.
+    """
+    streams = [zip(dists, itertools.repeat(idx), keys) for idx, keys, dists in matches]
+    merged = heapq.merge(*streams)
+    if min_sim is not None:
+        merged = itertools.takewhile(lambda m: 1.0 - m[0] >= min_sim, merged)
+    top = itertools.islice(merged, n)
+    return [(int(key), idx, 1.0 - float(dist)) for dist, idx, key in top]
 
-    arr = []
-    for i, idx, sim in results:
-        start = int(i * BYTES_PER_LABEL)
-        end = start + BYTES_PER_LABEL
-        label = cache['labels'][idx][start:end].decode("utf-8").strip()
-        arr.append((label, idx, sim))
-    return arr
 
+class SearchCursor:
+    """A search whose results are delivered in batches, in order of
+    similarity, without repeating the work done for earlier batches.
+
+    Each index is searched for as many matches as the first batch needs.
+    A fetched match is delivered only once no index can still hold a closer
+    one, i.e. it is no farther than the last match fetched from every index
+    that is not exhausted. When a batch needs more, only the indexes that
+    hold it back are searched again, with a larger `k`; matches already
+    fetched from them are skipped. An index is exhausted once it returns
+    fewer matches than asked for or its matches fall below `min_sim`.
+    """
+
+    def __init__(self, qvec, idxs, min_sim=None, threads=INDEX_THREADS, predicate=None,
+                 params=None):
+        self.id = uuid.uuid4().hex
+        self._qvec = qvec
+        self._threads = threads
+        self._params = params
+        self._predicate = predicate
+        self._max_dist = np.inf if min_sim is None else 1.0 - min_sim
+        self._fetched = {idx: 0 for idx in idxs}
+        self._last_dist = {idx: 0.0 for idx in idxs}
+        self._seen = {idx: set() for idx in idxs}
+        self._exhausted = set()
+        self._pending = []
+        self._lock = threading.Lock()
+        self.touched = time.time()
+
+    @property
+    def done(self):
+        return not self._pending and len(self._exhausted) == len(self._fetched)
+
+    def next(self, n):
+        with self._lock:
+            self.touched = time.time()
+            self._drop_removed()
+            while len(self._deliverable(n)) < n and not self._all_exhausted():
+                self._fetch_more(n)
+            batch = []
+            for _ in self._deliverable(n):
+                dist, idx, key = heapq.heappop(self._pending)
+                batch.append((key, idx, 1.0 - dist))
+            return batch
+
+    def _drop_removed(self):
+        """Forget the indexes that a reload has removed since."""
+        removed = [idx for idx in self._fetched if idx not in cache['paths']]
+        if removed:
+            self._exhausted.update(removed)
+            self._pending = [m for m in self._pending if m[1] not in removed]
+            heapq.heapify(self._pending)
+
+    def _all_exhausted(self):
+        return len(self._exhausted) == len(self._fetched)
+
+    def _frontier(self):
+        active = [d for idx, d in self._last_dist.items() if idx not in self._exhausted]
+        return min(active) if active else np.inf
+
+    def _deliverable(self, n):
+        frontier = self._frontier()
+        return [m for m in heapq.nsmallest(n, self._pending) if m[0] <= frontier]
+
+    def _fetch_more(self, n):
+        target = heapq.nsmallest(n, self._pending)
+        target = target[-1][0] if len(target) == n else np.inf
+        args = []
+        for idx, last_dist in self._last_dist.items():
+            if idx in self._exhausted or last_dist > target:
+                continue
+            k = self._fetched[idx]
+            args.append((idx, self._qvec, n if k == 0 else max(2 * k, k + n)))
+        for (idx, _, k), (_, keys, dists) in zip(args, fanout(partial(search_index, threads=self._threads,
+                                                                    params=self._params), args)):
+            self._add_matches(idx, k, keys, dists)
+
+    def _add_matches(self, idx, k, keys, dists):
+        self._fetched[idx] = k
+        seen = self._seen[idx]
+        passed = np.ones(len(keys), dtype=bool)
+        if self._predicate and idx in cache['metadata']:
+            passed = self._predicate(cache['metadata'][idx], keys)
+        for key, dist, ok in zip(keys.tolist(), dists.tolist(), passed.tolist()):
+            if dist > self._max_dist:
+                break
+            if ok and key not in seen:
+                seen.add(key)
+                heapq.heappush(self._pending, (dist, idx, key))
+        if len(keys):
+            self._last_dist[idx] = float(dists[-1])
+        if len(keys) < k or self._last_dist[idx] > self._max_dist:
+            self._exhausted.add(idx)
+
+
+class ResultsCache:
+    """LRU cache of search results whose entries expire after `ttl` seconds.
+
+    A key is a hash of the search parameters and of the exact float32 bytes
+    of the query vector, so that only identical queries share an entry.
+    Clearing the cache starts a new generation; results of searches that
+    began in an earlier generation are not stored.
+    """
+
+    def __init__(self, maxsize=RESULTS_CACHE_SIZE, ttl=RESULTS_CACHE_TTL):
+        self._entries = TTLCache(maxsize=max(maxsize, 1), ttl=ttl)
+        self._enabled = maxsize > 0
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(vector, params):
+        h = hashlib.sha1(np.asarray(vector, dtype='<f4').tobytes())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        if not self._enabled:
+            return None
+        with self._lock:
+            results = self._entries.get(key)
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return results
+
+    def put(self, key, results, generation):
+        if not self._enabled:
+            return
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self._enabled,
+                'size': len(self._entries),
+                'maxsize': self._entries.maxsize,
+                'ttl': self._entries.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None
+            }
+
+
+results_cache = ResultsCache()
+
+
+def open_cursor(qvec, routing=None, min_sim=None, threads=INDEX_THREADS, predicate=None,
+                params=None):
+    cursor = SearchCursor(qvec, select_indexes(routing or {}), min_sim, threads, predicate, params)
+    with cursors_lock:
+        now = time.time()
+        for cursor_id in [c for c, cur in cursors.items() if now - cur.touched > CURSOR_TTL]:
+            del cursors[cursor_id]
+        while len(cursors) >= MAX_CURSORS:
+            cursors.popitem(last=False)
+        cursors[cursor.id] = cursor
+    return cursor
+
+
+def get_cursor(cursor_id):
+    with cursors_lock:
+        cursor = cursors.get(cursor_id)
+        if cursor is None or time.time() - cursor.touched > CURSOR_TTL:
+            cursors.pop(cursor_id, None)
+            return None
+        cursors.move_to_end(cursor_id)
+        return cursor
+
+
+def drop_cursor(cursor_id):
+    with cursors_lock:
+        cursors.pop(cursor_id, None)
+
+
+def next_from_cursor(cursor, n, labels=True):
+    results = cursor.next(n)
+    if cursor.done:
+        drop_cursor(cursor.id)
+    return resolve_labels(results) if labels else results
+
+
+def locate(label):
+    """Return the (index id, key) pairs of a label across loaded indexes."""
+    return [(idx, key) for idx in cache['catalog']
+            for key in get_labels(idx).find(label)]
+
+
+def resolve_labels(results):
+    return [(get_label(idx, key), idx, sim) for key, idx, sim in results]
+
+
+def concurrent_search(qvec, n, routing=None, labels=True, threads=INDEX_THREADS,
+                      min_sim=None, predicate=None, params=None):
+    idxs = select_indexes(routing or {})
+    flat = [idx for idx in idxs if flat_indexes and idx in flat_indexes]
+    args = [(idx, qvec, n) for idx in idxs if idx not in flat]
+    if predicate:
+        fn = partial(search_index_filtered, predicate=predicate, threads=threads, params=params)
+    else:
+        fn = partial(search_index, threads=threads, params=params)
+    matches = fanout(fn, args)
+    if flat:
+        found = search_flat(qvec, n, flat, predicate)
+        matches += [(idx, *found[idx][0]) for idx in flat]
+    results = merge_top_n(matches, n, min_sim)
+    return resolve_labels(results) if labels else results
+
+
+def concurrent_search_batch(Q, ns, routings, labels=True, threads=INDEX_THREADS,
+                            predicates=None, params=None):
+    """Search every index once for all the queries (rows of `Q`) that are
+    routed to it, and return the top `ns[i]` triplets of each query.
+
+    Queries with a filter predicate are searched one at a time.
+    """
+    predicates = predicates or [None] * len(Q)
+    selected = [set(select_indexes(routing)) for routing in routings]
+    args, rows_of, flat = [], [], {}
+    for idx in cache['catalog'].keys():
+        rows = [i for i, idxs in enumerate(selected)
+                if idx in idxs and not predicates[i]]
+        if rows and flat_indexes and idx in flat_indexes:
+            flat.setdefault(tuple(rows), []).append(idx)
+        elif rows:
+            args.append((idx, Q[rows], max(ns[r] for r in rows)))
+            rows_of.append(rows)
+
+    per_query = [[] for _ in range(len(Q))]
+    batch_matches = fanout(partial(search_index_batch, threads=threads, params=params), args)
+    for (idx, _, _), rows, matches in zip(args, rows_of, batch_matches):
+        for row, (keys, dists) in zip(rows, matches):
+            per_query[row].append((idx, keys, dists))
+    for rows, idxs in flat.items():   # flat indexes searched by the same queries
+        found = search_flat(Q[list(rows)], max(ns[r] for r in rows), idxs)
+        for idx in idxs:
+            for row, (keys, dists) in zip(rows, found[idx]):
+                per_query[row].append((idx, keys, dists))
+
+    filtered = [(row, idx) for row, idxs in enumerate(selected)
+                if predicates[row] for idx in sorted(idxs)]
+    fn = lambda t: search_index_filtered(t[1:], predicates[t[0]], threads, params)
+    matches = fanout(fn, [(row, idx, Q[row], ns[row]) for row, idx in filtered])
+    for (row, _), match in zip(filtered, matches):
+        per_query[row].append(match)
+
+    output = []
+    for row, matches in enumerate(per_query):
+        results = merge_top_n(matches, ns[row])
+        output.append(resolve_labels(results) if labels else results)
+    return output
+
+
+def encode_frame(meta, array):
+    header = json.dumps(meta).encode('utf-8')
+    header += b' ' * (-(len(header) + 4) % 8)
+    return struct.pack('<I', len(header)) + header + array.tobytes()
+
+
+def decode_frame(buf, dtype):
+    (size,) = struct.unpack_from('<I', buf)
+    meta = json.loads(buf[4:4+size])
+    array = np.frombuffer(buf, dtype=dtype, offset=4+size)
+    return meta, array
+
+
+def encode_results(results, labels=True):
+    index_names = sorted(set(idx for _, idx, _ in results))
+    index_ids = {name: i for i, name in enumerate(index_names)}
+    meta = {'indexes': index_names, 'labels': labels}
+    if labels:
+        encoded = [label.encode('utf-8') for label, _, _ in results]
+        meta['label_bytes'] = max(map(len, encoded), default=1)
+        records = np.empty(len(results), dtype=result_dtype(meta['label_bytes']))
+        records['label'] = encoded
+    else:
+        records = np.empty(len(results), dtype=KEYED_RESULT_DTYPE)
+        records['key'] = [key for key, _, _ in results]
+    records['index'] = [index_ids[idx] for _, idx, _ in results]
+    records['sim'] = [sim for _, _, sim in results]
+    return encode_frame(meta, records)
+
+
+def encode_batch_results(list_of_results, labels=True):
+    """Encode the results of many queries as one frame, concatenated in query
+    order; the header's `counts` tells where each query's results end.
+    """
+    results = list(itertools.chain.from_iterable(list_of_results))
+    frame = encode_results(results, labels)
+    meta, records = decode_frame(frame, np.uint8)
+    meta['counts'] = [len(r) for r in list_of_results]
+    return encode_frame(meta, records)
+
+
+class SearchResults:
+    """Results of a vector search, held as (id, index, similarity) arrays.
+
+    Ids are labels, or numeric keys into the indexes' labels when the search
+    was made with `labels: false`. Binary responses are decoded without
+    copying: `ids`, `indexes` and `sims` are views into the response buffer.
+    Iterating yields the `[id, index_id, sim]` triplets of the JSON format.
+    """
+
+    def __init__(self, ids, indexes, sims, index_names, keyed=False):
+        self.ids = ids
+        self.indexes = indexes
+        self.sims = sims
+        self.index_names = index_names
+        self.keyed = keyed
+        self.cursor = None  # set for results read from a search cursor
+        self.done = True
+
+    @classmethod
+    def from_frame(cls, buf):
+        results = cls.batch_from_frame(buf)[0]
+        meta, _ = decode_frame(buf, np.uint8)
+        results.cursor = meta.get('cursor')
+        results.done = meta.get('done', True)
+        return results
+
+    @classmethod
+    def from_json(cls, data):
+        if isinstance(data, list):
+            return cls.from_triplets(data)
+        results = cls.from_triplets(data['results'])
+        results.cursor = data['cursor']
+        results.done = data['done']
+        return results
+
+    @classmethod
+    def batch_from_frame(cls, buf):
+        meta, raw = decode_frame(buf, np.uint8)
+        keyed = not meta.get('labels', True)
+        dtype = KEYED_RESULT_DTYPE if keyed else result_dtype(meta.get('label_bytes', BYTES_PER_LABEL))
+        records = raw.view(dtype)
+        ids = records['key'] if keyed else records['label']
+        bounds = np.cumsum([0] + meta.get('counts', [len(records)]))
+        return [cls(ids[a:b], records['index'][a:b], records['sim'][a:b], meta['indexes'], keyed)
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    @classmethod
+    def from_triplets(cls, triplets):
+        triplets = [list(t) for t in triplets]
+        index_names = sorted(set(t[1] for t in triplets))
+        index_ids = {name: i for i, name in enumerate(index_names)}
+        keyed = bool(triplets) and isinstance(triplets[0][0], int)
+        if keyed:
+            ids = np.array([t[0] for t in triplets], dtype='<u8')
+        else:
+            ids = np.array([t[0].encode('utf-8') for t in triplets], dtype='S')
+        indexes = np.array([index_ids[t[1]] for t in triplets], dtype='<u4')
+        sims = np.array([t[2] for t in triplets], dtype='<f4')
+        return cls(ids, indexes, sims, index_names, keyed)
+
+    def above(self, threshold):
+        mask = self.sims > threshold
+        results = SearchResults(self.ids[mask], self.indexes[mask], self.sims[mask],
+                                self.index_names, self.keyed)
+        results.cursor, results.done = self.cursor, self.done
+        return results
+
+    def resolve(self, label_fn):
+        """Replace numeric keys with labels; `label_fn(index_id, key)` must
+        return the label of a key in the given index."""
+        if not self.keyed:
+            return self
+        labels = [label_fn(self.index_names[i], key)
+                  for i, key in zip(self.indexes.tolist(), self.ids.tolist())]
+        ids = np.array([label.encode('utf-8') for label in labels], dtype='S')
+        return SearchResults(ids, self.indexes, self.sims, self.index_names)
+
+    def triplets(self):
+        if self.keyed:
+            ids = self.ids.tolist()
+        else:
+            ids = [label.decode('utf-8').strip() for label in self.ids.tolist()]
+        indexes = [self.index_names[i] for i in self.indexes.tolist()]
+        return [list(t) for t in zip(ids, indexes, self.sims.tolist())]
+
+    def __len__(self):
+        return len(self.sims)
+
+    def __iter__(self):
+        return iter(self.triplets())
 
 
 ############################# FASTAPI APP #############################
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    load_indexes()
+    start_executor()
+    threading.Thread(target=load_indexes, name='load', daemon=True).start()
+    stop_watching = threading.Event()
+    if WATCH_INTERVAL > 0:
+        threading.Thread(target=watch_indexes, args=(stop_watching, WATCH_INTERVAL),
+                         name='watch', daemon=True).start()
+    if RAM_BUDGET > 0:
+        threading.Thread(target=manage_residency, args=(stop_watching, RESIDENCY_INTERVAL),
+                         name='residency', daemon=True).start()
     print("Starting vector search service...")
     yield
     print("Shutting down vector search service...")
+    stop_watching.set()
+    stop_executor()
 
 app = FastAPI(lifespan=lifespan)
 
 def ready() -> bool:
-    try:
-        response = requests.get(f"{ENDPOINT}/health", timeout=2)
-        return response.status_code == 200
-    except requests.ConnectionError:
-        return False
+    return get_client().health()
 
 
 def start():
@@ -124,6 +1420,9 @@ def start():
 
     print("Starting vector search service...")
     cmd = ["uvicorn", "services.vector_search:app", "--port", str(PORT)]
+    if LOCAL_SHARDS > 1:
+        cmd = [sys.executable, "-m", "services.vector_search_coordinator",
+               "--shards", str(LOCAL_SHARDS), "--port", str(PORT)]
     process = subprocess.Popen(cmd, preexec_fn=os.setpgrp)
     time.sleep(2)
 
@@ -136,25 +1435,328 @@ def stop():
         print("Vector search service stopped.")
 
 
+def prepare_request(request_payload: dict, key='vector'):
+    if WIRE_FORMAT == 'json':
+        if isinstance(request_payload[key], np.ndarray):
+            request_payload = {**request_payload, key: request_payload[key].tolist()}
+        return {'json': request_payload}
+
+    meta = {k: v for k, v in request_payload.items() if k != key}
+    vector = np.asarray(request_payload[key], dtype='<f4')
+    meta['shape'] = list(vector.shape)
+    headers = {
+        'Content-Type': BINARY_CONTENT_TYPE,
+        'Accept': BINARY_CONTENT_TYPE
+    }
+    return {'content': encode_frame(meta, vector), 'headers': headers}
+
+
+def parse_response(response):
+    response.raise_for_status()
+    if response.headers.get('content-type') == BINARY_CONTENT_TYPE:
+        return SearchResults.from_frame(response.content)
+    return SearchResults.from_json(response.json())
+
+
+def parse_batch_response(response):
+    response.raise_for_status()
+    if response.headers.get('content-type') == BINARY_CONTENT_TYPE:
+        return SearchResults.batch_from_frame(response.content)
+    return [SearchResults.from_triplets(triplets) for triplets in response.json()]
+
+
+class VectorSearchClient:
+    """Client for the vector search service that keeps a pool of
+    keep-alive connections, so that a search does not pay for a new TCP
+    connection. Failed connections and 502/503/504 responses are retried.
+    """
+
+    def __init__(self, endpoint=ENDPOINT, pool_size=POOL_SIZE, timeout=TIMEOUT, retries=RETRIES):
+        self._endpoint = endpoint
+        self._timeout = timeout
+        retry = Retry(total=retries, backoff_factor=0.1,
+                      status_forcelist=[502, 503, 504], allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def search(self, request_payload: dict):
+        response = self._post("/search", prepare_request(request_payload))
+        return parse_response(response)
+
+    def search_batch(self, request_payload: dict):
+        response = self._post("/search_batch", prepare_request(request_payload, 'vectors'))
+        return parse_batch_response(response)
+
+    def next(self, cursor_id, n_results, labels=True):
+        """Get the next results of a search made with `cursor: true`."""
+        payload = {'cursor': cursor_id, 'n_results': n_results, 'labels': labels}
+        headers = {} if WIRE_FORMAT == 'json' else {'Accept': BINARY_CONTENT_TYPE}
+        response = self._post("/search/next", {'json': payload, 'headers': headers})
+        return parse_response(response)
+
+    def close_cursor(self, cursor_id):
+        self._session.delete(f"{self._endpoint}/search/{cursor_id}", timeout=self._timeout)
+
+    def _post(self, path, kwargs):
+        if 'content' in kwargs:
+            kwargs['data'] = kwargs.pop('content')
+        return self._session.post(f"{self._endpoint}{path}", timeout=self._timeout, **kwargs)
+
+    def health(self) -> bool:
+        try:
+            response = self._session.get(f"{self._endpoint}/health", timeout=2)
+            return response.status_code == 200
+        except requests.RequestException:   # also a 503 while loading, once retried
+            return False
+
+    def close(self):
+        self._session.close()
+
+
+class AsyncVectorSearchClient:
+    """Awaitable counterpart of `VectorSearchClient` for async request
+    handlers. It must be used from a single event loop.
+    """
+
+    def __init__(self, endpoint=ENDPOINT, pool_size=POOL_SIZE, timeout=TIMEOUT, retries=RETRIES):
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        transport = httpx.AsyncHTTPTransport(retries=retries, limits=limits)
+        self._client = httpx.AsyncClient(base_url=endpoint, timeout=timeout, transport=transport)
+
+    async def search(self, request_payload: dict):
+        response = await self._client.post("/search", **prepare_request(request_payload))
+        return parse_response(response)
+
+    async def search_batch(self, request_payload: dict):
+        kwargs = prepare_request(request_payload, 'vectors')
+        response = await self._client.post("/search_batch", **kwargs)
+        return parse_batch_response(response)
+
+    async def health(self) -> bool:
+        try:
+            response = await self._client.get("/health", timeout=2)
+            return response.status_code == 200
+        except httpx.TransportError:
+            return False
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_client = None
+_async_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = VectorSearchClient()
+    return _client
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncVectorSearchClient()
+    return _async_client
+
+
 def send(request_payload: dict):
-    response = requests.post(f"{ENDPOINT}/search", json=request_payload)
-    results = response.json()
-    return results
+    return get_client().search(request_payload)
+
+
+async def send_async(request_payload: dict):
+    return await get_async_client().search(request_payload)
+
+
+def send_batch(request_payload: dict):
+    return get_client().search_batch(request_payload)
+
+
+def send_next(cursor_id, n_results):
+    return get_client().next(cursor_id, n_results)
+
+
+def close_cursor(cursor_id):
+    get_client().close_cursor(cursor_id)
 
 @app.get('/health')
 async def health():
+    """Ready once the indexes are loaded (the ones to preload, in the lazy
+    mode); until then, a 503 response with the loading progress."""
+    status = {**load_status, "opened": len(cache['indexes']), "shard": SHARD}
+    if not indexes_loaded.is_set():
+        return JSONResponse(status_code=503, content={"status": "loading", **status})
+    return {"status": "ok", **status}
+
+
+async def wait_until_loaded():
+    """Hold requests that arrive while the indexes are being loaded, since
+    searching part of them would return incomplete results."""
+    if not indexes_loaded.is_set():
+        if not await run_in_threadpool(indexes_loaded.wait, TIMEOUT):
+            raise HTTPException(status_code=503, detail="Indexes are still being loaded")
+
+
+@app.get('/locate/{label}')
+async def locate_label(label: str):
+    await wait_until_loaded()
+    return await run_in_threadpool(locate, label)
+
+
+@app.get('/residency')
+async def residency_state():
+    await wait_until_loaded()
+    return residency()
+
+
+@app.get('/stats')
+async def stats_report():
+    return stats()
+
+
+@app.get('/cache')
+async def cache_stats():
+    return results_cache.stats()
+
+
+@app.delete('/cache')
+async def clear_cache():
+    results_cache.clear()
     return {"status": "ok"}
 
 
+@app.get('/catalog')
+async def catalog():
+    await wait_until_loaded()
+    return [info.to_dict() for info in cache['catalog'].values()]
+
+
+@app.post('/admin/reload')
+async def reload(request: Request):
+    """Load new and changed index files and unload removed ones, in the
+    background; with `?wait=true`, respond once done with what changed."""
+    await wait_until_loaded()
+    if request.query_params.get('wait') in ['true', '1']:
+        return await run_in_threadpool(reload_indexes)
+    started = start_reload()
+    return JSONResponse(status_code=202, content={'started': started})
+
+
+@app.get('/admin/reload')
+async def reload_state():
+    return reload_status
+
+
 @app.post("/search")
 async def search(request: Request):
-    payload = await request.json()
-    vector = np.array(payload["vector"], dtype=np.float32)
+    await wait_until_loaded()
+    payload, vector = await read_payload(request)
     n = payload.get("n_results", 10)
-    type = payload.get("type", 'patent')
-    results = concurrent_search(vector, n, type)
+    routing = get_routing(payload, payload.get("type", 'patent'))
+    labels = payload.get("labels", True)
+    threads = payload.get("threads", INDEX_THREADS)
+    min_sim = payload.get("min_similarity")
+    predicate = Predicate(payload.get("filters") or {})
+    params = read_params(payload)
+    if payload.get("cursor"):
+        cursor = open_cursor(vector, routing, min_sim, threads, predicate, params)
+        return await cursor_response(request, cursor, n, labels)
+
+    key = ResultsCache.key(vector, [n, routing, labels, min_sim, payload.get("filters"),
+                                    params.to_dict()])
+    results = results_cache.get(key)
+    if results is None:
+        generation = results_cache.generation
+        results = await run_in_threadpool(track_request, concurrent_search, vector, n, routing,
+                                          labels, threads, min_sim, predicate, params)
+        results_cache.put(key, results, generation)
+    if BINARY_CONTENT_TYPE in request.headers.get('accept', ''):
+        return Response(content=encode_results(results, labels), media_type=BINARY_CONTENT_TYPE)
     return JSONResponse(content=results)
 
+
+@app.post("/search/next")
+async def search_next(request: Request):
+    payload = await request.json()
+    cursor = get_cursor(payload["cursor"])
+    if cursor is None:
+        raise HTTPException(status_code=404, detail="Cursor not found or expired")
+    return await cursor_response(request, cursor, payload.get("n_results", 10),
+                                 payload.get("labels", True))
+
+
+@app.delete("/search/{cursor_id}")
+async def delete_cursor(cursor_id: str):
+    drop_cursor(cursor_id)
+    return {"status": "ok"}
+
+
+async def cursor_response(request, cursor, n, labels):
+    results = await run_in_threadpool(track_request, next_from_cursor, cursor, n, labels)
+    if BINARY_CONTENT_TYPE in request.headers.get('accept', ''):
+        meta, records = decode_frame(encode_results(results, labels), np.uint8)
+        meta.update({'cursor': cursor.id, 'done': cursor.done})
+        return Response(content=encode_frame(meta, records), media_type=BINARY_CONTENT_TYPE)
+    return JSONResponse(content={'cursor': cursor.id, 'done': cursor.done, 'results': results})
+
+
+@app.post("/search_batch")
+async def search_batch(request: Request):
+    await wait_until_loaded()
+    payload, vectors = await read_payload(request, 'vectors')
+    vectors = np.atleast_2d(vectors)
+    ns = per_query(payload.get("n_results", 10), len(vectors))
+    types = per_query(payload.get("type", 'patent'), len(vectors))
+    routings = per_query(payload.get("routing"), len(vectors))
+    routings = [get_routing({'routing': r}, t) for r, t in zip(routings, types)]
+    labels = payload.get("labels", True)
+    threads = payload.get("threads", INDEX_THREADS)
+    filters = per_query(payload.get("filters"), len(vectors))
+    predicates = [Predicate(spec or {}) for spec in filters]
+    params = read_params(payload)
+
+    keys = [ResultsCache.key(v, [n, routing, labels, None, spec, params.to_dict()])
+            for v, n, routing, spec in zip(vectors, ns, routings, filters)]
+    results = [results_cache.get(key) for key in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if todo:
+        generation = results_cache.generation
+        found = await run_in_threadpool(track_request, concurrent_search_batch,
+                                        vectors[todo], [ns[i] for i in todo],
+                                        [routings[i] for i in todo], labels, threads,
+                                        [predicates[i] for i in todo], params)
+        for i, r in zip(todo, found):
+            results[i] = r
+            results_cache.put(keys[i], r, generation)
+    if BINARY_CONTENT_TYPE in request.headers.get('accept', ''):
+        frame = encode_batch_results(results, labels)
+        return Response(content=frame, media_type=BINARY_CONTENT_TYPE)
+    return JSONResponse(content=results)
+
+
+async def read_payload(request: Request, key='vector'):
+    if request.headers.get('content-type') == BINARY_CONTENT_TYPE:
+        payload, vector = decode_frame(await request.body(), '<f4')
+        return payload, vector.reshape(payload['shape'])
+    payload = await request.json()
+    vector = np.array(payload[key], dtype=np.float32)
+    return payload, vector
+
+
+def read_params(payload):
+    """Search knobs of a request: a preset name or a dict of knobs, see
+    `core/search_params.py`"""
+    try:
+        return SearchParams.from_spec(payload.get("params"))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def per_query(value, n_queries):
+    return list(value) if isinstance(value, list) else [value] * n_queries
+
 if __name__ == "__main__":
     uvicorn.run(
         "services.vector_search:app",
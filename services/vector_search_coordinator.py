@@ -0,0 +1,403 @@
+"""
+Scatter-gather coordinator for a sharded vector search service
+
+The indexes are partitioned across worker processes, each of them a vector
+search service started with `VECTOR_SEARCH_SHARD=i/N` (see `shard_files` in
+`vector_search.py`). The coordinator serves the same API as a worker: it
+sends each query to the shards that hold a matching index, as told by their
+catalogs, and merges their top results. The latency of every shard is
+reported in the `Server-Timing` header of a response and on `/shards`.
+
+Run the workers and a coordinator on one host with:
+
+    python -m services.vector_search_coordinator --shards 4
+
+or point a coordinator at workers on other hosts with `VECTOR_SEARCH_SHARDS`
+(a comma separated list of endpoints).
+"""
+
+import os
+import sys
+import time
+import heapq
+import asyncio
+import argparse
+import itertools
+import subprocess
+import uuid
+from collections import OrderedDict, deque
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+import httpx
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, Response
+
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+sys.path.append(BASE_DIR)
+from services import vector_search as vs
+from services.vector_search import (
+    BINARY_CONTENT_TYPE,
+    IndexInfo,
+    SearchResults,
+    encode_frame,
+    decode_frame,
+    encode_results,
+    encode_batch_results,
+    read_payload,
+    per_query,
+    get_routing
+)
+
+LATENCY_WINDOW = 1000   # latencies kept per shard for /shards
+CATALOG_TTL = float(os.environ.get('VECTOR_SEARCH_CATALOG_TTL', 30))
+
+shards = []
+cursors = OrderedDict()
+
+
+class Shard:
+    """A worker of the sharded service, with the catalog of the indexes it
+    serves and its recent latencies."""
+
+    def __init__(self, endpoint, timeout=vs.TIMEOUT, pool_size=vs.POOL_SIZE):
+        self.endpoint = endpoint
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        transport = httpx.AsyncHTTPTransport(retries=vs.RETRIES, limits=limits)
+        self._client = httpx.AsyncClient(base_url=endpoint, timeout=timeout, transport=transport)
+        self.catalog = None
+        self._catalog_time = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.errors = 0
+
+    async def load_catalog(self, refresh=False):
+        """Read the shard's catalog, again once it is CATALOG_TTL seconds old
+        since the shard's indexes can be reloaded."""
+        if refresh or self.catalog is None or time.time() - self._catalog_time > CATALOG_TTL:
+            response = await self._client.get('/catalog')
+            response.raise_for_status()
+            self.catalog = [IndexInfo(entry['id'], entry['count'], entry['bytes'])
+                            for entry in response.json()]
+            self._catalog_time = time.time()
+        return self.catalog
+
+    def serves(self, routing):
+        return any(info.matches(routing) for info in self.catalog)
+
+    async def post(self, path, meta, array=None):
+        """POST a binary frame (or JSON if there is no array) and return the
+        response body; raises a 502 error if the shard fails."""
+        if array is None:
+            kwargs = {'json': meta, 'headers': {'Accept': BINARY_CONTENT_TYPE}}
+        else:
+            array = np.ascontiguousarray(array, dtype='<f4')
+            kwargs = {
+                'content': encode_frame({**meta, 'shape': list(array.shape)}, array),
+                'headers': {'Content-Type': BINARY_CONTENT_TYPE, 'Accept': BINARY_CONTENT_TYPE}
+            }
+        start = time.perf_counter()
+        try:
+            response = await self._client.post(path, **kwargs)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.errors += 1
+            raise HTTPException(status_code=502, detail=f'Shard {self.endpoint} failed: {e}')
+        self.latencies.append(time.perf_counter() - start)
+        return response.content
+
+    async def health(self):
+        try:
+            response = await self._client.get('/health', timeout=2)
+            return response.status_code == 200
+        except httpx.TransportError:
+            return False
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        p50, p95 = np.percentile(latencies, [50, 95]) if len(latencies) else (None, None)
+        return {
+            'endpoint': self.endpoint,
+            'indexes': None if self.catalog is None else len(self.catalog),
+            'vectors': None if self.catalog is None else sum(i.count for i in self.catalog),
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'p50_ms': None if p50 is None else float(p50),
+            'p95_ms': None if p95 is None else float(p95)
+        }
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+async def select_shards(routing):
+    await asyncio.gather(*[shard.load_catalog() for shard in shards])
+    return [shard for shard in shards if shard.serves(routing)]
+
+
+async def scatter(targets, path, meta, array=None):
+    """Send the same request to `targets`; returns their response bodies
+    and the latency of each shard in ms."""
+    starts = time.perf_counter()
+    timed = []
+
+    async def call(shard):
+        body = await shard.post(path, meta, array)
+        timed.append((shard, (time.perf_counter() - starts) * 1000))
+        return body
+
+    bodies = await asyncio.gather(*[call(shard) for shard in targets])
+    timings = {shards.index(shard): ms for shard, ms in timed}
+    return bodies, timings
+
+
+def merge(list_of_results, n):
+    """Merge per-shard result triplets, each in order of similarity."""
+    merged = heapq.merge(*[results.triplets() for results in list_of_results],
+                         key=lambda t: -t[2])
+    return list(itertools.islice(merged, n))
+
+
+def server_timing(timings):
+    return ', '.join(f'shard{i};dur={ms:.1f}' for i, ms in sorted(timings.items()))
+
+
+def respond(request, results, labels, timings, meta=None):
+    headers = {'Server-Timing': server_timing(timings)}
+    if BINARY_CONTENT_TYPE in request.headers.get('accept', ''):
+        frame = encode_results(results, labels)
+        if meta:
+            frame_meta, records = decode_frame(frame, np.uint8)
+            frame = encode_frame({**frame_meta, **meta}, records)
+        return Response(content=frame, media_type=BINARY_CONTENT_TYPE, headers=headers)
+    content = results if meta is None else {**meta, 'results': results}
+    return JSONResponse(content=content, headers=headers)
+
+
+class ShardedCursor:
+    """A search cursor over the cursors of the shards: their batches, each in
+    order of similarity, are merged as streams, fetching the next batch of a
+    shard only once everything it delivered so far has been merged."""
+
+    def __init__(self, targets):
+        self.id = uuid.uuid4().hex
+        self._cursors = {}
+        self._buffers = {shard: deque() for shard in targets}
+        self._done = {shard: False for shard in targets}
+        self.touched = time.time()
+
+    @property
+    def done(self):
+        return all(self._done.values()) and not any(self._buffers.values())
+
+    def add(self, shard, body):
+        results = SearchResults.from_frame(body)
+        self._cursors[shard] = results.cursor
+        self._done[shard] = results.done
+        self._buffers[shard].extend(results.triplets())
+
+    async def next(self, n, labels=True):
+        self.touched = time.time()
+        batch, timings = [], {}
+        while len(batch) < n:
+            empty = [s for s, buffer in self._buffers.items()
+                     if not buffer and not self._done[s]]
+            if empty:
+                meta = {'n_results': n - len(batch), 'labels': labels}
+                bodies = await asyncio.gather(*[
+                    s.post('/search/next', {**meta, 'cursor': self._cursors[s]}) for s in empty])
+                for shard, body in zip(empty, bodies):
+                    self.add(shard, body)
+                    timings[shards.index(shard)] = shard.latencies[-1] * 1000
+            heads = [s for s, buffer in self._buffers.items() if buffer]
+            if not heads:
+                break
+            shard = max(heads, key=lambda s: self._buffers[s][0][2])
+            batch.append(self._buffers[shard].popleft())
+        return batch, timings
+
+    async def close(self):
+        for shard, cursor_id in self._cursors.items():
+            if not self._done[shard]:
+                await shard._client.delete(f'/search/{cursor_id}')
+
+
+def store_cursor(cursor):
+    now = time.time()
+    for cursor_id in [c for c, cur in cursors.items() if now - cur.touched > vs.CURSOR_TTL]:
+        del cursors[cursor_id]
+    while len(cursors) >= vs.MAX_CURSORS:
+        cursors.popitem(last=False)
+    cursors[cursor.id] = cursor
+
+
+############################# FASTAPI APP #############################
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    endpoints = [e.strip() for e in os.environ.get('VECTOR_SEARCH_SHARDS', '').split(',')]
+    shards.extend(Shard(endpoint) for endpoint in endpoints if endpoint)
+    print(f"Starting vector search coordinator for {len(shards)} shards...")
+    yield
+    print("Shutting down vector search coordinator...")
+    for shard in shards:
+        await shard.aclose()
+    shards.clear()
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get('/health')
+async def health():
+    healthy = await asyncio.gather(*[shard.health() for shard in shards])
+    if not shards or not all(healthy):
+        raise HTTPException(status_code=503, detail="Shards are not ready")
+    return {"status": "ok", "shards": len(shards)}
+
+
+@app.get('/shards')
+async def shards_stats():
+    return [shard.stats() for shard in shards]
+
+
+@app.get('/stats')
+async def stats():
+    """The `/stats` of every shard, with the coordinator's view of its
+    latency."""
+    async def shard_stats(shard):
+        response = await shard._client.get('/stats')
+        response.raise_for_status()
+        return {**shard.stats(), **response.json()}
+    return await asyncio.gather(*[shard_stats(shard) for shard in shards])
+
+
+@app.get('/catalog')
+async def catalog():
+    await select_shards({})
+    return [{**info.to_dict(), 'shard': i}
+            for i, shard in enumerate(shards) for info in shard.catalog]
+
+
+@app.post('/admin/reload')
+async def reload(request: Request):
+    """Reload the indexes of every shard, see `reload` in vector_search.py"""
+    async def reload_shard(shard):
+        response = await shard._client.post('/admin/reload', params=request.query_params)
+        response.raise_for_status()
+        await shard.load_catalog(refresh=True)
+        return response.json()
+    return await asyncio.gather(*[reload_shard(shard) for shard in shards])
+
+
+@app.get('/locate/{label}')
+async def locate_label(label: str):
+    async def locate(shard):
+        response = await shard._client.get(f'/locate/{label}')
+        response.raise_for_status()
+        return response.json()
+    found = await asyncio.gather(*[locate(shard) for shard in shards])
+    return list(itertools.chain.from_iterable(found))
+
+
+@app.post("/search")
+async def search(request: Request):
+    payload, vector = await read_payload(request)
+    payload.pop('vector', None)
+    payload.pop('shape', None)
+    n = payload.get("n_results", 10)
+    labels = payload.get("labels", True)
+    targets = await select_shards(get_routing(payload, payload.get("type", 'patent')))
+
+    if payload.get("cursor"):
+        cursor = ShardedCursor(targets)
+        bodies, timings = await scatter(targets, "/search", payload, vector)
+        for shard, body in zip(targets, bodies):
+            cursor.add(shard, body)
+        results, more_timings = await cursor.next(n, labels)
+        timings.update(more_timings)
+        if not cursor.done:
+            store_cursor(cursor)
+        return respond(request, results, labels, timings, {'cursor': cursor.id, 'done': cursor.done})
+
+    bodies, timings = await scatter(targets, "/search", payload, vector)
+    results = merge([SearchResults.from_frame(body) for body in bodies], n)
+    return respond(request, results, labels, timings)
+
+
+@app.post("/search/next")
+async def search_next(request: Request):
+    payload = await request.json()
+    cursor = cursors.get(payload["cursor"])
+    if cursor is None or time.time() - cursor.touched > vs.CURSOR_TTL:
+        cursors.pop(payload["cursor"], None)
+        raise HTTPException(status_code=404, detail="Cursor not found or expired")
+    labels = payload.get("labels", True)
+    results, timings = await cursor.next(payload.get("n_results", 10), labels)
+    if cursor.done:
+        cursors.pop(cursor.id, None)
+    return respond(request, results, labels, timings, {'cursor': cursor.id, 'done': cursor.done})
+
+
+@app.delete("/search/{cursor_id}")
+async def delete_cursor(cursor_id: str):
+    cursor = cursors.pop(cursor_id, None)
+    if cursor is not None:
+        await cursor.close()
+    return {"status": "ok"}
+
+
+@app.post("/search_batch")
+async def search_batch(request: Request):
+    payload, vectors = await read_payload(request, 'vectors')
+    payload.pop('vectors', None)
+    payload.pop('shape', None)
+    vectors = np.atleast_2d(vectors)
+    ns = per_query(payload.get("n_results", 10), len(vectors))
+    labels = payload.get("labels", True)
+    types = per_query(payload.get("type", 'patent'), len(vectors))
+    routings = per_query(payload.get("routing"), len(vectors))
+    routings = [get_routing({'routing': r}, t) for r, t in zip(routings, types)]
+    targets = set()
+    for routing in routings:
+        targets.update(await select_shards(routing))
+    targets = [shard for shard in shards if shard in targets]
+
+    bodies, timings = await scatter(targets, "/search_batch", payload, vectors)
+    per_shard = [SearchResults.batch_from_frame(body) for body in bodies]
+    results = [merge([batches[row] for batches in per_shard], ns[row])
+               for row in range(len(vectors))]
+    headers = {'Server-Timing': server_timing(timings)}
+    if BINARY_CONTENT_TYPE in request.headers.get('accept', ''):
+        frame = encode_batch_results(results, labels)
+        return Response(content=frame, media_type=BINARY_CONTENT_TYPE, headers=headers)
+    return JSONResponse(content=results, headers=headers)
+
+
+def run_local(n_shards, port=vs.PORT):
+    """Run `n_shards` workers on the ports after `port` and a coordinator
+    for them on `port`."""
+    workers = []
+    endpoints = []
+    for i in range(n_shards):
+        worker_port = port + 1 + i
+        env = {**os.environ, 'VECTOR_SEARCH_SHARD': f'{i}/{n_shards}', 'VECTOR_SEARCH_LOCAL_SHARDS': '1'}
+        cmd = ["uvicorn", "services.vector_search:app", "--port", str(worker_port)]
+        workers.append(subprocess.Popen(cmd, env=env, cwd=BASE_DIR))
+        endpoints.append(f'http://{vs.HOST}:{worker_port}')
+    os.environ['VECTOR_SEARCH_SHARDS'] = ','.join(endpoints)
+    try:
+        uvicorn.run(app, host=vs.HOST, port=port, access_log=False)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sharded vector search service')
+    parser.add_argument('--shards', type=int, default=vs.LOCAL_SHARDS)
+    parser.add_argument('--port', type=int, default=vs.PORT)
+    args = parser.parse_args()
+    run_local(args.shards, args.port)
@@ -161,6 +161,21 @@ class TestSearchRequest102Class(unittest.TestCase):
         results_b = self.search({ 'q': self.query, 'n': 10, 'offset': 5})
         self.assertEqual(results_a[5:], results_b[:5])
 
+    def test_family_member_across_batches(self):
+        req = SearchRequest102({ 'q': self.query })
+        first = ['US9876543B2', '2019.patent', 0.9]
+        last = ['CN109876543A', '2019.patent', 0.8]
+        batch = [['US1234567B2', '2019.patent', 0.8], ['EP1234567A1', '2019.patent', 0.7]]
+        results = [first, last]
+        self.assertEqual(batch, req._after_last(last, batch, results))
+        self.assertEqual([first], results)
+
+        last = ['US1234567B2', '2019.patent', 0.8]
+        batch = [['CN109876543A', '2019.patent', 0.8], ['EP1234567A1', '2019.patent', 0.7]]
+        results = [first, last]
+        self.assertEqual(batch[1:], req._after_last(last, batch, results))
+        self.assertEqual([first, last], results)
+
     def search(self, req):
         req = SearchRequest102(req)
         results = req.serve()['results']
@@ -0,0 +1,83 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+import usearch.index
+
+from pathlib import Path
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+
+import sys
+sys.path.append(BASE_DIR)
+
+from core.index_builder import IndexBuilder
+from core.manifest import Manifest
+
+
+class SourceError(Exception):
+	pass
+
+
+class TestIndexBuilder(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.vectors = np.random.default_rng(0).normal(size=(250, 16)).astype(np.float32)
+		self.docs = [(i, f'US{i}', str(i)) for i in range(250)]
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def source(self, fail_at=None):
+		def batches(token):
+			start = 0 if token is None else token + 1
+			for i in range(start, len(self.docs), 20):
+				if fail_at is not None and i >= fail_at:
+					raise SourceError()
+				yield self.docs[i:i+20]
+		return batches
+
+	def encode(self, texts):
+		return self.vectors[[int(t) for t in texts]]
+
+	def builder(self):
+		return IndexBuilder('2020.patent', self.tmp.name, chunk_size=50).start()
+
+	def test_resumes_after_failure(self):
+		with self.assertRaises(SourceError):
+			self.builder().embed(self.source(fail_at=120), self.encode, workers=2)
+		builder = self.builder()
+		self.assertEqual(120, builder.state['count'])
+		builder.embed(self.source(), self.encode, workers=2)
+		self.assertEqual([f'US{i}' for i in range(250)], builder.labels())
+		X = np.concatenate(list(builder.chunks()))
+		expected = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+		self.assertTrue(np.allclose(expected, X, atol=1e-6))
+
+	def test_builds_indexes_in_manifest(self):
+		builder = self.builder()
+		builder.embed(self.source(), self.encode, workers=2)
+		builder.build(['usearch', 'annoy'], dtype='f32', trees=4)
+		builder.finish()
+		manifest = Manifest.read(self.tmp.name)
+		self.assertEqual(250, manifest.get('2020.patent', ['usearch'])['count'])
+		self.assertEqual(16, manifest.get('2020.patent', ['annoy'])['dims'])
+
+	def test_usearch_indexes_keep_full_precision(self):
+		builder = self.builder()
+		builder.embed(self.source(), self.encode, workers=2)
+		builder.build(['usearch'])
+		meta = usearch.index.Index.metadata(f'{self.tmp.name}/2020.patent.usearch')
+		self.assertEqual('f32', meta['kind_scalar'].name.lower())
+		self.assertFalse(os.path.exists(f'{self.tmp.name}/2020.patent.vectors.npy'))
+
+	def test_quantized_usearch_indexes_come_with_vectors(self):
+		builder = self.builder()
+		builder.embed(self.source(), self.encode, workers=2)
+		builder.build(['usearch'], dtype='bf16')
+		vectors = np.load(f'{self.tmp.name}/2020.patent.vectors.npy')
+		self.assertTrue(np.array_equal(np.concatenate(list(builder.chunks())), vectors))
+
+
+if __name__ == '__main__':
+	unittest.main()
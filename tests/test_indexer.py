@@ -0,0 +1,59 @@
+import unittest
+import tempfile
+
+from pathlib import Path
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+
+import sys
+sys.path.append(BASE_DIR)
+
+from core.indexer import Resharder, fanout_report
+from core.manifest import Manifest, parse_index_name
+
+
+def entry(index_id, count):
+	return {'id': index_id, 'backend': 'usearch', 'file': f'{index_id}.usearch',
+			'count': count, **parse_index_name(index_id)}
+
+
+class TestResharder(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.manifest = Manifest(self.tmp.name, [
+			entry('2019.patent', 300), entry('2020.patent', 500),
+			entry('H04W.2020.patent', 120), entry('H04L.2020.patent', 80),
+			entry('2020.npl', 90)])
+		self.manifest.save()
+		self.resharder = Resharder(self.tmp.name)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_merges_partitions(self):
+		shards = self.resharder.plan(years=5)
+		self.assertEqual(['2019.patent', '2020.npl', '2020.patent'],
+						 sorted(s['id'] for s in shards))
+		merged = [s for s in shards if s['id'] == '2020.patent'][0]
+		self.assertEqual(700, merged['count'])
+
+	def test_splits_to_target_size(self):
+		shards = self.resharder.plan(by='class', target_size=250)
+		for shard in shards:
+			self.assertLessEqual(shard['count'], 250)
+			self.assertEqual(shard['count'], sum(end - start for _, start, end in shard['parts']))
+		self.assertEqual(1090, sum(s['count'] for s in shards))
+		self.assertIn('H04.2020.patent', [s['id'] for s in shards])
+		self.assertEqual(len(shards), len({s['id'] for s in shards}))
+
+	def test_fanout_report(self):
+		shards = self.resharder.plan()
+		after = Manifest(self.tmp.name, [entry(s['id'], s['count']) for s in shards])
+		rows = {row['query']: row for row in fanout_report(self.manifest, after)}
+		self.assertEqual(5, rows['all indexes']['before'])
+		self.assertEqual(2, rows['all indexes']['after'])
+		self.assertEqual(4, rows['type=patent']['reduction'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,5 +1,12 @@
 import unittest
+import tempfile
+import shutil
+import threading
+import json
+import faiss
+import usearch.index
 import numpy as np
+from unittest import mock
 
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
@@ -19,6 +26,9 @@ sys.path.append(BASE_DIR)
 from core.indexes import Index, IndexesDirectory
 from core.indexes import AnnoyIndexReader, AnnoyIndex
 from core.indexes import FaissIndexReader, FaissIndex
+from core.indexes import FlatIndex, IndexCache
+from core.indexes import USearchIndexReader
+from core.labels import write_labels
 from core.query import VectorQuery
 from config.config import indexes_dir
 
@@ -77,6 +87,275 @@ class TestFaissIndexClass(unittest.TestCase):
 		self.assertEqual(n_results, len(results))
 
 
+class TestFlatIndex(unittest.TestCase):
+
+	def setUp(self):
+		self.vectors = np.random.default_rng(0).normal(size=(100, 16))
+		self.index = FlatIndex(self.vectors, lambda i: f'doc{i}', 'flat')
+
+	def test_finds_exact_neighbours(self):
+		results = self.index.search(self.vectors[7], 3)
+		self.assertEqual('doc7', results[0][0])
+		self.assertAlmostEqual(0.0, results[0][1], places=5)
+		self.assertEqual(3, len(results))
+
+	def test_search_many(self):
+		ids, dists = self.index.search_many(self.vectors[[3, 5]], 4)
+		self.assertEqual(['doc3', 'doc5'], [row[0] for row in ids])
+		self.assertEqual([4, 4], [len(row) for row in dists])
+		self.assertTrue(all(np.all(np.diff(row) >= 0) for row in dists))
+
+	def test_read_faiss_index_as_flat(self):
+		index_file = f'{indexes_dir}/B68G.abs.faiss'
+		json_file = f'{indexes_dir}/B68G.abs.items.json'
+		index = FaissIndexReader().read_from_files(index_file, json_file)
+		self.assertRaises(RuntimeError, index.to_flat)	# OPQ transformed
+
+
+class TestQuantizedUSearchIndex(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		rng = np.random.default_rng(0)
+		centers = rng.normal(size=(20, 64))
+		self.X = centers[rng.integers(20, size=2000)] + rng.normal(scale=0.3, size=(2000, 64))
+		self.X = self.X.astype(np.float32)
+		self.Q = centers[rng.integers(20, size=50)] + rng.normal(scale=0.3, size=(50, 64))
+		X = self.X / np.linalg.norm(self.X, axis=1, keepdims=True)
+		self.truth = [[str(i) for i in np.argsort(-(X @ q))[:10]] for q in self.Q]
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def read(self, dtype, rescored):
+		path = f'{self.tmp.name}/{dtype}'
+		index = usearch.index.Index(ndim=64, metric='cos', dtype=dtype)
+		index.add(np.arange(len(self.X)), self.X)
+		index.save(f'{path}.usearch')
+		write_labels(f'{path}.items.bin', [str(i) for i in range(len(self.X))])
+		if rescored:
+			np.save(f'{path}.vectors.npy', self.X)
+		return USearchIndexReader(64, 'cos').read_from_files(f'{path}.usearch', f'{path}.items.bin')
+
+	def exact_rankings(self, index):
+		ids, _ = index.search_many(self.Q, 10)
+		return sum(found == expected for found, expected in zip(ids, self.truth))
+
+	def test_rescoring_restores_f32_ranking(self):
+		for dtype in ['i8', 'bf16']:
+			rescored = self.read(dtype, True)
+			for q, expected in zip(self.Q, self.truth):
+				self.assertEqual(expected, [label for label, _ in rescored.search(q, 10)])
+			self.assertEqual(len(self.Q), self.exact_rankings(rescored))
+
+	def test_quantized_ranking_differs_without_rescoring(self):
+		for dtype in ['i8', 'bf16']:
+			self.assertLess(self.exact_rankings(self.read(dtype, False)), len(self.Q) // 2)
+
+
+class TestFaissHNSWSearch(unittest.TestCase):
+
+	def setUp(self):
+		X = np.random.default_rng(0).normal(size=(500, 16)).astype(np.float32)
+		X /= np.linalg.norm(X, axis=1, keepdims=True)
+		self.hnsw = faiss.IndexHNSWFlat(16, 32)
+		self.hnsw.add(X)
+		self.index = FaissIndex(self.hnsw, str, 'hnsw')
+		self.X = X
+
+	def search_in_thread(self, *args):
+		found = []
+		search = threading.Thread(target=lambda: found.append(self.index.search(*args)))
+		search.start()
+		return search, found
+
+	def test_default_search_waits_while_another_efsearch_is_set(self):
+		default = self.hnsw.hnsw.efSearch
+		with self.index._expansion_lock.holding(256):	# as during a high-recall search
+			self.hnsw.hnsw.efSearch = 256
+			search, found = self.search_in_thread(self.X[3], 1)
+			search.join(0.2)
+			self.assertTrue(search.is_alive())
+		search.join(5)
+		self.assertEqual('3', found[0][0][0])
+		self.assertEqual(default, self.hnsw.hnsw.efSearch)
+
+	def test_searches_with_the_same_efsearch_run_together(self):
+		with self.index._expansion_lock.holding(self.hnsw.hnsw.efSearch):
+			search, found = self.search_in_thread(self.X[3], 1)
+			search.join(5)
+		self.assertEqual('3', found[0][0][0])
+
+	def test_search_with_another_efsearch(self):
+		default = self.hnsw.hnsw.efSearch
+		results = self.index.search(self.X[3], 5, {'expansion': 256})
+		self.assertEqual('3', results[0][0])
+		self.assertEqual(256, self.hnsw.hnsw.efSearch)
+		self.index.search(self.X[3], 5)
+		self.assertEqual(default, self.hnsw.hnsw.efSearch)
+
+
+class TestFaissIndexDeltas(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.X = np.random.default_rng(0).normal(size=(120, 16)).astype(np.float32)
+		faiss.normalize_L2(self.X)
+		base = faiss.IndexFlatL2(16)
+		base.add(self.X[:100])
+		faiss.write_index(base, f'{self.tmp.name}/2020.patent.faiss')
+		with open(f'{self.tmp.name}/2020.patent.items.json', 'w') as f:
+			json.dump([f'US{i}' for i in range(100)], f)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def read(self):
+		return FaissIndexReader().read_from_files(f'{self.tmp.name}/2020.patent.faiss',
+			f'{self.tmp.name}/2020.patent.items.json', '2020.patent')
+
+	def top(self, index, i):
+		return index.search(self.X[i], 1)[0][0]
+
+	def test_added_and_deleted_vectors_survive_reload(self):
+		index = self.read()
+		index.add_vectors(self.X[100:], [f'US{i}' for i in range(100, 120)])
+		index.delete(['US3', 'US110'])
+		index = self.read()
+		self.assertEqual('US105', self.top(index, 105))
+		self.assertNotEqual('US3', self.top(index, 3))
+		self.assertNotEqual('US110', self.top(index, 110))
+
+	def test_compaction_merges_deltas(self):
+		index = self.read()
+		index.add_vectors(self.X[100:], [f'US{i}' for i in range(100, 120)])
+		index.delete(['US3'])
+		index.add_vectors(self.X[3:4], ['US3'])
+		index.compact()
+		self.assertEqual(121, index._index.ntotal)	# with the dead US3, below max_dead_ratio
+		self.assertEqual(120, index.count())
+		self.assertEqual(120, self.read().count())
+		self.assertEqual('US3', self.top(self.read(), 3))
+
+	def test_count_leaves_out_deleted_vectors(self):
+		index = self.read()
+		index.delete(['US3', 'US5'])
+		self.assertEqual(98, index.count())
+		index.add_vectors(self.X[100:], [f'US{i}' for i in range(100, 120)])
+		index.delete(['US110'])
+		self.assertEqual(117, index.count())
+		self.assertEqual(117, self.read().count())
+
+	def test_deletions_trigger_compaction(self):
+		index = self.read()
+		index.max_dead_ratio = 0.05
+		index.delete([f'US{i}' for i in range(5)])
+		self.assertIsNone(index._compaction)
+		index.delete(['US5'])
+		index._compaction.join()
+		self.assertEqual(94, index._index.ntotal)
+		self.assertFalse(index._deltas)
+		self.assertEqual(0, index._deltas.hidden)
+		self.assertEqual('US7', self.top(self.read(), 7))
+
+	def test_compaction_drops_dead_ids_past_ratio(self):
+		index = self.read()
+		index.delete(['US3'])
+		index.add_vectors(self.X[100:101], ['US100'])
+		index.compact()
+		self.assertEqual({3}, index._deltas.dead)
+		self.assertEqual(101, index._index.ntotal)
+		index.max_dead_ratio = 0
+		index.compact()
+		self.assertEqual(frozenset(), index._deltas.dead)
+		self.assertEqual(100, index._index.ntotal)
+		index = self.read()
+		self.assertEqual(100, index.count())
+		self.assertEqual('US100', self.top(index, 100))
+		self.assertNotIn('US3', [label for label, _ in index.search(self.X[3], 5)])
+
+	def test_compaction_rebuilds_hnsw_indexes_without_dead_ids(self):
+		hnsw = faiss.IndexHNSWFlat(16, 16)
+		hnsw.add(self.X[:100])
+		faiss.write_index(hnsw, f'{self.tmp.name}/2020.patent.faiss')
+		index = self.read()
+		index.max_dead_ratio = 0
+		index.delete(['US3', 'US50'])
+		index._compaction.join()
+		self.assertEqual(98, index._index.ntotal)
+		index = self.read()
+		self.assertEqual('US99', self.top(index, 99))
+		self.assertNotIn('US3', [label for label, _ in index.search(self.X[3], 5)])
+
+	def compact_until(self, index, step):
+		"""Compact, stopping (as if the process died) at `step`"""
+		def stop(*args, **kwargs):
+			raise KeyboardInterrupt
+		with mock.patch(step, side_effect=stop):
+			self.assertRaises(KeyboardInterrupt, index.compact)
+
+	def test_compaction_stopped_before_its_deltas_is_not_applied(self):
+		index = self.read()
+		index.delete(['US3'])
+		index.add_vectors(self.X[100:101], ['US100'])
+		index.max_dead_ratio = 0
+		self.compact_until(index, 'core.indexes.FaissDeltas.write')
+		index = self.read()
+		self.assertEqual(100, index._index.ntotal)
+		self.assertEqual(1, len(index._deltas.segments))
+		self.assertEqual(100, index.count())
+		self.assertEqual('US100', self.top(index, 100))
+
+	def test_compaction_stopped_before_its_renames_is_finished(self):
+		index = self.read()
+		index.delete(['US3'])
+		index.add_vectors(self.X[100:101], ['US100'])
+		index.max_dead_ratio = 0
+		self.compact_until(index, 'core.indexes._apply_renames')
+		index = self.read()
+		self.assertEqual(100, index._index.ntotal)
+		self.assertFalse(index._deltas)
+		self.assertEqual('US100', self.top(index, 100))
+		self.assertEqual('US99', self.top(index, 99))
+		self.assertNotIn('US3', [label for label, _ in index.search(self.X[3], 5)])
+		self.assertEqual(['2020.patent.deltas.json', '2020.patent.faiss', '2020.patent.items.json',
+						  'manifest.json'], sorted(os.listdir(self.tmp.name)))
+
+	def test_orphan_segment_files_are_removed(self):
+		index = self.read()
+		index.add_vectors(self.X[100:101], ['US100'])
+		for ext in ['.npy', '.items.json']:	# as left by a compaction that stopped
+			shutil.copy(f'{self.tmp.name}/2020.patent.delta-000001{ext}', f'{self.tmp.name}/seg{ext}')
+		index.compact()
+		for ext in ['.npy', '.items.json']:
+			shutil.move(f'{self.tmp.name}/seg{ext}', f'{self.tmp.name}/2020.patent.delta-000001{ext}')
+		index = self.read()
+		self.assertEqual(101, index.count())
+		self.assertFalse([f for f in os.listdir(self.tmp.name) if '.delta-' in f])
+
+
+class TestIndexCache(unittest.TestCase):
+
+	def test_evicts_least_recently_used_beyond_budget(self):
+		cache = IndexCache(budget=100)
+		cache.put('a', 'A', 40)
+		cache.put('b', 'B', 40)
+		cache.get('a')
+		cache.put('c', 'C', 40)
+		self.assertNotIn('b', cache)
+		self.assertEqual(80, cache.nbytes)
+		self.assertEqual(1, cache.evictions)
+
+	def test_loads_once(self):
+		cache = IndexCache()
+		loads = []
+		load = lambda: loads.append(1) or ('A', 10)
+		self.assertEqual('A', cache.get_or_load('a', load))
+		self.assertEqual('A', cache.get_or_load('a', load))
+		self.assertEqual(1, len(loads))
+		self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+
 class TestIndexesDirectory(unittest.TestCase):
 
 	def setUp(self):
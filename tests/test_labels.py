@@ -0,0 +1,62 @@
+import unittest
+import tempfile
+import json
+import os
+
+from pathlib import Path
+TEST_DIR = str(Path(__file__).parent.resolve())
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+
+import sys
+sys.path.append(BASE_DIR)
+
+from core.labels import LabelStore, LabelsDirectory, convert, write_labels
+
+TEST_INDEXES_DIR = f'{TEST_DIR}/test_indexes'
+
+
+class TestLabelStore(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.json_file = f'{TEST_INDEXES_DIR}/Y02T.npl.items.json'
+		with open(self.json_file) as f:
+			self.labels = json.load(f)
+		self.bin_file = convert(self.json_file, f'{self.tmp.name}/Y02T.npl.items.bin')
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_converted_file_has_same_labels(self):
+		store = LabelStore.open(self.bin_file)
+		self.assertEqual(len(self.labels), len(store))
+		self.assertEqual(self.labels, [store[i] for i in range(len(store))])
+
+	def test_find_key_of_label(self):
+		store = LabelStore.open(self.bin_file)
+		self.assertEqual([7], store.find(self.labels[7]))
+		self.assertEqual([], store.find('inexistent'))
+
+	def test_find_without_order_file(self):
+		os.remove(f'{self.tmp.name}/Y02T.npl.items.order')
+		store = LabelStore.open(self.bin_file)
+		self.assertEqual([7], store.find(self.labels[7]))
+
+	def test_reads_fixed_width_bytes(self):
+		store = LabelStore.from_bytes(b'US1234567A1'.ljust(20) + b'EP7654321B1'.ljust(20))
+		self.assertEqual('EP7654321B1', store[1])
+
+
+class TestLabelsDirectory(unittest.TestCase):
+
+	def test_locate_label_across_indexes(self):
+		with tempfile.TemporaryDirectory() as folder:
+			write_labels(f'{folder}/a.items.bin', ['US1A', 'US2A', 'US3A'])
+			write_labels(f'{folder}/b.items.bin', ['US3A', 'US4A'])
+			labels = LabelsDirectory(folder)
+			self.assertEqual([('a', 2), ('b', 0)], labels.locate('US3A'))
+			self.assertEqual('US4A', labels.get('b', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
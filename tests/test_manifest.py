@@ -0,0 +1,90 @@
+import os
+import unittest
+import tempfile
+import shutil
+
+from pathlib import Path
+TEST_DIR = str(Path(__file__).parent.resolve())
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+
+import sys
+sys.path.append(BASE_DIR)
+
+from core.manifest import Manifest, parse_index_name, record
+
+TEST_INDEXES_DIR = f'{TEST_DIR}/test_indexes'
+
+
+class TestManifest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		for ext in ['.faiss', '.items.json']:
+			shutil.copy(f'{TEST_INDEXES_DIR}/B68G.abs{ext}', f'{self.tmp.name}/B68G.abs{ext}')
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_recorded_index_is_read_back(self):
+		entry = record(f'{self.tmp.name}/B68G.abs.faiss')
+		manifest = Manifest.read(self.tmp.name)
+		self.assertEqual({'B68G.abs'}, manifest.ids())
+		self.assertEqual(entry['count'], manifest.get('B68G.abs')['count'])
+		self.assertEqual('faiss', manifest.get('B68G.abs')['backend'])
+		self.assertTrue(manifest.verify('B68G.abs', 'faiss'))
+
+	def test_first_record_keeps_other_indexes(self):
+		for ext in ['.faiss', '.items.json']:
+			shutil.copy(f'{TEST_INDEXES_DIR}/B68G.abs{ext}', f'{self.tmp.name}/2019.patent{ext}')
+		record(f'{self.tmp.name}/B68G.abs.faiss')
+		manifest = Manifest.read(self.tmp.name)
+		self.assertEqual({'B68G.abs', '2019.patent'}, manifest.ids())
+		self.assertEqual('patent', manifest.get('2019.patent')['doc_type'])
+		self.assertIsNotNone(manifest.get('B68G.abs')['count'])
+
+	def test_record_leaves_no_lock_file(self):
+		record(f'{self.tmp.name}/B68G.abs.faiss')
+		self.assertEqual(['B68G.abs.faiss', 'B68G.abs.items.json', 'manifest.json'],
+						 sorted(os.listdir(self.tmp.name)))
+
+	def test_file_added_after_manifest_is_loaded(self):
+		record(f'{self.tmp.name}/B68G.abs.faiss')
+		for ext in ['.faiss', '.items.json']:
+			shutil.copy(f'{TEST_INDEXES_DIR}/B68G.abs{ext}', f'{self.tmp.name}/2019.patent{ext}')
+		self.assertEqual({'B68G.abs'}, Manifest.read(self.tmp.name).ids())
+		manifest = Manifest.load(self.tmp.name)
+		self.assertEqual({'B68G.abs', '2019.patent'}, manifest.ids())
+		self.assertEqual('patent', manifest.get('2019.patent')['doc_type'])
+		self.assertIsNotNone(manifest.get('B68G.abs')['count'])
+
+	def test_removed_file_is_not_loaded(self):
+		for ext in ['.faiss', '.items.json']:
+			shutil.copy(f'{TEST_INDEXES_DIR}/B68G.abs{ext}', f'{self.tmp.name}/2019.patent{ext}')
+		record(f'{self.tmp.name}/B68G.abs.faiss')
+		os.remove(f'{self.tmp.name}/2019.patent.faiss')
+		self.assertEqual({'B68G.abs'}, Manifest.load(self.tmp.name).ids())
+
+	def test_folder_without_manifest(self):
+		self.assertIsNone(Manifest.read(self.tmp.name))
+		manifest = Manifest.from_files(self.tmp.name)
+		self.assertEqual({'B68G.abs'}, manifest.ids())
+
+	def test_find_by_attributes(self):
+		manifest = Manifest(self.tmp.name)
+		for index_id in ['2019.patent', '2020.patent', '2020.npl', 'H04W.npl']:
+			manifest.add({'id': index_id, 'backend': 'usearch', **parse_index_name(index_id)})
+		self.assertEqual({'2020.patent'}, manifest.find(doc_type='patent', years=(2020, None)))
+		self.assertEqual({'2020.npl', 'H04W.npl'}, manifest.find(doc_type='npl', subclass='H04'))
+		self.assertEqual({'2020.npl'}, manifest.find(doc_type='npl', subclass='G06F'))
+		self.assertEqual({'2020.npl', '2020.patent'}, manifest.find(prefix='2020'))
+
+
+class TestParseIndexName(unittest.TestCase):
+
+	def test_parses_years_subclass_and_type(self):
+		attrs = parse_index_name('H04W.2001-2005.npl')
+		self.assertEqual({'doc_type': 'npl', 'years': (2001, 2005), 'subclass': 'H04W'}, attrs)
+
+
+if __name__ == '__main__':
+	unittest.main()
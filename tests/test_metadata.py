@@ -0,0 +1,51 @@
+import unittest
+import tempfile
+
+from pathlib import Path
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+
+import sys
+sys.path.append(BASE_DIR)
+
+from core.metadata import Predicate, doc_to_row, write_columns, open_columns
+
+
+class TestPredicate(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		docs = [
+			{'publicationNumber': 'US7654321B2', 'publicationDate': '2010-02-02',
+			 'filingDate': '2007-05-01', 'priorityDate': '2006-05-01'},
+			{'publicationNumber': 'EP1234567A1', 'publicationDate': '2002-07-17',
+			 'filingDate': '2001-01-10', 'priorityDate': None},
+			{'id': 'ab' * 20, 'year': 2015},
+			None
+		]
+		path = f'{self.tmp.name}/test.meta.npy'
+		write_columns(path, [doc_to_row(doc) for doc in docs])
+		self.columns = open_columns(path)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_empty_predicate_passes_all(self):
+		predicate = Predicate({})
+		self.assertFalse(predicate)
+		self.assertEqual([True] * 4, predicate(self.columns).tolist())
+
+	def test_date_range(self):
+		predicate = Predicate({'publication': ['2005-01-01', None]})
+		self.assertEqual([True, False, True, False], predicate(self.columns).tolist())
+
+	def test_missing_dates_fail(self):
+		predicate = Predicate({'priority': [None, '20200101']})
+		self.assertEqual([True, False, False, False], predicate(self.columns).tolist())
+
+	def test_country_codes_at_keys(self):
+		predicate = Predicate({'cc': ['EP', 'JP']})
+		self.assertEqual([True, False], predicate(self.columns, [1, 0]).tolist())
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -48,6 +48,13 @@ class TestVectorIndexSearcher(unittest.TestCase):
 		results = self.search(self.unitvec, 'Y02T', -1)
 		self.assertCount(0, results)
 
+	def test_search_many_gives_results_of_each_needle(self):
+		indexes = self.indexes.get('Y02T')
+		needles = np.stack([self.unitvec, -self.unitvec])
+		results = self.searcher.search_many(needles, indexes, 10)
+		self.assertEqual(2, len(results))
+		self.assertEqual(self.searcher.search(needles[1], indexes, 10), results[1])
+
 	def search(self, needle, haystack, n):
 		indexes = self.indexes.get(haystack)
 		results = self.searcher.search(needle, indexes, n)
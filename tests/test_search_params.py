@@ -0,0 +1,72 @@
+import unittest
+import threading
+
+from pathlib import Path
+BASE_DIR = str(Path(__file__).parent.parent.resolve())
+
+import sys
+sys.path.append(BASE_DIR)
+
+from core.search_params import SearchParams, SettingLock, PRESETS
+
+
+class TestSearchParams(unittest.TestCase):
+
+	def test_default_keeps_index_settings(self):
+		params = SearchParams.from_spec(None)
+		self.assertEqual({}, params.to_dict())
+
+	def test_preset_by_name(self):
+		params = SearchParams.from_spec('fast')
+		self.assertEqual(PRESETS['fast'], params.to_dict())
+
+	def test_preset_with_overrides(self):
+		params = SearchParams.from_spec({'preset': 'high-recall', 'exact': True, 'nprobe': 4})
+		self.assertTrue(params.exact)
+		self.assertEqual(4, params.nprobe)
+		self.assertEqual(PRESETS['high-recall']['expansion'], params.expansion)
+
+	def test_invalid_spec(self):
+		self.assertRaises(ValueError, SearchParams.from_spec, 'slow')
+		self.assertRaises(ValueError, SearchParams.from_spec, {'ef': 10})
+
+
+class TestSettingLock(unittest.TestCase):
+
+	def setUp(self):
+		self.lock = SettingLock()
+		self.held = []
+
+	def hold(self, value):
+		def run():
+			with self.lock.holding(value):
+				self.held.append(value)
+		thread = threading.Thread(target=run)
+		thread.start()
+		thread.join(0.2)
+		return thread
+
+	def test_same_value_is_held_together(self):
+		with self.lock.holding(64):
+			self.assertFalse(self.hold(64).is_alive())
+		self.assertEqual([64], self.held)
+
+	def test_other_value_waits(self):
+		with self.lock.holding(64):
+			thread = self.hold(256)
+			self.assertEqual([], self.held)
+		thread.join(5)
+		self.assertEqual([256], self.held)
+
+	def test_same_value_waits_behind_other_value(self):
+		with self.lock.holding(64):
+			other = self.hold(256)
+			same = self.hold(64)
+			self.assertTrue(same.is_alive())
+		other.join(5)
+		same.join(5)
+		self.assertCountEqual([256, 64], self.held)
+
+
+if __name__ == '__main__':
+	unittest.main()
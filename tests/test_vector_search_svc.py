@@ -1,5 +1,12 @@
 import os
+import json
+import time
+import tempfile
+import threading
 import unittest
+import numpy as np
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from fastapi.testclient import TestClient
 import sys
 from pathlib import Path
@@ -14,6 +21,13 @@ load_dotenv(BASE_DIR / ".env")
 os.environ['ENVIRONMENT'] = 'test'
 
 from vector_search import app
+from vector_search import BINARY_CONTENT_TYPE, SearchResults, encode_frame
+from vector_search import merge_top_n, IndexInfo, assign_shards, ResultsCache, FlatIndexes
+from vector_search import VectorSearchClient
+import vector_search as vs
+from core.search_params import SearchParams
+from usearch.index import Index as UsearchIndex
+from core.labels import write_labels
 from core.vectorizers import SentBERTVectorizer
 
 vectorizer = SentBERTVectorizer()
@@ -63,6 +77,77 @@ class TestVectorSearch(unittest.TestCase):
             results = response.json()
             self.assertTrue(len(results) >= 25)
         
+    def test__binary_vector_search(self):
+        query = "fire fighting drones"
+        vector = vectorizer.embed(query).astype('float32')
+        with TestClient(app) as client:
+            meta = {"n_results": 10, "type": "patent", "shape": list(vector.shape)}
+            headers = {
+                "Content-Type": BINARY_CONTENT_TYPE,
+                "Accept": BINARY_CONTENT_TYPE
+            }
+            response = client.post("/search", content=encode_frame(meta, vector), headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["content-type"], BINARY_CONTENT_TYPE)
+            results = SearchResults.from_frame(response.content)
+            self.assertTrue(len(results) > 0)
+            for doc_id, index_id, score in results:
+                self.assertIsInstance(doc_id, str)
+                self.assertIn("patent", index_id)
+                self.assertIsInstance(score, float)
+
+            json_response = client.post("/search", json={"vector": vector.tolist(), "n_results": 10})
+            self.assertEqual([r[0] for r in json_response.json()], [r[0] for r in results])
+
+    def test__batch_vector_search(self):
+        queries = ["fire fighting drones", "wireless charging of vehicles"]
+        vectors = [vectorizer.embed(q).tolist() for q in queries]
+        with TestClient(app) as client:
+            payload = {
+                "vectors": vectors,
+                "n_results": [5, 10],
+                "type": ["patent", "npl"]
+            }
+            response = client.post("/search_batch", json=payload)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(2, len(data))
+            self.assertTrue(0 < len(data[0]) <= 5)
+            self.assertTrue(0 < len(data[1]) <= 10)
+            for doc_id, index_id, score in data[1]:
+                self.assertIn("npl", index_id)
+
+            single = client.post("/search", json={"vector": vectors[0], "n_results": 5}).json()
+            self.assertEqual([r[0] for r in single][:5], [r[0] for r in data[0]])
+
+    def test__search_with_cursor(self):
+        vector = vectorizer.embed("fire fighting drones").tolist()
+        with TestClient(app) as client:
+            payload = {"vector": vector, "n_results": 10, "cursor": True}
+            first = client.post("/search", json=payload).json()
+            self.assertEqual(10, len(first["results"]))
+            self.assertFalse(first["done"])
+
+            payload = {"cursor": first["cursor"], "n_results": 10}
+            second = client.post("/search/next", json=payload).json()
+            results = first["results"] + second["results"]
+            self.assertEqual(20, len(set(r[0] for r in results)))
+            for i in range(1, len(results)):
+                self.assertTrue(results[i][2] <= results[i-1][2])
+
+            response = client.delete(f"/search/{first['cursor']}")
+            self.assertEqual(200, response.status_code)
+            response = client.post("/search/next", json=payload)
+            self.assertEqual(404, response.status_code)
+
+    def test__search_with_similarity_floor(self):
+        vector = vectorizer.embed("fire fighting drones").tolist()
+        with TestClient(app) as client:
+            payload = {"vector": vector, "n_results": 100, "min_similarity": 0.5}
+            response = client.post("/search", json=payload)
+            for _, _, score in response.json():
+                self.assertGreaterEqual(score, 0.5)
+
     def assertValidResponse(self, response):
         self.assertEqual(response.status_code, 200)
         data = response.json()
@@ -79,5 +164,534 @@ class TestVectorSearch(unittest.TestCase):
                 self.assertTrue(data[i][2] <= data[i-1][2])
 
 
+class TestWireFormat(unittest.TestCase):
+
+    def test__long_labels_round_trip(self):
+        results = [['US20190123456A1-a-long-label-of-42-bytes', '2019.patent', 0.75],
+                   ['US1B2', '2020.patent', 0.5]]
+        decoded = SearchResults.from_frame(vs.encode_results(results))
+        self.assertEqual([label for label, _, _ in results], [label for label, _, _ in decoded])
+        self.assertEqual([idx for _, idx, _ in results], [idx for _, idx, _ in decoded])
+
+    def test__long_labels_round_trip_in_batches(self):
+        batches = [[['W' * 64, '2019.patent', 0.75]], [], [['US1B2', '2020.patent', 0.5]]]
+        decoded = SearchResults.batch_from_frame(vs.encode_batch_results(batches))
+        self.assertEqual([[r[0] for r in b] for b in batches],
+                         [[r[0] for r in b] for b in decoded])
+
+
+class TestMergeTopN(unittest.TestCase):
+
+    def test__keeps_global_top_n(self):
+        matches = [
+            ('a', np.array([3, 1, 2]), np.array([0.1, 0.4, 0.9])),
+            ('b', np.array([7, 5]), np.array([0.2, 0.3])),
+            ('c', np.array([], dtype=int), np.array([])),
+        ]
+        results = merge_top_n(matches, 4)
+        self.assertEqual([(3, 'a'), (7, 'b'), (5, 'b'), (1, 'a')],
+                         [(key, idx) for key, idx, _ in results])
+        self.assertAlmostEqual(0.9, results[0][2])
+
+    def test__returns_fewer_when_not_enough_matches(self):
+        matches = [('a', np.array([3]), np.array([0.1]))]
+        self.assertEqual(1, len(merge_top_n(matches, 10)))
+
+
+class TestIndexInfo(unittest.TestCase):
+
+    def test__reads_attributes_from_name(self):
+        info = IndexInfo('H04W.2001-2005.npl')
+        self.assertEqual('npl', info.doc_type)
+        self.assertEqual((2001, 2005), info.years)
+        self.assertEqual('H04W', info.subclass)
+
+    def test__routing(self):
+        info = IndexInfo('2019.patent')
+        self.assertTrue(info.matches({}))
+        self.assertTrue(info.matches({'types': ['patent'], 'years': [2015, None]}))
+        self.assertFalse(info.matches({'types': ['npl']}))
+        self.assertFalse(info.matches({'years': [2020, 2022]}))
+        self.assertTrue(info.matches({'subclasses': ['H04W']}))
+        self.assertFalse(IndexInfo('H04W.patent').matches({'subclasses': ['A01B']}))
+
+
+class TestAssignShards(unittest.TestCase):
+
+    def test__balances_bytes(self):
+        sizes = {'2019.patent': 50, '2020.patent': 40, '2021.patent': 30, '2020.npl': 20}
+        assignment = assign_shards(sizes, 2)
+        loads = [sum(sizes[i] for i, s in assignment.items() if s == shard) for shard in [0, 1]]
+        self.assertEqual([70, 70], loads)
+
+    def test__is_deterministic(self):
+        sizes = {f'{year}.patent': 100 for year in range(2000, 2020)}
+        self.assertEqual(assign_shards(sizes, 3), assign_shards(dict(reversed(sizes.items())), 3))
+
+
+class TestResultsCache(unittest.TestCase):
+
+    def test__hit_after_put(self):
+        results_cache = ResultsCache(maxsize=10, ttl=60)
+        key = ResultsCache.key(np.ones(4), [10, {'types': ['patent']}])
+        self.assertIsNone(results_cache.get(key))
+        results_cache.put(key, [['US1', '2020.patent', 0.9]], results_cache.generation)
+        self.assertEqual([['US1', '2020.patent', 0.9]], results_cache.get(key))
+        self.assertEqual((1, 1), (results_cache.hits, results_cache.misses))
+
+    def test__close_vectors_have_different_keys(self):
+        vector = np.random.default_rng(0).normal(size=384).astype(np.float32)
+        nearby = vector.copy()
+        nearby[0] = np.nextafter(nearby[0], np.float32(np.inf))
+        self.assertNotEqual(ResultsCache.key(vector, [10]), ResultsCache.key(nearby, [10]))
+        self.assertEqual(ResultsCache.key(vector, [10]), ResultsCache.key(vector.tolist(), [10]))
+        self.assertNotEqual(ResultsCache.key(vector, [10]), ResultsCache.key(vector, [20]))
+
+    def test__results_of_an_older_generation_are_not_stored(self):
+        results_cache = ResultsCache(maxsize=10, ttl=60)
+        key = ResultsCache.key(np.ones(4), [10])
+        generation = results_cache.generation
+        results_cache.clear()
+        results_cache.put(key, [], generation)
+        self.assertIsNone(results_cache.get(key))
+
+
+
+class TestFlatIndexes(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = {idx: rng.normal(size=(50, 8)).astype(np.float32)
+                        for idx in ['2019.patent', '2020.patent', '2021.patent']}
+        self.flat = FlatIndexes([(idx, np.arange(100, 150), X) for idx, X in self.vectors.items()])
+        self.Q = rng.normal(size=(3, 8)).astype(np.float32)
+
+    def test__finds_exact_top_n(self):
+        found = self.flat.search(self.Q, 5, ['2019.patent', '2021.patent'])
+        self.assertEqual({'2019.patent', '2021.patent'}, set(found))
+        for idx, rows in found.items():
+            X = self.vectors[idx]
+            for q, (keys, dists) in zip(self.Q, rows):
+                sims = (X @ q) / (np.linalg.norm(X, axis=1) * np.linalg.norm(q))
+                self.assertEqual(list(np.argsort(-sims)[:5] + 100), keys.tolist())
+                self.assertTrue(np.all(np.diff(dists) >= 0))
+
+    def test__scans_adjacent_indexes_together(self):
+        runs = self.flat._runs(['2021.patent', '2019.patent', '2020.patent'])
+        self.assertEqual([[0, 150, ['2019.patent', '2020.patent', '2021.patent']]], runs)
+        runs = self.flat._runs(['2019.patent', '2021.patent'])
+        self.assertEqual(2, len(runs))
+
+    def test__returns_fewer_when_index_is_smaller_than_n(self):
+        keys, dists = self.flat.search(self.Q[0], 80, ['2020.patent'])['2020.patent'][0]
+        self.assertEqual(50, len(keys))
+
+
+def write_index(folder, index_id, X, dtype='f32'):
+    """Write a usearch index of the vectors `X` (keys 0, 1, ...) with labels
+    `<index id>-<key>`, as the service reads them."""
+    index = UsearchIndex(ndim=X.shape[1], metric='cos', dtype=dtype)
+    index.add(np.arange(len(X)), X)
+    index.save(f'{folder}/{index_id}.usearch')
+    write_labels(f'{folder}/{index_id}.items.bin', [f'{index_id}-{i}' for i in range(len(X))])
+
+
+def reset_service():
+    """Forget the indexes loaded by the service and what it has counted."""
+    for key in vs.cache:
+        vs.cache[key] = {}
+    for state in [vs.signatures, vs.expansion_locks, vs.latencies, vs.query_counts,
+                  vs.query_scores, vs.query_totals, vs.index_locks]:
+        state.clear()
+    vs.flat_indexes = None
+    vs.indexes_loaded.clear()
+    vs.results_cache.clear()
+
+
+class ServiceTestCase(unittest.TestCase):
+
+    """Runs the service on small indexes written to a temporary folder;
+    `settings` are module settings of the service to change for a test."""
+
+    settings = {}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+        self.rng = np.random.default_rng(0)
+        settings = {'indexes_dir': f'{self.folder}/', **self.settings}
+        self.saved = {name: getattr(vs, name) for name in settings}
+        for name, value in settings.items():
+            setattr(vs, name, value)
+        reset_service()
+
+    def tearDown(self):
+        reset_service()
+        for name, value in self.saved.items():
+            setattr(vs, name, value)
+        self.tmp.cleanup()
+
+    def vectors(self, n, dims=384):
+        return self.rng.normal(size=(n, dims)).astype(np.float32)
+
+
+class TestFanout(ServiceTestCase):
+
+    settings = {'SEARCH_WORKERS': 8, 'FANOUT': 'adaptive', 'FLAT_LIMIT': 0}
+
+    def setUp(self):
+        super().setUp()
+        vs.start_executor(8)
+
+    def tearDown(self):
+        vs.stop_executor()
+        super().tearDown()
+
+    def test__width_follows_index_count(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def task(x):
+            barrier.wait()  # fails unless the 3 tasks run at the same time
+            return x
+
+        self.assertEqual([0, 1, 2], vs.fanout(task, [0, 1, 2]))
+
+    def test__width_follows_load(self):
+        self.assertEqual(8, vs.fanout_width(20))
+        running, peak, lock = [0], [0], threading.Lock()
+
+        def task(x):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return x
+
+        vs.inflight = 4
+        try:
+            self.assertEqual(2, vs.fanout_width(20))
+            self.assertEqual(list(range(20)), vs.fanout(task, list(range(20))))
+            self.assertLessEqual(peak[0], 2)
+        finally:
+            vs.inflight = 0
+
+    def test__matches_serial_search(self):
+        for year in range(2015, 2021):
+            write_index(self.folder, f'{year}.patent', self.vectors(200))
+        vs.load_indexes()
+        q = self.vectors(1)[0]
+        idxs = vs.select_indexes({})
+        serial = vs.merge_top_n([vs.search_index((idx, q, 10)) for idx in idxs], 10)
+        self.assertEqual(serial, vs.concurrent_search(q, 10, labels=False))
+        vs.inflight = 8
+        try:
+            self.assertEqual(serial, vs.concurrent_search(q, 10, labels=False))
+        finally:
+            vs.inflight = 0
+
+
+class TestReload(ServiceTestCase):
+
+    settings = {'RELOAD_GRACE': 0, 'LAZY': False, 'FLAT_LIMIT': 10000}
+
+    def setUp(self):
+        super().setUp()
+        self.X = {idx: self.vectors(50) for idx in ['2019.patent', '2020.patent']}
+        for idx, X in self.X.items():
+            write_index(self.folder, idx, X)
+        vs.load_indexes()
+
+    def top(self, q):
+        return vs.concurrent_search(q, 1)[0][0]
+
+    def test__loads_added_indexes(self):
+        X = self.vectors(50)
+        write_index(self.folder, '2021.patent', X)
+        status = vs.reload_indexes()
+        self.assertEqual(['2021.patent'], status['loaded'])
+        self.assertEqual(['2019.patent', '2020.patent', '2021.patent'], list(vs.cache['catalog']))
+        self.assertIn('2021.patent', vs.flat_indexes)
+        self.assertEqual('2021.patent-7', self.top(X[7]))
+
+    def test__unloads_removed_indexes(self):
+        for ext in ['.usearch', '.items.bin']:
+            os.remove(f'{self.folder}/2019.patent{ext}')
+        status = vs.reload_indexes()
+        self.assertEqual(['2019.patent'], status['removed'])
+        self.assertEqual(['2020.patent'], list(vs.cache['catalog']))
+        self.assertNotIn('2019.patent', vs.flat_indexes)
+        self.assertEqual('2020.patent', vs.concurrent_search(self.X['2019.patent'][0], 1)[0][1])
+        time.sleep(0.2)     # past the grace period
+        self.assertNotIn('2019.patent', vs.cache['indexes'])
+
+    def test__reloads_changed_indexes(self):
+        X = self.vectors(60)
+        write_index(self.folder, '2020.patent', X)
+        status = vs.reload_indexes()
+        self.assertEqual(['2020.patent'], status['loaded'])
+        self.assertEqual(60, vs.cache['catalog']['2020.patent'].count)
+        self.assertEqual(60, len(vs.flat_indexes.block('2020.patent')[0]))
+        self.assertEqual('2020.patent-55', self.top(X[55]))
+
+
+class TestLoading(ServiceTestCase):
+
+    settings = {'LAZY': True, 'PRELOAD': ['2020.*']}
+
+    def setUp(self):
+        super().setUp()
+        for idx in ['2019.patent', '2020.patent']:
+            write_index(self.folder, idx, self.vectors(50))
+
+    def test__health_is_503_until_loaded(self):
+        client = TestClient(app)
+        response = client.get('/health')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('loading', response.json()['status'])
+        vs.load_indexes()
+        response = client.get('/health')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json()['loaded'])
+
+    def test__lazy_index_is_loaded_on_first_use(self):
+        vs.load_indexes()
+        self.assertEqual(['2019.patent', '2020.patent'], list(vs.cache['catalog']))
+        self.assertEqual(['2020.patent'], list(vs.cache['indexes']))
+        results = vs.concurrent_search(self.vectors(1)[0], 5, {'years': [2019, 2019]})
+        self.assertEqual(5, len(results))
+        self.assertIn('2019.patent', vs.cache['indexes'])
+
+
+class TestExpansion(ServiceTestCase):
+
+    settings = {'FLAT_LIMIT': 0, 'LAZY': False, 'RAM_BUDGET': 0}
+
+    def setUp(self):
+        super().setUp()
+        self.X = self.vectors(200)
+        write_index(self.folder, '2020.patent', self.X)
+        with mock.patch.dict(os.environ, {'LOAD_USEARCH_INDEXES_IN_MEMORY': '1'}):
+            vs.load_indexes()
+        self.index = vs.cache['indexes']['2020.patent']
+
+    def search(self, preset='default'):
+        params = SearchParams.from_preset(preset)
+        return vs.search_index(('2020.patent', self.X[7], 5), params=params)[1]
+
+    def test__resident_index_is_searched_with_preset(self):
+        self.assertTrue(vs.cache['catalog']['2020.patent'].resident)
+        default = self.index.expansion_search
+        self.assertEqual(7, self.search('high-recall')[0])
+        self.assertEqual(256, self.index.expansion_search)
+        self.assertIs(self.index, vs.cache['indexes']['2020.patent'])
+        self.assertEqual(7, self.search()[0])
+        self.assertEqual(default, self.index.expansion_search)
+
+    def test__search_waits_while_another_expansion_is_set(self):
+        self.search()
+        lock, _ = vs.expansion_locks['2020.patent']
+        found = []
+        with lock.holding(256):
+            search = threading.Thread(target=lambda: found.append(self.search('fast')))
+            search.start()
+            search.join(0.2)
+            self.assertTrue(search.is_alive())
+        search.join(5)
+        self.assertEqual(7, found[0][0])
+        self.assertEqual(32, self.index.expansion_search)
+
+
+class TestStats(ServiceTestCase):
+
+    settings = {'FLAT_LIMIT': 0, 'LAZY': False}
+
+    def setUp(self):
+        super().setUp()
+        for idx in ['2019.patent', '2020.patent', '2020.npl']:
+            write_index(self.folder, idx, self.vectors(100))
+        vs.load_indexes()
+        vs.start_executor(4)
+
+    def tearDown(self):
+        vs.stop_executor()
+        super().tearDown()
+
+    def test__searches_update_stats(self):
+        client = TestClient(app)
+        before = client.get('/stats').json()
+        for vector in self.vectors(3):
+            payload = {'vector': vector.tolist(), 'n_results': 5, 'type': 'patent'}
+            self.assertEqual(200, client.post('/search', json=payload).status_code)
+        client.post('/search', json=payload)    # answered from the cache
+        after = client.get('/stats').json()
+
+        indexes = {i['id']: i for i in after['indexes']}
+        self.assertEqual(0, sum(i['queries'] for i in before['indexes']))
+        self.assertEqual(3, indexes['2019.patent']['queries'])
+        self.assertEqual(3, indexes['2020.patent']['queries'])
+        self.assertEqual(0, indexes['2020.npl']['queries'])
+        for idx in ['2019.patent', '2020.patent']:
+            self.assertGreater(indexes[idx]['p50_ms'], 0)
+            self.assertGreaterEqual(indexes[idx]['p95_ms'], indexes[idx]['p50_ms'])
+        self.assertIsNone(indexes['2020.npl']['p50_ms'])
+        self.assertEqual(0, after['executor']['queue_depth'])
+        self.assertEqual(0, after['executor']['inflight_requests'])
+        self.assertEqual(1, after['cache']['hits'] - before['cache']['hits'])
+
+    def test__queue_depth_counts_pending_tasks(self):
+        release = threading.Event()
+        futures = [vs.submit(release.wait) for _ in range(6)]
+        self.assertEqual(6, vs.stats()['executor']['queue_depth'])
+        release.set()
+        for future in futures:
+            future.result()
+        self.assertEqual(0, vs.stats()['executor']['queue_depth'])
+
+
+class RacingDict(dict):
+    """Dict that calls `race` once, when it has been read through for a
+    copy, as if another thread changed it right after it was copied."""
+
+    def __init__(self, items, race):
+        super().__init__(items)
+        self.race = race
+
+    def keys(self):
+        keys = list(super().keys())
+        race, self.race = self.race, None
+        if race:
+            race()
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+class TestResidency(ServiceTestCase):
+
+    settings = {'LAZY': False, 'FLAT_LIMIT': 0, 'RAM_BUDGET': 0}
+
+    def setUp(self):
+        super().setUp()
+        for idx in ['2019.patent', '2020.patent', '2021.patent']:
+            write_index(self.folder, idx, self.vectors(100))
+        size = os.path.getsize(f'{self.folder}/2019.patent.usearch')
+        vs.RAM_BUDGET = size + size // 2     # room for one index
+        vs.load_indexes()
+
+    def resident(self):
+        return [idx for idx, info in vs.cache['catalog'].items() if info.resident]
+
+    def test__pins_most_searched_index(self):
+        vs.count_queries('2020.patent', 10)
+        vs.count_queries('2021.patent', 2)
+        vs.update_residency()
+        self.assertEqual(['2020.patent'], self.resident())
+        used = os.path.getsize(f'{self.folder}/2020.patent.usearch')
+        self.assertEqual(used, vs.residency()['used'])
+
+    def test__evicts_when_traffic_moves(self):
+        vs.count_queries('2020.patent', 10)
+        vs.update_residency()
+        vs.count_queries('2021.patent', 10)
+        vs.update_residency()   # 2020.patent keeps 5 * 1.25 against 10
+        self.assertEqual(['2021.patent'], self.resident())
+
+    def test__keeps_resident_index_on_small_changes(self):
+        vs.count_queries('2020.patent', 10)
+        vs.update_residency()
+        vs.count_queries('2021.patent', 6)
+        vs.update_residency()   # 5 * 1.25 against 6
+        self.assertEqual(['2020.patent'], self.resident())
+
+    def test__lazy_load_during_residency_change_is_kept(self):
+        loader = threading.Thread(target=vs.get_index, args=('2019.patent',))
+
+        def race():     # lazy load right after set_residency copied the indexes
+            loader.start()
+            loader.join(0.5)
+
+        indexes = {k: v for k, v in vs.cache['indexes'].items() if k != '2019.patent'}
+        vs.cache['indexes'] = RacingDict(indexes, race)
+        vs.set_residency('2020.patent', True)
+        loader.join()
+        self.assertIn('2019.patent', vs.cache['indexes'])
+        self.assertTrue(vs.cache['catalog']['2020.patent'].resident)
+
+class StubServer:
+    """HTTP/1.1 server on a local port that answers with the statuses in
+    `statuses`, one per request, and then with 200 and `body`."""
+
+    def __init__(self, statuses=(), body=None):
+        self.statuses = list(statuses)
+        self.body = json.dumps(body if body is not None else []).encode('utf-8')
+        self.requests = []  # (method, path, client port) of each request
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(length)
+                stub.requests.append((self.command, self.path, self.client_address[1]))
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(stub.body)))
+                self.end_headers()
+                self.wfile.write(stub.body)
+
+            do_GET = do_POST = do_DELETE = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestVectorSearchClient(unittest.TestCase):
+
+    def test__retries_bad_gateway_and_unavailable(self):
+        server = StubServer([502, 503, 504], [['US1', '2020.patent', 0.9]])
+        client = VectorSearchClient(server.endpoint, retries=3)
+        try:
+            results = client.search({'vector': np.ones(4, dtype=np.float32), 'n_results': 1})
+            self.assertEqual(['US1'], [doc_id for doc_id, _, _ in results])
+            self.assertEqual(4, len(server.requests))
+        finally:
+            client.close()
+            server.close()
+
+    def test__not_healthy_while_loading(self):
+        server = StubServer([503] * 10)
+        client = VectorSearchClient(server.endpoint, retries=1)
+        try:
+            self.assertFalse(client.health())
+        finally:
+            client.close()
+            server.close()
+
+    def test__reuses_connections(self):
+        server = StubServer(body=[['US1', '2020.patent', 0.9]])
+        client = VectorSearchClient(server.endpoint)
+        try:
+            for _ in range(5):
+                client.search({'vector': np.ones(4, dtype=np.float32), 'n_results': 1})
+            self.assertEqual(5, len(server.requests))
+            self.assertEqual(1, len({port for _, _, port in server.requests}))
+        finally:
+            client.close()
+            server.close()
+
+
 if __name__ == '__main__':
     unittest.main()